@@ -1,12 +1,11 @@
 # Diagnostic build to test the wheel installation mechanism.
 import bpy
 import logging
-import threading
 
 from . import properties
 from . import panel
 from . import operators
-from .utils import state, receiver, tasks, tunnel, dependencies
+from .utils import state, tasks, tunnel, dependencies, scheduler, channel, progress, shm, render_queue, encoding, trace
 
 # --- 日志配置 ---
 log = logging.getLogger("bl_ext.user_default.blender_comfyui_bridge")
@@ -23,6 +22,8 @@ classes = (
     properties.BridgeProperties,
     operators.BRIDGE_OT_TestConnection,
     operators.BRIDGE_OT_SendData, # 替换为新的 Operator
+    operators.BRIDGE_OT_SendImageBatch,
+    operators.BRIDGE_OT_CancelJob,
 )
 
 bl_info = {
@@ -70,6 +71,12 @@ def register():
     if not bpy.app.timers.is_registered(tasks.process_task_queue):
         bpy.app.timers.register(tasks.process_task_queue, first_interval=1.0)
         log.info("Task queue processor registered.")
+    # 文件中保存的连接状态在打开文件时重置
+    if tasks.reset_connection_status not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(tasks.reset_connection_status)
+
+    # 渲染完成/取消处理器和渲染队列定时器
+    render_queue.register()
 
     log.info("Addon registration complete.")
 
@@ -79,11 +86,21 @@ def unregister():
     log.info("Unregistering Blender-ComfyUI-Bridge addon...")
 
     # --- 首先停止所有网络活动 ---
+    render_queue.unregister()
+    scheduler.stop_scheduler()
+    channel.stop_channel()
+    progress.stop_subscriber()
+    shm.close_ring()
+    encoding.shutdown()
     tunnel.stop_tunnel()
     state.stop_receiver_server()
+    trace.configure(False)
     
     panel.unregister()
 
+    if tasks.reset_connection_status in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(tasks.reset_connection_status)
+
     # 注销后台任务定时器
     if bpy.app.timers.is_registered(tasks.process_task_queue):
         bpy.app.timers.unregister(tasks.process_task_queue)
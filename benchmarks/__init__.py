@@ -0,0 +1,5 @@
+"""
+不需要 Blender 和 ComfyUI 的传输基准测试，在插件目录中运行，例如:
+
+    python -m benchmarks.result_transfer
+"""
@@ -0,0 +1,208 @@
+"""
+图像传输格式的端到端延迟基准测试：同一张合成图像分别编码为 PNG (8/16 位) 和原始 float16/float32 数组，
+经插件自己的 comms.send_data 发送到本地替身服务器，再按服务器端的方式解码，分别计时编码、发送和解码。
+
+在插件目录中运行:
+
+    python -m benchmarks.encode_latency [--width 1920 --height 1080] [--repeats 5]
+
+EXR 由 Blender 编码，只有在 Blender 中运行时才会测量:
+
+    blender -b --factory-startup --python benchmarks/encode_latency.py -- --repeats 5
+
+服务器端的 PNG 解码在安装了 Pillow 时使用 Pillow (与 ComfyUI 相同)，否则用 zlib 直接解压。
+所有格式都解码到 float32 数组为止，与 ComfyUI 中图像张量的类型一致。
+"""
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import zlib
+import logging
+
+if __name__ == "__main__" and not __package__:
+    # 作为脚本运行 (例如在 Blender 中) 时，插件目录不在 sys.path 中
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import comms, encoding  # noqa: E402
+from utils.replay import StandInServer  # noqa: E402
+
+FORMATS = ("png8", "png16", "raw16", "raw32", "raw16-planar", "exr")
+
+
+def synthetic_pixels(width, height, seed=0):
+    """类似渲染结果的 RGBA float32 像素：平滑渐变加少量噪声 (纯噪声无法压缩，纯色又压缩得过好)。"""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    pixels = np.empty((height, width, 4), dtype=np.float32)
+    pixels[..., 0] = x / width
+    pixels[..., 1] = y / height
+    pixels[..., 2] = 0.5 + 0.5 * np.sin(x / 37.0) * np.cos(y / 23.0)
+    pixels[..., :3] += rng.normal(0.0, 0.02, (height, width, 3)).astype(np.float32)
+    pixels[..., 3] = 1.0
+    return np.clip(pixels, 0.0, 1.0)
+
+
+def _decode_png(data):
+    import numpy as np
+
+    try:
+        from PIL import Image
+    except ImportError:
+        Image = None
+    if Image is not None:
+        import io
+        values = np.asarray(Image.open(io.BytesIO(data)))
+        return values.astype(np.float32) / (65535.0 if values.dtype == np.uint16 else 255.0)
+    # 只适用于 encoding.encode_png 写出的单个 IDAT、不过滤的 PNG
+    width, height = int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+    bit_depth = data[24]
+    length = int.from_bytes(data[33:37], "big")
+    raw = zlib.decompress(data[41:41 + length])
+    rows = np.frombuffer(raw, dtype=np.uint8).reshape(height, -1)[:, 1:]
+    values = rows.view(">u2" if bit_depth == 16 else np.uint8).reshape(height, width, -1)
+    return values.astype(np.float32) / (65535.0 if bit_depth == 16 else 255.0)
+
+
+def _decode_raw(frames, info):
+    import numpy as np
+
+    dtype = np.dtype(info["dtype"]).newbyteorder("<")
+    if info["layout"] == "planar":
+        values = np.stack([np.frombuffer(frame, dtype=dtype).reshape(info["shape"]) for frame in frames], axis=-1)
+    else:
+        values = np.frombuffer(frames[0], dtype=dtype).reshape(info["shape"])
+    return values.astype(np.float32, copy=False)
+
+
+class BlenderExr:
+    """在 Blender 中用图像数据块把像素保存为 EXR，并用 Blender 读回 (代替服务器端的 EXR 解码)。"""
+
+    def __init__(self, pixels):
+        import bpy
+
+        height, width, _ = pixels.shape
+        self.bpy = bpy
+        self.image = bpy.data.images.new("bridge_benchmark", width, height, alpha=True, float_buffer=True)
+        self.image.pixels.foreach_set(pixels.ravel())
+        self.directory = tempfile.mkdtemp(prefix="bridge-bench-")
+
+    def encode(self):
+        path = os.path.join(self.directory, "encode.exr")
+        self.image.filepath_raw = path
+        self.image.file_format = 'OPEN_EXR'
+        self.image.save()
+        with open(path, "rb") as f:
+            return f.read()
+
+    def decode(self, data):
+        import numpy as np
+
+        path = os.path.join(self.directory, "decode.exr")
+        with open(path, "wb") as f:
+            f.write(data)
+        image = self.bpy.data.images.load(path)
+        try:
+            pixels = np.empty(len(image.pixels), dtype=np.float32)
+            image.pixels.foreach_get(pixels)
+            return pixels
+        finally:
+            self.bpy.data.images.remove(image)
+
+    def close(self):
+        self.bpy.data.images.remove(self.image)
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+
+def _codec(name, pixels, exr):
+    """返回 (编码函数 () -> 帧列表, 解码函数 (帧列表) -> 数组)。"""
+    if name in ("png8", "png16"):
+        bit_depth = 16 if name == "png16" else 8
+        return (lambda: [encoding.encode_png(pixels, compression=1, bit_depth=bit_depth)],
+                lambda frames: _decode_png(frames[0]))
+    if name == "exr":
+        return lambda: [exr.encode()], lambda frames: exr.decode(frames[0])
+    dtype = "float16" if name.startswith("raw16") else "float32"
+    planar = name.endswith("planar")
+    info = encoding.describe_raw(pixels, dtype, planar)
+    return lambda: encoding.encode_raw(pixels, dtype, planar), lambda frames: _decode_raw(frames, info)
+
+
+def benchmark(width=1920, height=1080, repeats=5, formats=FORMATS, resumable=True):
+    in_blender = importlib.util.find_spec("bpy") is not None
+    formats = [name for name in formats if name != "exr" or in_blender]
+    pixels = synthetic_pixels(width, height)
+    exr = BlenderExr(pixels) if "exr" in formats else None
+
+    server = StandInServer()
+    server.start()
+    previous = comms.resumable_enabled
+    comms.resumable_enabled = resumable
+    results = {}
+    try:
+        for name in formats:
+            encode, decode = _codec(name, pixels, exr)
+            timings = {"encode": [], "send": [], "decode": [], "total": []}
+            size = 0
+            for index in range(repeats):
+                started = time.perf_counter()
+                frames = encode()
+                encoded = time.perf_counter()
+                payload = frames[0] if len(frames) == 1 else frames
+                metadata = {"type": "render_and_return", "return_info": {"job_id": f"bench-{name}-{index}"}}
+                if not comms.send_data(server.address, metadata, payload, timeout=120000):
+                    raise RuntimeError(f"Sending {name} failed")
+                sent = time.perf_counter()
+                decode(frames)
+                decoded = time.perf_counter()
+                size = sum(len(frame) for frame in frames)
+                for key, seconds in (("encode", encoded - started), ("send", sent - encoded),
+                                     ("decode", decoded - sent), ("total", decoded - started)):
+                    timings[key].append(seconds)
+            results[name] = {"mb": round(size / 1024 / 1024, 2)}
+            results[name].update({f"{key}_ms": round(statistics.median(values) * 1000, 1) for key, values in timings.items()})
+    finally:
+        comms.resumable_enabled = previous
+        server.stop()
+        if exr:
+            exr.close()
+    return results
+
+
+def main(argv=None):
+    if argv is None:
+        # 在 Blender 中运行时，脚本参数位于 "--" 之后
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.encode_latency", description="Compare end-to-end latency of PNG, EXR and raw pixel transport.")
+    parser.add_argument("--width", type=int, default=1920, help="Image width (default: 1920)")
+    parser.add_argument("--height", type=int, default=1080, help="Image height (default: 1080)")
+    parser.add_argument("--repeats", type=int, default=5, help="Runs per format; the median is reported (default: 5)")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS), help="Formats to measure (exr only inside Blender)")
+    parser.add_argument("--no-resumable", action="store_true", help="Send large payloads in one message instead of a resumable upload")
+    parser.add_argument("--report", help="Write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    results = benchmark(args.width, args.height, max(1, args.repeats), args.formats, not args.no_resumable)
+    print(f"{args.width}x{args.height} RGBA, median of {args.repeats} runs")
+    print(f"  {'format':<13}{'MB':>8}{'encode ms':>11}{'send ms':>9}{'decode ms':>11}{'total ms':>10}")
+    for name, result in results.items():
+        print(f"  {name:<13}{result['mb']:>8.2f}{result['encode_ms']:>11.1f}{result['send_ms']:>9.1f}"
+              f"{result['decode_ms']:>11.1f}{result['total_ms']:>10.1f}")
+    if "exr" in args.formats and "exr" not in results:
+        print("  exr: skipped (run inside Blender to measure EXR)")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"arguments": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+本机传输的吞吐量基准测试：同一个替身服务器同时在 tcp:// 和 ipc:// 上监听，
+通过插件自己的 comms.send_data 分别以回环 TCP 和 Unix 域套接字发送不同大小的负载。
+
+在插件目录中运行:
+
+    python -m benchmarks.ipc_throughput [--sizes-mb 16 64 256] [--repeats 3]
+
+默认关闭可续传上传，只比较传输本身；--resumable 时大负载按可续传上传分块发送。
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+import logging
+
+from utils import comms
+from utils.replay import StandInServer, deterministic_payload
+
+
+def _negotiate(address, transport):
+    """按 ping 回复协商传输方式，返回实际使用的端点。"""
+    comms.ipc_enabled = transport == "ipc"
+    if comms.probe(address) is None:
+        raise RuntimeError(f"Stand-in server {address} did not answer the ping")
+    return comms._prepare_address(address)
+
+
+def benchmark(sizes, repeats=3, resumable=False):
+    import zmq
+
+    transports = ["tcp"] + (["ipc"] if zmq.has("ipc") else [])
+    socket_path = os.path.join(tempfile.mkdtemp(prefix="bridge-bench-"), "bridge.sock")
+    server = StandInServer(ipc_path=socket_path if "ipc" in transports else None)
+    server.start()
+    previous = comms.ipc_enabled, comms.resumable_enabled
+    comms.resumable_enabled = resumable
+    results = {}
+    try:
+        for size in sizes:
+            payload = deterministic_payload(size, f"ipc:{size}")
+            for transport in transports:
+                endpoint = _negotiate(server.address, transport)
+                if not endpoint.startswith(f"{transport}://"):
+                    raise RuntimeError(f"Expected a {transport} endpoint, got {endpoint}")
+                timings = []
+                for index in range(repeats):
+                    metadata = {"type": "render_and_return", "return_info": {"job_id": f"bench-{size}-{transport}-{index}"}}
+                    started = time.perf_counter()
+                    if not comms.send_data(server.address, metadata, payload, timeout=120000):
+                        raise RuntimeError(f"Send over {endpoint} failed")
+                    timings.append(time.perf_counter() - started)
+                results.setdefault(f"{size // (1024 * 1024)} MB", {})[transport] = {
+                    "best_seconds": round(min(timings), 4),
+                    "median_seconds": round(statistics.median(timings), 4),
+                    "mb_per_second": round(size / min(timings) / 1024 / 1024, 1),
+                }
+    finally:
+        comms.ipc_enabled, comms.resumable_enabled = previous
+        server.stop()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        os.rmdir(os.path.dirname(socket_path))
+    return transports, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.ipc_throughput", description="Compare loopback TCP and ipc:// throughput to a local server.")
+    parser.add_argument("--sizes-mb", type=int, nargs="+", default=[16, 64, 256], help="Payload sizes in MB (default: 16 64 256)")
+    parser.add_argument("--repeats", type=int, default=3, help="Sends per size and transport (default: 3)")
+    parser.add_argument("--resumable", action="store_true", help="Send large payloads as resumable uploads")
+    parser.add_argument("--report", help="Write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    transports, results = benchmark([size * 1024 * 1024 for size in args.sizes_mb], max(1, args.repeats), args.resumable)
+    if "ipc" not in transports:
+        print("ipc:// is not supported by this libzmq build; only TCP was measured.")
+    for size, by_transport in results.items():
+        line = "  ".join(
+            f"{transport} {result['best_seconds']:.3f} s ({result['mb_per_second']:.0f} MB/s)"
+            for transport, result in by_transport.items()
+        )
+        print(f"{size:>7}  {line}")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"arguments": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+结果回传的基准测试：许多小结果分别用每个结果一个新连接 (HTTP/1.0 的行为)、
+HTTP/1.1 持久连接、分块传输编码和 multipart 批量请求 POST 到插件自己的 HTTP 接收服务，
+计时到所有结果都进入任务队列为止。
+
+在插件目录中运行:
+
+    python -m benchmarks.result_transfer [--count 200] [--size-kb 64] [--batch 16] [--connect-delay-ms 20]
+
+--connect-delay-ms 在接收服务前放一个转发代理，每个新连接先等待指定的毫秒数，
+模拟通过 SSH 反向隧道建立连接的开销。
+"""
+import argparse
+import http.client
+import json
+import queue
+import socket
+import threading
+import time
+import logging
+import uuid
+
+from utils import state, spool
+from utils.receiver import ReceiverService
+from utils.replay import _free_port, deterministic_payload
+
+MODES = ("close", "keep-alive", "chunked", "multipart")
+
+
+class DelayedForwarder:
+    """转发 TCP 连接，每个新连接在连接上游之前先等待 delay 秒。"""
+
+    def __init__(self, upstream_port, delay):
+        self.upstream_port = upstream_port
+        self.delay = delay
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.listen(64)
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._accept_loop, name="DelayedForwarder", daemon=True).start()
+
+    def stop(self):
+        self._listener.close()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._connect, args=(client,), daemon=True).start()
+
+    def _connect(self, client):
+        time.sleep(self.delay)
+        upstream = socket.create_connection(("127.0.0.1", self.upstream_port))
+        for sock in (client, upstream):
+            # 转发本身不应再增加 Nagle 算法的等待
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        for source, target in ((client, upstream), (upstream, client)):
+            threading.Thread(target=self._pump, args=(source, target), daemon=True).start()
+
+    @staticmethod
+    def _pump(source, target):
+        try:
+            while True:
+                data = source.recv(256 * 1024)
+                if not data:
+                    break
+                target.sendall(data)
+        except OSError:
+            pass
+        for sock in (source, target):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class ResultCollector:
+    """取出任务队列中的结果并释放暂存文件，相当于主线程应用结果。"""
+
+    def __init__(self):
+        self.count = 0
+        self._target = None
+        self._done = threading.Event()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="BenchmarkCollector", daemon=True)
+        self._thread.start()
+
+    def expect(self, count):
+        self.count = 0
+        self._target = count
+        self._done.clear()
+
+    def wait(self, timeout):
+        return self._done.wait(timeout)
+
+    def stop(self):
+        self._running = False
+        self._thread.join(timeout=1)
+
+    def _run(self):
+        while self._running:
+            try:
+                image_paths, _, _ = state.task_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            for image_path in image_paths:
+                spool.get_spool().release(image_path)
+            self.count += len(image_paths)
+            if self._target is not None and self.count >= self._target:
+                self._done.set()
+
+
+def _post(connection, body, job_id, headers=None, chunked=False):
+    headers = dict(headers or {}, **{"X-Bridge-Job-Id": job_id})
+    headers.setdefault("Content-Type", "image/png")
+    if chunked:
+        # http.client 对可迭代的请求体使用分块传输编码
+        connection.request("POST", "/", body=iter([body]), headers=headers, encode_chunked=True)
+    else:
+        connection.request("POST", "/", body=body, headers=headers)
+    response = connection.getresponse()
+    response.read()
+    if response.status != 200:
+        raise RuntimeError(f"Receiver replied {response.status}")
+
+
+def _multipart(bodies, job_ids):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for body, job_id in zip(bodies, job_ids):
+        parts.append(
+            f"--{boundary}\r\nContent-Type: image/png\r\nX-Bridge-Job-Id: {job_id}\r\n\r\n".encode("latin-1")
+            + body + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode("latin-1"))
+    return b"".join(parts), f"multipart/mixed; boundary={boundary}"
+
+
+def run_mode(mode, port, bodies, batch):
+    """按一种方式发送所有结果，返回发送耗时 (秒)。"""
+    job_ids = [f"bench-{index}" for index in range(len(bodies))]
+    started = time.perf_counter()
+    if mode == "close":
+        for body, job_id in zip(bodies, job_ids):
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            try:
+                _post(connection, body, job_id, {"Connection": "close"})
+            finally:
+                connection.close()
+    else:
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        try:
+            if mode == "multipart":
+                for start in range(0, len(bodies), batch):
+                    body, content_type = _multipart(bodies[start:start + batch], job_ids[start:start + batch])
+                    _post(connection, body, job_ids[start], {"Content-Type": content_type})
+            else:
+                for body, job_id in zip(bodies, job_ids):
+                    _post(connection, body, job_id, chunked=mode == "chunked")
+        finally:
+            connection.close()
+    return time.perf_counter() - started
+
+
+def benchmark(count=200, size=64 * 1024, batch=16, connect_delay=0.0, repeats=3, modes=MODES):
+    receiver_port = _free_port()
+    service = ReceiverService(max_uploads=64, max_queued_bytes=4 * 1024 * 1024 * 1024)
+    service.configure(receiver_port, default_target="benchmark")
+    forwarder = DelayedForwarder(receiver_port, connect_delay) if connect_delay else None
+    port = forwarder.port if forwarder else receiver_port
+    collector = ResultCollector()
+    bodies = [deterministic_payload(size, f"result:{index}") for index in range(count)]
+    results = {}
+    try:
+        for mode in modes:
+            timings = []
+            for _ in range(repeats):
+                collector.expect(count)
+                started = time.perf_counter()
+                run_mode(mode, port, bodies, batch)
+                if not collector.wait(60):
+                    raise RuntimeError(f"{mode}: only {collector.count}/{count} results arrived")
+                timings.append(time.perf_counter() - started)
+            best = min(timings)
+            results[mode] = {
+                "seconds": round(best, 4),
+                "results_per_second": round(count / best, 1),
+                "mb_per_second": round(count * size / best / 1024 / 1024, 1),
+            }
+    finally:
+        collector.stop()
+        if forwarder:
+            forwarder.stop()
+        service.stop()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.result_transfer", description="Benchmark returning many small results to the HTTP receiver.")
+    parser.add_argument("--count", type=int, default=200, help="Number of results per run (default: 200)")
+    parser.add_argument("--size-kb", type=int, default=64, help="Size of each result in KB (default: 64)")
+    parser.add_argument("--batch", type=int, default=16, help="Results per multipart request (default: 16)")
+    parser.add_argument("--connect-delay-ms", type=float, default=0.0, help="Delay added to every new connection, e.g. to model an SSH tunnel")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per mode; the fastest is reported (default: 3)")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES), help="Transfer modes to run")
+    parser.add_argument("--report", help="Write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    results = benchmark(
+        args.count, args.size_kb * 1024, args.batch, args.connect_delay_ms / 1000.0, max(1, args.repeats), args.modes,
+    )
+    print(f"{args.count} results x {args.size_kb} KB, connect delay {args.connect_delay_ms:g} ms")
+    for mode, result in results.items():
+        print(f"  {mode:<11} {result['seconds']:>8.3f} s  {result['results_per_second']:>8.1f} results/s  {result['mb_per_second']:>7.1f} MB/s")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"arguments": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
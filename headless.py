@@ -0,0 +1,297 @@
+"""
+无界面批量渲染入口，供渲染农场在 `blender -b` 下使用。
+
+用法 (插件安装为扩展时):
+
+    blender -b scene.blend --python-expr \
+        "import bl_ext.user_default.blender_comfyui_bridge.headless as h; h.main()" -- \
+        --frames 1-100 --cameras CamA,CamB --view-layers ViewLayer --jobs 4 --output /farm/out
+
+每个 (帧, 相机, 视图层) 组合渲染一次并发送到 ComfyUI，最多同时有 --jobs 个任务在 ComfyUI 中处理，
+返回的结果写入输出目录，manifest.json 记录每个组合的渲染、等待和总耗时。
+服务器地址、返回方式、SSH 隧道等设置取自场景的插件设置，可以用 --address 覆盖服务器地址。
+"""
+import argparse
+import json
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import time
+import logging
+
+import bpy
+
+from .operators import _DeferredSubmitter, _ensure_receiver
+from .utils import state, scheduler, spool, channel, progress, tunnel, render_queue
+from .utils.shots import expand_shots, parse_frames, _round
+
+log = logging.getLogger(__name__)
+
+_FORMATS = {
+    'PNG': ('PNG', None, ".png"),
+    'OPEN_EXR': ('OPEN_EXR', '32', ".exr"),
+}
+
+
+def _split_names(text):
+    return [name.strip() for name in (text or "").split(',') if name.strip()]
+
+
+def build_shots(scene, frames, camera_names=None, view_layer_names=None):
+    """
+    展开 (帧, 相机, 视图层) 组合。
+    未指定相机时使用场景相机；未指定视图层时使用所有启用渲染的视图层。
+    :raises ValueError: 指定的相机或视图层不存在
+    """
+    if camera_names:
+        for name in camera_names:
+            obj = bpy.data.objects.get(name)
+            if obj is None or obj.type != 'CAMERA':
+                raise ValueError(f"Camera '{name}' not found.")
+    elif scene.camera:
+        camera_names = [scene.camera.name]
+    else:
+        raise ValueError(f"Scene '{scene.name}' has no camera.")
+
+    if view_layer_names:
+        for name in view_layer_names:
+            if name not in scene.view_layers:
+                raise ValueError(f"View layer '{name}' not found in scene '{scene.name}'.")
+    else:
+        view_layer_names = [layer.name for layer in scene.view_layers if layer.use]
+
+    return expand_shots(scene.name, frames, camera_names, view_layer_names, bpy.path.clean_name)
+
+
+def render_shot(scene, shot, filepath, file_format='PNG', color_depth=None):
+    """
+    渲染一个组合到 filepath (同步)。相机和视图层由 RenderRequest 临时覆盖并在渲染后恢复。
+    当前帧不恢复 (每次切换帧都要重新求值场景)，由调用方在全部渲染结束后恢复。
+    """
+    request = render_queue.RenderRequest(
+        scene.name, filepath, None, file_format=file_format, color_depth=color_depth,
+        camera=shot.camera, view_layer=shot.view_layer,
+    )
+    if scene.frame_current != shot.frame:
+        scene.frame_set(shot.frame)
+    try:
+        request.apply(scene)
+        bpy.ops.render.render(write_still=True, scene=scene.name)
+    finally:
+        request.restore()
+    if not os.path.exists(filepath):
+        raise RuntimeError(f"Render output not found: {filepath}")
+
+
+class HeadlessRunner:
+    """
+    依次渲染各个组合，同时最多保持 max_jobs 个任务在 ComfyUI 中处理，并收集返回的结果。
+
+    后台模式下 bpy.app.timers 不会在脚本运行期间执行，因此结果队列 (state.task_queue)
+    由这里直接处理：结果文件从暂存目录复制到输出目录，而不是加载到图像数据块。
+    """
+
+    def __init__(self, scene, shots, output_dir, max_jobs=2, file_format='PNG', timeout=600.0):
+        self.scene = scene
+        self.shots = shots
+        self.output_dir = output_dir
+        self.max_jobs = max(1, max_jobs)
+        self.file_format = file_format
+        self.timeout = timeout
+        self.job_scheduler = scheduler.get_scheduler(max_workers=self.max_jobs)
+        self._by_name = {shot.name: shot for shot in shots}
+        self._in_flight = []
+
+    def run(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        pending = list(self.shots)
+        pending.reverse()
+        started = time.time()
+        original_frame = self.scene.frame_current
+        try:
+            while pending or self._in_flight:
+                if pending and len(self._in_flight) < self.max_jobs:
+                    self._submit(pending.pop())
+                    self._collect(block=False)
+                    continue
+                self._collect(block=True)
+        finally:
+            self.scene.frame_set(original_frame)
+        return self._write_manifest(time.time() - started)
+
+    def _submit(self, shot):
+        file_format, color_depth, extension = _FORMATS[self.file_format]
+        render_path = os.path.join(tempfile.gettempdir(), f"blender_headless_{os.getpid()}_{shot.name}{extension}")
+        shot.render_started = time.time()
+        log.info(f"正在渲染 {shot.name}...")
+        try:
+            render_shot(self.scene, shot, render_path, file_format, color_depth)
+        except Exception as e:
+            self._fail(shot, f"Render failed: {e}")
+            return
+        shot.render_seconds = time.time() - shot.render_started
+
+        metadata = {
+            "render_type": "standard",
+            "frame": shot.frame,
+            "camera": shot.camera,
+            "view_layer": shot.view_layer,
+        }
+        shot.submitted_at = time.time()
+        # 每个镜头单独提交，各自检查一次 SSH 隧道 (长时间运行期间隧道可能断开)
+        submitter = _DeferredSubmitter()
+        try:
+            with open(render_path, 'rb') as f:
+                image_data = f.read()
+        finally:
+            submitter._remove_temp_file(render_path)
+        shot.job = submitter.submit_job(self.scene, image_data, metadata, os.path.basename(render_path), shot.name)
+        if shot.job is None:
+            self._fail(shot, "Failed to queue the job.")
+            return
+        shot.status = 'RUNNING'
+        self._in_flight.append(shot)
+
+    def _collect(self, block):
+        """处理返回的结果，并检查失败和超时的任务。"""
+        try:
+            image_paths, image_name, job_id = state.task_queue.get(timeout=0.2 if block else 0)
+        except queue.Empty:
+            pass
+        else:
+            self._store(image_paths, image_name, job_id)
+
+        now = time.time()
+        for shot in list(self._in_flight):
+            job = shot.job
+            if job.status in ('FAILED', 'CANCELLED'):
+                self._fail(shot, job.error or f"Job {job.status.lower()}.")
+            elif self.timeout and now - shot.submitted_at > self.timeout:
+                self.job_scheduler.cancel(job.id)
+                self._fail(shot, f"Timed out after {self.timeout:.0f} s.")
+
+    def _store(self, image_paths, image_name, job_id):
+        shot = self._by_name.get(image_name)
+        try:
+            if shot is None or shot not in self._in_flight:
+                log.warning(f"收到未知或已结束的结果 '{image_name}'，已丢弃。")
+                return
+            for index, image_path in enumerate(image_paths):
+                extension = os.path.splitext(image_path)[1] or ".png"
+                suffix = f"_{index:03d}" if len(image_paths) > 1 else ""
+                output_path = os.path.join(self.output_dir, f"{shot.name}{suffix}{extension}")
+                shutil.copyfile(image_path, output_path)
+                shot.outputs.append(os.path.basename(output_path))
+            shot.status = 'DONE'
+            shot.finished_at = time.time()
+            self._in_flight.remove(shot)
+            if job_id:
+                self.job_scheduler.mark_done(job_id)
+            log.info(f"{shot.name} 完成，结果已写入 {self.output_dir}。")
+        except Exception as e:
+            self._fail(shot, f"Failed to write result: {e}")
+            if job_id:
+                self.job_scheduler.mark_done(job_id, error=str(e))
+        finally:
+            for image_path in image_paths:
+                spool.get_spool().release(image_path)
+
+    def _fail(self, shot, error):
+        shot.status = 'FAILED'
+        shot.error = error
+        shot.finished_at = time.time()
+        if shot in self._in_flight:
+            self._in_flight.remove(shot)
+        log.error(f"{shot.name} 失败: {error}")
+
+    def _write_manifest(self, wall_seconds):
+        manifest = {
+            "blend_file": bpy.data.filepath,
+            "scene": self.scene.name,
+            "jobs": self.max_jobs,
+            "wall_seconds": _round(wall_seconds),
+            "succeeded": sum(1 for shot in self.shots if shot.status == 'DONE'),
+            "failed": sum(1 for shot in self.shots if shot.status != 'DONE'),
+            "shots": [shot.to_dict() for shot in self.shots],
+        }
+        with open(os.path.join(self.output_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        return manifest
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="blender -b file.blend --python-expr '...headless.main()' --",
+        description="Render frames/cameras/view layers, process them with ComfyUI and write the results to disk.",
+    )
+    parser.add_argument("--output", required=True, help="Directory for results and manifest.json")
+    parser.add_argument("--scene", help="Scene to render (default: the active scene)")
+    parser.add_argument("--frames", help="Frames, e.g. '1-10', '1,5,10-20' or '1-100x10' (default: current frame)")
+    parser.add_argument("--cameras", help="Comma-separated camera objects (default: the scene camera)")
+    parser.add_argument("--view-layers", help="Comma-separated view layers (default: all enabled view layers)")
+    parser.add_argument("--jobs", type=int, default=2, help="Jobs processed by ComfyUI in parallel (default: 2)")
+    parser.add_argument("--address", help="ComfyUI address(es), overriding the scene settings")
+    parser.add_argument("--format", choices=sorted(_FORMATS), default='PNG', help="Render output format sent to ComfyUI")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Seconds to wait for each result (0 = no limit)")
+    return parser.parse_args(argv)
+
+
+def _shutdown():
+    scheduler.stop_scheduler()
+    channel.stop_channel()
+    progress.stop_subscriber()
+    tunnel.stop_tunnel()
+    state.stop_receiver_server()
+
+
+def main(argv=None):
+    """
+    命令行入口。参数取自 Blender 命令行中 "--" 之后的部分。
+    全部成功时以退出码 0 结束，否则为 1 (参数错误为 2)。
+    """
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    args = _parse_args(argv)
+
+    if not hasattr(bpy.types.Scene, "bridge_props"):
+        # 以 --python-expr 导入时插件可能尚未启用
+        sys.modules[__package__].register()
+
+    scene = bpy.data.scenes.get(args.scene) if args.scene else bpy.context.scene
+    if scene is None:
+        print(f"[ERROR] Scene '{args.scene}' not found.")
+        sys.exit(2)
+    props = scene.bridge_props
+    if args.address:
+        addresses = _split_names(args.address)
+        props.comfyui_address = addresses[0]
+        props.extra_comfyui_addresses = ",".join(addresses[1:])
+    # 结果写入磁盘而不是图像数据块，不使用依赖数据块的结果缓存
+    props.use_result_cache = False
+    # 只保存完整结果，不请求渐进返回的分块
+    props.stream_tiles = False
+    if props.return_mode == 'HTTP':
+        _ensure_receiver(props)
+
+    try:
+        shots = build_shots(
+            scene,
+            parse_frames(args.frames, scene.frame_current),
+            _split_names(args.cameras),
+            _split_names(args.view_layers),
+        )
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(2)
+
+    print(f"[INFO] Rendering {len(shots)} shots with {args.jobs} parallel ComfyUI jobs.")
+    output_dir = os.path.abspath(bpy.path.abspath(args.output))
+    try:
+        manifest = HeadlessRunner(scene, shots, output_dir, args.jobs, args.format, args.timeout).run()
+    finally:
+        _shutdown()
+    print(f"[INFO] {manifest['succeeded']}/{len(shots)} shots succeeded in {manifest['wall_seconds']} s. "
+          f"Manifest: {os.path.join(output_dir, 'manifest.json')}")
+    sys.exit(0 if manifest["failed"] == 0 else 1)
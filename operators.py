@@ -3,12 +3,18 @@ import logging
 import tempfile
 import os
 import time
+import uuid
 
-from .utils import comms, tunnel, state
-from .panel import get_active_image_from_editor
+from .utils import comms, tunnel, state, scheduler, pool, cache, tasks, spool, progress, shm, render_queue, encoding, profiling
+from .panel import get_active_image_from_editor, collect_batch_images
 
 log = logging.getLogger(__name__)
 
+def _operator_result(job):
+    """submit_job 返回的任务转换为操作符的返回值。"""
+    return {'FINISHED'} if job is not None else {'CANCELLED'}
+
+
 def _ensure_ssh_tunnel(props):
     """
     检查是否需要SSH隧道，并确保它正在运行。
@@ -28,6 +34,11 @@ def _ensure_ssh_tunnel(props):
         return False, f"Invalid SSH port: '{props.ssh_port}'. Please enter a number between 1-65535."
 
     manager = tunnel.get_tunnel_manager(props)
+    if manager and manager.use_reverse_tunnel != (props.return_mode == 'HTTP'):
+        # 结果返回方式已改变，需要按新的配置重建隧道
+        log.info("结果返回方式已改变，正在重建SSH隧道...")
+        tunnel.stop_tunnel()
+        manager = tunnel.get_tunnel_manager(props)
     if not manager:
         msg = "Cannot create SSH tunnel manager."
         log.error(msg)
@@ -73,6 +84,15 @@ def _get_comfyui_address(props):
             return "0.0.0.0:0"
     else:
         return props.comfyui_address
+
+def _get_comfyui_addresses(props):
+    """
+    获取服务器池中的所有 ComfyUI 地址。
+    SSH 隧道只转发主服务器，因此使用隧道时只返回主服务器。
+    """
+    if props.use_ssh:
+        return [_get_comfyui_address(props)]
+    return pool.parse_addresses(f"{props.comfyui_address},{props.extra_comfyui_addresses}")
         
 def _get_blender_callback_address(props):
     """
@@ -92,11 +112,43 @@ def _get_blender_callback_address(props):
     # 如果在docker等复杂网络中，用户需要使用 public_address_override
     return f"http://127.0.0.1:{props.blender_receiver_port}"
 
+def _ensure_receiver(props, default_target=None):
+    """按当前设置 (端口和准入限制) 确保 HTTP 接收服务器在运行。"""
+    return state.ensure_receiver_server(
+        props.blender_receiver_port, default_target,
+        max_uploads=props.receiver_max_uploads,
+        max_queued_bytes=props.receiver_max_queued_mb * 1024 * 1024,
+    )
+
+def _use_shared_memory(props):
+    """只有所有 ComfyUI 服务器都在本机时才能通过共享内存传递像素。"""
+    if props.pixel_transport != 'SHARED_MEMORY' or props.use_ssh:
+        return False
+    return all(comms.is_local_address(address) for address in _get_comfyui_addresses(props))
+
+def _build_return_info(props, target_image_name):
+    """构建告诉 ComfyUI 如何返回结果的信息。"""
+    if props.return_mode == 'ZMQ':
+        # 结果通过提交任务的同一个 ZMQ 连接返回，不需要回调地址
+        return_info = {
+            "transport": "zmq",
+            "image_datablock_name": target_image_name,
+        }
+    else:
+        return_info = {
+            "blender_server_address": _get_blender_callback_address(props),
+            "image_datablock_name": target_image_name,
+        }
+    if props.stream_tiles:
+        # 服务器可以先返回分块或低分辨率的渐进结果，最后一个分块带 final 标记 (或再返回完整结果)
+        return_info["tiles"] = True
+    return return_info
+
 class BRIDGE_OT_TestConnection(bpy.types.Operator):
-    """向ComfyUI发送一个'ping'来测试连接状态"""
+    """配置后台健康检查并立即检查一次连接状态"""
     bl_idname = "bridge.test_connection"
     bl_label = "测试连接"
-    bl_description = "向 ComfyUI 发送一个'ping'来测试连接状态"
+    bl_description = "开始在后台定期 ping ComfyUI 服务器，连接状态、延迟和负载会持续自动更新"
 
     def execute(self, context):
         props = context.scene.bridge_props
@@ -108,33 +160,338 @@ class BRIDGE_OT_TestConnection(bpy.types.Operator):
             props.connection_status = 'FAILED'
             return {'FINISHED'}
 
-        target_address = _get_comfyui_address(props)
-        log.info(f"正在尝试连接到: {target_address}")
+        addresses = _get_comfyui_addresses(props)
+        log.info(f"正在后台检查连接: {addresses}")
 
-        props.connection_status = 'DISCONNECTED'
-        bpy.ops.wm.redraw_timer(type='DRAW_WIN_SWAP', iterations=1)
+        # 健康检查在服务器池的监控线程中进行，结果由任务队列定时器同步到 connection_status，
+        # 这里不等待回复，界面不会被阻塞
+        comms.ipc_enabled = props.use_ipc
+        endpoint_pool = scheduler.get_scheduler().pool
+        endpoint_pool.set_addresses(addresses)
+        endpoint_pool.check_now()
+        self.report({'OPERATOR'}, f"[INFO] Checking connection to {', '.join(addresses)} in the background...")
+        return {'FINISHED'}
 
+def _parse_sweep_value(text):
+    """扫描值优先解析为整数或浮点数 (例如种子、CFG)，否则保留为字符串 (例如提示词)。"""
+    for convert in (int, float):
         try:
-            success = comms.send_ping(target_address)
-            if success:
-                props.connection_status = 'CONNECTED'
-                msg = "Successfully connected to ComfyUI!"
-                self.report({'OPERATOR'}, f"[INFO] {msg}")
-                log.info("与 ComfyUI 连接成功！")
-            else:
-                props.connection_status = 'FAILED'
-                msg = "Connection failed. Please check the address or ensure ComfyUI is running."
-                self.report({'OPERATOR'}, f"[ERROR] {msg}")
-                log.error("连接失败。请检查地址或确保ComfyUI服务器正在运行。")
+            return convert(text)
+        except ValueError:
+            pass
+    return text
+
+def _sweep_variants(props):
+    """
+    根据参数扫描设置生成变体列表 [{参数名: 值}, ...]。
+    值包含 '|' 时按 '|' 分隔 (提示词中可以有逗号)，否则按逗号分隔。
+    """
+    parameter = props.sweep_parameter.strip()
+    text = props.sweep_values
+    if not parameter or not text.strip():
+        return []
+    separator = '|' if '|' in text else ','
+    values = [value.strip() for value in text.split(separator) if value.strip()]
+    return [{parameter: _parse_sweep_value(value)} for value in values]
+
+class _JobSubmitter:
+    """
+    发送任务的公共逻辑，由操作符和延迟发送 (渲染完成后) 共用。
+    子类需要提供 report(type, message)。
+    """
+
+    def ensure_tunnel(self, props):
+        """
+        确保 SSH 隧道可用，每次操作只检查一次：操作符在提交任务之前调用，
+        之后同一次操作中的 submit_job (例如批量发送的每张图像) 不再重复检查。失败时报告错误并返回 False。
+        """
+        if getattr(self, "_tunnel_ready", False):
+            return True
+        success, msg = _ensure_ssh_tunnel(props)
+        if not success:
+            self.report({'OPERATOR'}, f"[ERROR] {msg}")
+            log.error(msg)
+            return False
+        self._tunnel_ready = True
+        return True
+
+    def send_to_comfyui(self, scene, file_path, user_metadata=None, target_image_name=None, keep_file=False):
+        try:
+            with open(file_path, 'rb') as f:
+                image_data = f.read()
         except Exception as e:
-            props.connection_status = 'FAILED'
-            msg = f"An unknown error occurred: {e}"
+            msg = f"Failed to read file: {file_path}. Reason: {e}"
             self.report({'OPERATOR'}, f"[ERROR] {msg}")
-            log.error(f"发生未知错误: {e}", exc_info=True)
-            
-        return {'FINISHED'}
+            log.error(f"读取文件 '{file_path}' 失败: {e}", exc_info=True)
+            return {'CANCELLED'}
+
+        job = self.submit_job(scene, image_data, user_metadata, os.path.basename(file_path), target_image_name)
+        if not keep_file:
+            self._remove_temp_file(file_path)
+        return _operator_result(job)
+
+    def send_shared_memory(self, scene, image, user_metadata=None, target_image_name=None):
+        """
+        通过共享内存发送图像的像素，不经过编码和文件。
+        没有空闲的共享内存段时返回 None，调用方应回退到普通的文件传输。
+        """
+        ring = shm.get_ring()
+        try:
+            acquired = shm.write_image_pixels(ring, image)
+        except Exception as e:
+            log.warning(f"写入共享内存失败，回退到文件传输: {e}")
+            return None
+        if acquired is None:
+            log.info("共享内存段均被占用，回退到文件传输。")
+            return None
+        index, descriptor = acquired
+
+        metadata = dict(user_metadata or {})
+        metadata["source_render_type"] = metadata.get("render_type")
+        metadata["render_type"] = "shared_memory"
+        metadata["shared_memory"] = descriptor
+        job = self.submit_job(
+            scene, None, metadata, image.name, target_image_name,
+            return_options={"shared_memory": True},
+            on_finish=lambda job: ring.release(index),
+        )
+        if job is None:
+            ring.release(index)
+        return _operator_result(job)
+
+    def submit_job(self, scene, payload, user_metadata=None, label="", target_image_name=None, return_options=None, on_finish=None):
+        """
+        构建元数据并将任务提交到调度器。payload 为 None 时表示像素通过其他途径 (共享内存) 传递，
+        为可调用对象时由调度器的工作线程在发送前求值 (例如编码图像)。
+        target_image_name 默认为当前选择的目标图像；延迟发送时应传入请求发起时的目标。
+        返回提交的任务；命中结果缓存时返回一个已完成 (未提交到调度器) 的任务，SSH 隧道不可用时返回 None。
+        """
+        props = scene.bridge_props
+
+        if not self.ensure_tunnel(props):
+            return None
+
+        target_image_name = target_image_name or props.target_image_datablock.name
+        return_info = _build_return_info(props, target_image_name)
+        if return_options:
+            return_info.update(return_options)
+        metadata = {
+            "type": "render_and_return",
+            "filename": label,
+            "return_info": return_info,
+        }
+        if user_metadata is not None:
+            metadata.update(user_metadata)
+        if "proxy" in metadata:
+            label = f"{label} (代理)"
+        elif props.use_sweep:
+            # 负载只上传一次，由服务器为每个变体各运行一次工作流
+            variants = _sweep_variants(props)
+            if variants:
+                metadata["sweep"] = {"parameter": props.sweep_parameter.strip(), "variants": variants}
+                label = f"{label} (扫描 {len(variants)} 个变体)"
+                # 每个变体的结果写入不同的数据块，不逐块显示
+                return_info.pop("tiles", None)
+        # 参数扫描会返回多个结果，不使用结果缓存
+        use_cache = props.use_result_cache and "sweep" not in metadata
+        
+        comms.ipc_enabled = props.use_ipc
+        comms.resumable_enabled = props.use_resumable_upload
+        job_scheduler = scheduler.get_scheduler()
+        addresses = _get_comfyui_addresses(props)
+        job_scheduler.pool.set_addresses(addresses)
+
+        job = scheduler.Job(
+            None,
+            metadata,
+            payload,
+            priority=scheduler.PRIORITY_BY_NAME.get(props.job_priority, scheduler.PRIORITY_INTERACTIVE),
+            label=label,
+            target_image_name=target_image_name,
+        )
+        cache_key = None
+        workflow_hash = job_scheduler.pool.workflow_hash()
+        if use_cache and isinstance(payload, bytes):
+            result_cache = cache.get_result_cache(props.cache_size_mb * 1024 * 1024)
+            cache_key = cache.make_key(payload, metadata, workflow_hash)
+            cached_path = cache_key and result_cache.get(cache_key)
+            if cached_path:
+                # 命中缓存：直接应用结果，无需往返 ComfyUI
+                try:
+                    tasks.apply_result(bpy.data.images[target_image_name], cached_path)
+                except Exception as e:
+                    log.warning(f"应用缓存结果失败，将重新发送: {e}")
+                else:
+                    if "proxy" not in metadata:
+                        # 与返回的完整结果一样，取消先前排队的代理任务，避免其结果稍后覆盖缓存结果
+                        tasks.supersede_proxies(job_scheduler, target_image_name, time.time())
+                    log.info(f"结果缓存命中 ({cache_key[:12]})，已直接更新图像 '{target_image_name}'。")
+                    self.report({'OPERATOR'}, "[INFO] Result loaded from cache.")
+                    job.status = 'DONE'
+                    job.finished_at = time.time()
+                    return job
+
+        if props.return_mode == 'HTTP' and props.progress_port:
+            # HTTP 模式下进度事件来自服务器的 PUB socket；ZMQ 模式下直接在任务通道上到达
+            progress.get_subscriber().set_addresses(
+                [f"{address.rsplit(':', 1)[0]}:{props.progress_port}" for address in addresses]
+            )
+        job.cache_key = cache_key
+        job.workflow_hash = workflow_hash
+        if use_cache and callable(payload):
+            # 延迟负载的缓存键在工作线程中求值后计算
+            cache.get_result_cache(props.cache_size_mb * 1024 * 1024)
+            job.use_cache = True
+        job.batch_target = props.batch_target
+        job.sweep_target = props.sweep_target
+        job.on_finish = on_finish
+        log.info(f"准备发送任务 {job.id}")
+        log.debug(f"构建的元数据: {metadata}")
+        if props.return_mode == 'HTTP' and state.receiver_service is not None:
+            state.receiver_service.add_route(job.id, target_image_name)
+        job_scheduler.submit(job)
+
+        msg = f"Job {job.id} queued for ComfyUI."
+        self.report({'OPERATOR'}, f"[INFO] {msg}")
+        return job
+
+    def send_raw(self, scene, image, user_metadata=None, target_image_name=None):
+        """
+        以原始 float16/float32 数组发送图像像素，服务器无需解码。
+        主线程只读取像素，类型转换在调度器的工作线程中进行。图像没有像素缓冲区时返回 None。
+        """
+        pixels = encoding.grab_pixels(image)
+        if pixels is None:
+            return None
+        return self._submit_raw(scene, pixels, image, user_metadata, image.name, target_image_name)
+
+    def send_proxy(self, scene, image, user_metadata=None, target_image_name=None):
+        """
+        发送按 proxy_scale 缩小的代理图像，使第一个可用结果尽快返回。
+        代理结果之后会被完整分辨率的结果替换。图像没有像素缓冲区，或缩小后不比原图小时返回 None。
+        """
+        props = scene.bridge_props
+        pixels = encoding.grab_pixels(image)
+        if pixels is None:
+            return None
+        # 与渲染模式一样使用精确的百分比，而不是取整到整数分之一
+        pixels = encoding.downscale(pixels, props.proxy_scale / 100)
+        if pixels is None:
+            return None
+        metadata = dict(user_metadata or {})
+        metadata["proxy"] = {"scale": props.proxy_scale / 100, "full_size": list(image.size)}
+        if props.pixel_transport == 'RAW':
+            return self._submit_raw(scene, pixels, image, metadata, image.name, target_image_name)
+        if not encoding.matches_save_render(image, scene):
+            # 代理无法以 save_render 的颜色直接编码，只发送完整分辨率的任务
+            return None
+        return self._submit_png(scene, pixels, image, metadata, f"{image.name}.png", target_image_name)
+
+    def _submit_raw(self, scene, pixels, image, user_metadata, label, target_image_name=None):
+        props = scene.bridge_props
+        dtype = props.raw_dtype.lower()
+        metadata = dict(user_metadata or {})
+        metadata["source_render_type"] = metadata.get("render_type")
+        metadata["render_type"] = "raw"
+        metadata["raw"] = encoding.describe_raw(pixels, dtype, props.raw_planar, image.colorspace_settings.name)
+        payload = encoding.defer(encoding.encode_raw, pixels, dtype, props.raw_planar)
+        return _operator_result(self.submit_job(scene, payload, metadata, label, target_image_name))
+
+    def _submit_png(self, scene, pixels, image, user_metadata, label, target_image_name=None):
+        """PNG 编码在编码线程池中立即开始，主线程只负责读取像素。"""
+        payload = encoding.defer(
+            encoding.encode_png,
+            pixels,
+            compression=scene.bridge_props.png_compression,
+            bit_depth=16 if image.is_float else 8,
+            to_srgb=encoding.needs_srgb_transform(image),
+        )
+        return _operator_result(self.submit_job(scene, payload, user_metadata, label, target_image_name))
+
+    def send_image(self, scene, image, user_metadata=None, target_image_name=None):
+        """
+        按 pixel_transport 设置发送一张图像数据块。
+        图像没有像素缓冲区且不是磁盘文件时返回 None (例如 Render Result)。
+        """
+        props = scene.bridge_props
+        if _use_shared_memory(props):
+            # 像素直接从图像缓冲区写入共享内存，跳过保存和编码
+            result = self.send_shared_memory(scene, image, user_metadata, target_image_name)
+            if result is not None:
+                return result
+
+        if props.pixel_transport == 'RAW':
+            result = self.send_raw(scene, image, user_metadata, target_image_name)
+            if result is not None:
+                return result
+
+        if image.source == 'FILE' and image.filepath and not image.is_dirty:
+            # 磁盘上的文件就是当前内容，直接发送原文件 (文件属于用户，发送后保留)
+            image_path = os.path.abspath(bpy.path.abspath(image.filepath))
+            return self.send_to_comfyui(scene, image_path, user_metadata, target_image_name, keep_file=True)
+
+        # 生成的或修改过的图像：主线程只读取一次像素，PNG 编码在编码线程池中进行
+        pixels = encoding.grab_pixels(image)
+        if pixels is None:
+            return None
+        if not encoding.matches_save_render(image, scene):
+            # 场景使用 Filmic/AgX 等视图变换时，只有 save_render 能得到与图像编辑器中相同的颜色
+            return self.send_saved_render(scene, image, user_metadata, target_image_name)
+        return self._submit_png(scene, pixels, image, user_metadata, f"{image.name}.png", target_image_name)
+
+    def send_saved_render(self, scene, image, user_metadata=None, target_image_name=None):
+        """在主线程中用 save_render (应用场景的色彩管理) 将图像保存为临时 PNG 并发送。"""
+        try:
+            filename = f"blender_image_{image.name.replace(' ', '_')}_{os.getpid()}.png"
+            image_path = os.path.join(tempfile.gettempdir(), filename)
+            image.save_render(filepath=image_path, scene=scene)
+            log.info(f"图像 '{image.name}' 已临时保存到: {image_path}")
+        except Exception as e:
+            msg = f"Failed to save image: {e}"
+            self.report({'OPERATOR'}, f"[ERROR] {msg}")
+            log.error(f"保存图像 '{image.name}' 失败: {e}", exc_info=True)
+            return {'CANCELLED'}
+        return self.send_to_comfyui(scene, image_path, user_metadata, target_image_name)
+
+    def send_file_pixels(self, scene, file_path, metadata, target_image_name=None):
+        """
+        加载渲染输出文件，按 pixel_transport 设置以共享内存或原始数组发送其像素。
+        失败时返回 None，调用方应回退到发送文件本身。
+        """
+        try:
+            image = bpy.data.images.load(file_path, check_existing=False)
+        except RuntimeError as e:
+            log.warning(f"无法加载渲染输出，回退到文件传输: {e}")
+            return None
+        try:
+            if scene.bridge_props.pixel_transport == 'RAW':
+                result = self.send_raw(scene, image, metadata, target_image_name)
+            else:
+                result = self.send_shared_memory(scene, image, metadata, target_image_name)
+        finally:
+            bpy.data.images.remove(image)
+        if result is not None:
+            self._remove_temp_file(file_path)
+        return result
+
+    def _remove_temp_file(self, file_path):
+        if tempfile.gettempdir() in os.path.abspath(file_path):
+            try:
+                os.remove(file_path)
+                log.info(f"已删除临时文件: {file_path}")
+            except OSError as e:
+                log.warning(f"删除临时文件失败: {file_path}. 原因: {e}")
+
+class _DeferredSubmitter(_JobSubmitter):
+    """在操作符返回之后 (例如渲染完成时) 发送任务，报告写入日志。"""
+
+    def report(self, type, message):
+        if message.startswith("[ERROR]"):
+            log.error(message)
+        else:
+            log.info(message)
 
-class BRIDGE_OT_SendData(bpy.types.Operator):
+class BRIDGE_OT_SendData(_JobSubmitter, bpy.types.Operator):
     """根据所选模式，发送数据到ComfyUI"""
     bl_idname = "bridge.send_data"
     bl_label = "发送数据到 ComfyUI"
@@ -194,8 +551,16 @@ class BRIDGE_OT_SendData(bpy.types.Operator):
         return channel_map
 
     def execute(self, context):
+        return profiling.call("send_operator", self._execute, context)
+
+    def _execute(self, context):
         props = context.scene.bridge_props
-        state.start_receiver_server(props.blender_receiver_port)
+        if not self.ensure_tunnel(props):
+            return {'CANCELLED'}
+        spool.get_spool(props.spool_size_mb * 1024 * 1024)
+        if props.return_mode == 'HTTP':
+            # 服务器已在运行时这里只更新默认目标，不会重启
+            _ensure_receiver(props, props.target_image_datablock.name)
         if props.source_mode == 'RENDER':
             return self.execute_render(context)
         elif props.source_mode == 'IMAGE_EDITOR':
@@ -203,55 +568,125 @@ class BRIDGE_OT_SendData(bpy.types.Operator):
         return {'CANCELLED'}
 
     def execute_render(self, context):
+        """
+        将渲染加入渲染队列后立即返回，界面在渲染期间保持可用。
+        渲染完成后由 render_queue 在主线程中调用 on_complete 发送结果。
+        启用多相机/多视图层时，每个组合各渲染一次，作为一组任务发送到各自的结果图像。
+        """
         props = context.scene.bridge_props
         scene = context.scene
-        render_settings = scene.render
-        
-        original_filepath = render_settings.filepath
-        original_format = render_settings.image_settings.file_format
-        original_color_depth = render_settings.image_settings.color_depth
-
-        try:
-            render_dir = tempfile.gettempdir()
-            render_filename_base = f"blender_render_{os.getpid()}"
-            metadata = {}
 
+        file_format = None
+        color_depth = None
+        if props.render_mode == 'MULTILAYER_EXR':
+            file_format = 'OPEN_EXR_MULTILAYER'
+            color_depth = '32'
+            extension = ".exr"
+        elif props.pixel_transport == 'RAW':
+            # 原始数组需要完整的浮点精度，渲染到单层 32 位 EXR 后再读取像素
+            file_format = 'OPEN_EXR'
+            color_depth = '32'
+            extension = ".exr"
+        else: # STANDARD
+            extension = ".jpg" if scene.render.image_settings.file_format == 'JPEG' else ".png"
+
+        send_pixels = props.render_mode == 'STANDARD' and (props.pixel_transport == 'RAW' or _use_shared_memory(props))
+        shots = self._collect_render_shots(context)
+        group_id = uuid.uuid4().hex[:12] if len(shots) > 1 else None
+
+        def shot_metadata(index, camera, view_layer):
+            metadata = {"render_type": "multilayer_exr" if props.render_mode == 'MULTILAYER_EXR' else "standard"}
             if props.render_mode == 'MULTILAYER_EXR':
-                render_settings.image_settings.file_format = 'OPEN_EXR_MULTILAYER'
-                render_settings.image_settings.color_depth = '32'
-                extension = ".exr"
-                metadata["render_type"] = "multilayer_exr"
-                
-                active_view_layer = context.view_layer
-                channel_map = self._build_channel_map(active_view_layer)
+                # 只渲染一个视图层时 EXR 中只有该层的通道
+                channel_map = self._build_channel_map(scene.view_layers[view_layer] if view_layer else context.view_layer)
                 if channel_map:
                     metadata["channel_map"] = channel_map
+            if group_id:
+                metadata["group"] = {
+                    "id": group_id, "index": index, "count": len(shots),
+                    "camera": camera or (scene.camera.name if scene.camera else None),
+                    "view_layer": view_layer or context.view_layer.name,
+                }
+            return metadata
+
+        def make_request(request_metadata, target_image_name, camera=None, view_layer=None, resolution_percentage=None):
+            # 每个请求使用独立的输出文件，排队中的多次渲染不会互相覆盖
+            render_filename = f"blender_render_{os.getpid()}_{uuid.uuid4().hex[:8]}{extension}"
+            render_path = os.path.join(tempfile.gettempdir(), render_filename)
+
+            def on_complete(request):
+                submitter = _DeferredSubmitter()
+                render_scene = bpy.data.scenes.get(request.scene_name)
+                if render_scene is None or not os.path.exists(request.filepath):
+                    log.error(f"渲染输出不存在: {request.filepath}")
+                    return
+                if send_pixels:
+                    if submitter.send_file_pixels(render_scene, request.filepath, request_metadata, target_image_name) is not None:
+                        return
+                submitter.send_to_comfyui(render_scene, request.filepath, request_metadata, target_image_name)
+
+            def on_cancel(request, reason):
+                # 操作符实例在 execute 返回后即失效，这里不能再引用 self
+                log.warning(f"渲染未完成，不发送到 ComfyUI: {reason}")
+                if os.path.exists(request.filepath):
+                    _DeferredSubmitter()._remove_temp_file(request.filepath)
+
+            return render_queue.RenderRequest(
+                scene.name, render_path, on_complete, on_cancel, file_format=file_format, color_depth=color_depth,
+                resolution_percentage=resolution_percentage, camera=camera, view_layer=view_layer,
+            )
+
+        requests = []
+        for index, (camera, view_layer, target_image_name) in enumerate(shots):
+            metadata = shot_metadata(index, camera, view_layer)
+            if props.use_proxy:
+                # 先以较低的分辨率渲染并发送代理，完整分辨率的渲染排在所有代理之后
+                proxy_percentage = max(1, scene.render.resolution_percentage * props.proxy_scale // 100)
+                proxy_metadata = dict(metadata, proxy={"scale": props.proxy_scale / 100})
+                requests.insert(index, make_request(proxy_metadata, target_image_name, camera, view_layer, proxy_percentage))
+            requests.append(make_request(metadata, target_image_name, camera, view_layer))
+
+        position = 0
+        for offset, request in enumerate(requests):
+            queued_ahead = render_queue.enqueue(request)
+            if not offset:
+                position = queued_ahead
+        if group_id:
+            self.report({'OPERATOR'}, f"[INFO] Render group {group_id}: {len(shots)} renders queued ({position} ahead).")
+        elif position:
+            self.report({'OPERATOR'}, f"[INFO] Render queued ({position} ahead).")
+        else:
+            self.report({'OPERATOR'}, "[INFO] Render started; the result will be sent when it finishes.")
+        return {'FINISHED'}
 
-            else: # STANDARD
-                file_format = render_settings.image_settings.file_format
-                extension = ".jpg" if file_format == 'JPEG' else ".png"
-                metadata["render_type"] = "standard"
-
-            render_filename = f"{render_filename_base}{extension}"
-            render_path = os.path.join(render_dir, render_filename)
-            render_settings.filepath = render_path
-            
-            log.info(f"正在渲染场景到: {render_path}...")
-            bpy.ops.render.render(write_still=True)
-            log.info("渲染完成。")
-
-        except Exception as e:
-            msg = f"Render failed: {e}"
-            self.report({'OPERATOR'}, f"[ERROR] {msg}")
-            log.error(f"渲染操作失败: {e}", exc_info=True)
-            return {'CANCELLED'}
-        finally:
-            render_settings.filepath = original_filepath
-            render_settings.image_settings.file_format = original_format
-            render_settings.image_settings.color_depth = original_color_depth
-            log.info("用户原始渲染设置已恢复。")
-
-        return self.send_to_comfyui(context, render_path, metadata)
+    def _collect_render_shots(self, context):
+        """
+        根据多相机/多视图层设置展开要渲染的组合。
+        :return: [(相机名或 None, 视图层名或 None, 结果图像名)]。None 表示使用场景当前的设置
+        """
+        props = context.scene.bridge_props
+        scene = context.scene
+        target_name = props.target_image_datablock.name
+
+        cameras = [None]
+        if props.fan_out_cameras:
+            selected = [obj.name for obj in context.selected_objects if obj.type == 'CAMERA']
+            cameras = selected or [None]
+        view_layers = [None]
+        if props.fan_out_view_layers:
+            enabled = [layer.name for layer in scene.view_layers if layer.use]
+            view_layers = enabled or [None]
+
+        width = scene.render.resolution_x * scene.render.resolution_percentage // 100
+        height = scene.render.resolution_y * scene.render.resolution_percentage // 100
+        shots = []
+        for camera in cameras:
+            for view_layer in view_layers:
+                suffix = "".join(f"_{name}" for name in (camera, view_layer) if name)
+                if suffix:
+                    tasks.ensure_result_image(f"{target_name}{suffix}", width, height)
+                shots.append((camera, view_layer, f"{target_name}{suffix}"))
+        return shots
 
     def execute_send_image(self, context):
         image = get_active_image_from_editor(context)
@@ -261,79 +696,77 @@ class BRIDGE_OT_SendData(bpy.types.Operator):
             log.error("在图像编辑器中没有找到活动的图像。")
             return {'CANCELLED'}
 
-        temp_dir = tempfile.gettempdir()
-        image_path = ""
-        
-        if image.source == 'FILE' and image.filepath:
-            image_path = os.path.abspath(bpy.path.abspath(image.filepath))
-        else:
-            try:
-                filename = f"blender_image_{image.name.replace(' ', '_')}_{os.getpid()}.png"
-                temp_path = os.path.join(temp_dir, filename)
-                
-                if image.is_dirty:
-                    image.update()
-
-                image.save_render(filepath=temp_path, scene=context.scene)
-                image_path = temp_path
-                log.info(f"图像 '{image.name}' 已临时保存到: {image_path}")
-            except Exception as e:
-                msg = f"Failed to save image: {e}"
-                self.report({'OPERATOR'}, f"[ERROR] {msg}")
-                log.error(f"保存图像 '{image.name}' 失败: {e}", exc_info=True)
-                return {'CANCELLED'}
-        
-        return self.send_to_comfyui(context, image_path, {"render_type": "direct_image"})
+        props = context.scene.bridge_props
+        if props.use_proxy and not _use_shared_memory(props):
+            # 先发送低分辨率代理，完整分辨率的任务紧随其后
+            self.send_proxy(context.scene, image, {"render_type": "direct_image"})
+
+        result = self.send_image(context.scene, image, {"render_type": "direct_image"})
+        if result is not None:
+            return result
+
+        # 没有像素缓冲区的图像 (例如 Render Result) 只能通过 save_render 保存
+        return self.send_saved_render(context.scene, image, {"render_type": "direct_image"})
+
+class BRIDGE_OT_SendImageBatch(_JobSubmitter, bpy.types.Operator):
+    """将一组图像作为一批任务发送到ComfyUI，每张图像的结果写入各自的结果图像"""
+    bl_idname = "bridge.send_image_batch"
+    bl_label = "批量发送图像"
+    bl_description = "将一组图像作为一批任务发送到 ComfyUI，每张图像的结果写入 '图像名+后缀' 的结果图像"
 
-    def send_to_comfyui(self, context, file_path, user_metadata=None):
+    @classmethod
+    def poll(cls, context):
+        if not hasattr(context, 'scene') or not context.scene:
+            return False
+        return context.scene.bridge_props.connection_status == 'CONNECTED'
+
+    def execute(self, context):
         props = context.scene.bridge_props
-        image_data = None
-        
-        success, msg = _ensure_ssh_tunnel(props)
-        if not success:
-            self.report({'OPERATOR'}, f"[ERROR] {msg}")
-            log.error(msg)
+        images = collect_batch_images(context, props)
+        if not images:
+            self.report({'OPERATOR'}, "[ERROR] No images match the batch source.")
             return {'CANCELLED'}
-
-        try:
-            with open(file_path, 'rb') as f:
-                image_data = f.read()
-        except Exception as e:
-            msg = f"Failed to read file: {file_path}. Reason: {e}"
-            self.report({'OPERATOR'}, f"[ERROR] {msg}")
-            log.error(f"读取文件 '{file_path}' 失败: {e}", exc_info=True)
+        # 隧道只在排队之前检查一次，而不是为每张图像各检查一次
+        if not self.ensure_tunnel(props):
             return {'CANCELLED'}
 
-        blender_server_address = _get_blender_callback_address(props)
-        metadata = {
-            "type": "render_and_return",
-            "filename": os.path.basename(file_path),
-            "return_info": {
-                "blender_server_address": blender_server_address,
-                "image_datablock_name": props.target_image_datablock.name
+        spool.get_spool(props.spool_size_mb * 1024 * 1024)
+        if props.return_mode == 'HTTP':
+            _ensure_receiver(props)
+
+        # 所有像素先在主线程读取，编码在编码线程池中并行进行，调度器按顺序流水线式发送
+        batch_id = uuid.uuid4().hex[:12]
+        queued = 0
+        for index, image in enumerate(images):
+            target_name = f"{image.name}{props.batch_result_suffix}"
+            tasks.ensure_result_image(target_name, *image.size)
+            metadata = {
+                "render_type": "direct_image",
+                "batch": {"id": batch_id, "index": index, "count": len(images), "source_image": image.name},
             }
-        }
-        if user_metadata is not None:
-            metadata.update(user_metadata)
-        
-        target_address = _get_comfyui_address(props)
-        log.info(f"准备发送数据到: {target_address}")
-        log.debug(f"构建的元数据: {metadata}")
-        success = comms.send_data(target_address, metadata, image_data)
-        if success:
-            msg = "Data sent to ComfyUI successfully."
-            self.report({'OPERATOR'}, f"[INFO] {msg}")
-            log.info("数据已成功发送到 ComfyUI。")
-        else:
-            msg = "Failed to send data! Please check the console log."
-            self.report({'OPERATOR'}, f"[ERROR] {msg}")
-            log.error("数据发送失败！请检查控制台日志。")
-        
-        if tempfile.gettempdir() in os.path.abspath(file_path):
-            try:
-                os.remove(file_path)
-                log.info(f"已删除临时文件: {file_path}")
-            except OSError as e:
-                log.warning(f"删除临时文件失败: {file_path}. 原因: {e}")
+            result = self.send_image(context.scene, image, metadata, target_name)
+            if result == {'FINISHED'}:
+                queued += 1
+            elif result is None:
+                log.warning(f"图像 '{image.name}' 没有可发送的像素，已跳过。")
+
+        if not queued:
+            self.report({'OPERATOR'}, "[ERROR] None of the batch images could be sent.")
+            return {'CANCELLED'}
+        self.report({'OPERATOR'}, f"[INFO] Batch {batch_id}: {queued}/{len(images)} images queued for ComfyUI.")
+        return {'FINISHED'}
 
+class BRIDGE_OT_CancelJob(bpy.types.Operator):
+    """取消一个排队中或进行中的任务"""
+    bl_idname = "bridge.cancel_job"
+    bl_label = "取消任务"
+    bl_description = "取消一个排队中或进行中的任务"
+
+    job_id: bpy.props.StringProperty(options={'HIDDEN'})
+
+    def execute(self, context):
+        if scheduler.get_scheduler().cancel(self.job_id):
+            self.report({'OPERATOR'}, f"[INFO] Job {self.job_id} cancelled.")
+        else:
+            self.report({'OPERATOR'}, f"[WARNING] Job {self.job_id} is not active.")
         return {'FINISHED'}
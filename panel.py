@@ -1,4 +1,17 @@
 import bpy
+import fnmatch
+from bpy.app.handlers import persistent
+from .utils import scheduler, cache, progress, render_queue, state
+
+# 任务状态对应的图标和显示文本
+_JOB_STATUS_DISPLAY = {
+    'QUEUED': ("排队中", 'SORTTIME'),
+    'SENDING': ("发送中", 'EXPORT'),
+    'WAITING': ("处理中", 'TIME'),
+    'DONE': ("已完成", 'CHECKMARK'),
+    'FAILED': ("失败", 'ERROR'),
+    'CANCELLED': ("已取消", 'CANCEL'),
+}
 
 # 一个辅助函数，用于获取当前活动的图像编辑器中的图像
 def get_active_image_from_editor(context):
@@ -8,6 +21,68 @@ def get_active_image_from_editor(context):
                 return area.spaces.active.image
     return None
 
+def collect_batch_images(context, props):
+    """按批量来源设置收集要发送的图像，排除之前批量发送产生的结果图像。"""
+    images = []
+    if props.batch_source == 'EDITORS':
+        for window in context.window_manager.windows:
+            for area in window.screen.areas:
+                if area.type == 'IMAGE_EDITOR' and area.spaces.active and area.spaces.active.image:
+                    images.append(area.spaces.active.image)
+    elif props.batch_source == 'PATTERN':
+        images = [image for image in bpy.data.images if fnmatch.fnmatchcase(image.name, props.batch_pattern)]
+    elif props.batch_source == 'COLLECTION' and props.batch_collection:
+        # 集合中物体的材质所使用的图像纹理
+        for obj in props.batch_collection.all_objects:
+            for slot in obj.material_slots:
+                material = slot.material
+                if not material or not material.node_tree:
+                    continue
+                for node in material.node_tree.nodes:
+                    if node.type == 'TEX_IMAGE' and node.image:
+                        images.append(node.image)
+
+    suffix = props.batch_result_suffix
+    unique = []
+    for image in images:
+        if image in unique or image.type not in ('IMAGE', 'UV_TEST'):
+            continue
+        if suffix and image.name.endswith(suffix):
+            continue
+        unique.append(image)
+    return unique
+
+# 面板每次重绘都要显示批量发送的图像数量。结果按设置缓存，场景数据或选择改变 (depsgraph 更新) 时失效
+_batch_generation = 0
+_batch_cache = {"key": None, "count": 0}
+
+@persistent
+def _invalidate_batch_cache(*args):
+    global _batch_generation
+    _batch_generation += 1
+
+def cached_batch_image_count(context, props):
+    """返回 collect_batch_images 的图像数量，只在设置、图像编辑器中的图像或场景数据改变后重新收集。"""
+    key = (
+        _batch_generation,
+        props.batch_source,
+        props.batch_pattern,
+        props.batch_collection.name if props.batch_collection else None,
+        props.batch_result_suffix,
+    )
+    if props.batch_source == 'EDITORS':
+        # 切换图像编辑器中的图像不会触发 depsgraph 更新
+        key += tuple(
+            area.spaces.active.image.name
+            for window in context.window_manager.windows
+            for area in window.screen.areas
+            if area.type == 'IMAGE_EDITOR' and area.spaces.active and area.spaces.active.image
+        )
+    if _batch_cache["key"] != key:
+        _batch_cache["key"] = key
+        _batch_cache["count"] = len(collect_batch_images(context, props))
+    return _batch_cache["count"]
+
 class BRIDGE_PT_MainPanel(bpy.types.Panel):
     bl_label = "ComfyUI Bridge"
     bl_idname = "BRIDGE_PT_MainPanel"
@@ -28,6 +103,15 @@ class BRIDGE_PT_MainPanel(bpy.types.Panel):
         if status == 'DISCONNECTED': row.label(text="未连接", icon='RADIOBUT_OFF')
         elif status == 'CONNECTED': row.label(text="已连接", icon='RADIOBUT_ON')
         elif status == 'FAILED': row.label(text="连接失败", icon='ERROR')
+
+        # 后台健康检查的最新结果 (只读取缓存的数据，不会阻塞界面)。
+        # 绘制面板不应创建调度器并启动其线程，尚未发送过任务时没有这些信息
+        job_scheduler = scheduler.current_scheduler()
+        summary = job_scheduler.pool.summary() if job_scheduler else None
+        if summary and summary[0] == 'CONNECTED':
+            _, rtt, load = summary
+            rtt_text = f"{rtt * 1000:.0f} ms" if rtt is not None else "-"
+            box.label(text=f"延迟: {rtt_text}  负载: {load}", icon='BLANK1')
         
         box.operator("bridge.test_connection", text="测试连接", icon='FILE_REFRESH')
 
@@ -42,7 +126,25 @@ class BRIDGE_PT_MainPanel(bpy.types.Panel):
             col = box.column(align=True)
             col.enabled = is_ready_for_send
             col.prop(props, "render_mode")
-            col.operator("bridge.send_data", text="渲染并发送", icon='RENDER_STILL')
+            col.prop(props, "job_priority")
+            row = col.row(align=True)
+            row.prop(props, "fan_out_cameras", toggle=True, icon='OUTLINER_OB_CAMERA')
+            row.prop(props, "fan_out_view_layers", toggle=True, icon='RENDERLAYERS')
+            row = col.row(align=True)
+            row.prop(props, "use_proxy")
+            sub = row.row(align=True)
+            sub.active = props.use_proxy
+            sub.prop(props, "proxy_scale", text="")
+            render_count = 1
+            if props.fan_out_cameras:
+                render_count *= max(1, sum(1 for obj in context.selected_objects if obj.type == 'CAMERA'))
+            if props.fan_out_view_layers:
+                render_count *= max(1, sum(1 for layer in context.scene.view_layers if layer.use))
+            text = f"渲染并发送 ({render_count} 个)" if render_count > 1 else "渲染并发送"
+            col.operator("bridge.send_data", text=text, icon='RENDER_STILL')
+            queued_renders = render_queue.pending_count()
+            if queued_renders:
+                col.label(text=f"渲染队列: {queued_renders} 个", icon='RENDER_ANIMATION')
         
         elif props.source_mode == 'IMAGE_EDITOR':
             col = box.column(align=True)
@@ -55,14 +157,88 @@ class BRIDGE_PT_MainPanel(bpy.types.Panel):
             else:
                 col.label(text="请在图像编辑器中选择图像", icon='INFO')
             
+            col.prop(props, "job_priority")
+            col.prop(props, "png_compression")
+            row = col.row(align=True)
+            row.prop(props, "use_proxy")
+            sub = row.row(align=True)
+            sub.active = props.use_proxy
+            sub.prop(props, "proxy_scale", text="")
             op = col.operator("bridge.send_data", text="发送当前图像", icon='IMAGE_DATA')
             if not active_image:
                 op.enabled = False
 
+            # --- 批量发送 ---
+            col = box.column(align=True)
+            col.enabled = props.connection_status == 'CONNECTED'
+            col.separator()
+            col.label(text="批量发送", icon='DOCUMENTS')
+            col.prop(props, "batch_source", text="")
+            if props.batch_source == 'PATTERN':
+                col.prop(props, "batch_pattern")
+            elif props.batch_source == 'COLLECTION':
+                col.prop(props, "batch_collection")
+            col.prop(props, "batch_result_suffix")
+            count = cached_batch_image_count(context, props)
+            col.operator("bridge.send_image_batch", text=f"批量发送 ({count} 张)", icon='EXPORT')
+
+        # --- 参数扫描 ---
+        col = box.column(align=True)
+        col.enabled = is_ready_for_send
+        col.separator()
+        col.prop(props, "use_sweep")
+        if props.use_sweep:
+            row = col.row(align=True)
+            row.prop(props, "sweep_parameter", text="")
+            row.prop(props, "sweep_target", text="")
+            col.prop(props, "sweep_values", text="")
+
+        # --- 任务列表 ---
+        jobs = job_scheduler.snapshot() if job_scheduler else []
+        if jobs:
+            box = layout.box()
+            box.label(text="任务列表", icon='SEQ_STRIP_DUPLICATE')
+            for job in reversed(jobs):
+                text, icon = _JOB_STATUS_DISPLAY.get(job.status, (job.status, 'QUESTION'))
+                row = box.row(align=True)
+                row.label(text=f"{job.label} ({text})", icon=icon)
+                if job.is_active:
+                    op = row.operator("bridge.cancel_job", text="", icon='X')
+                    op.job_id = job.id
+                entry = progress.get_board().get(job.id) if job.status == 'WAITING' else None
+                if entry:
+                    factor, text = progress.describe(entry)
+                    if factor is not None:
+                        box.progress(factor=factor, type='BAR', text=text)
+                    else:
+                        box.label(text=text, icon='BLANK1')
+
         # --- 接收设置 ---
         box = layout.box()
         box.label(text="结果接收", icon='IMPORT')
         box.prop(props, "target_image_datablock")
+        box.prop(props, "batch_target")
+        box.prop(props, "stream_tiles")
+        row = box.row(align=True)
+        row.prop(props, "use_result_cache")
+        row.prop(props, "cache_size_mb", text="上限")
+        if props.use_result_cache:
+            result_cache = cache.get_result_cache()
+            lookups = result_cache.hits + result_cache.misses
+            box.label(
+                text=f"缓存命中率: {result_cache.hits}/{lookups} ({result_cache.hit_rate:.0%})  "
+                     f"占用: {result_cache.total_bytes / 1024 / 1024:.0f} MB",
+                icon='FILE_CACHE',
+            )
+        
+        service = state.receiver_service
+        if props.return_mode == 'HTTP' and service is not None and service.is_running:
+            metrics = service.metrics()
+            box.label(
+                text=f"接收队列: {metrics['queue_depth']} 个结果  {metrics['queued_bytes'] / 1024 / 1024:.0f} MB  "
+                     f"上传中: {metrics['active_uploads']}  已拒绝: {metrics['rejected']}",
+                icon='SORTTIME',
+            )
         
         # --- 提示信息 ---
         if not is_ready_for_send:
@@ -83,8 +259,40 @@ class BRIDGE_PT_MainPanel(bpy.types.Panel):
 
         if props.show_connection_settings:
             settings_box.prop(props, "comfyui_address")
-            settings_box.prop(props, "blender_receiver_port")
-            settings_box.prop(props, "public_address_override")
+            settings_box.prop(props, "extra_comfyui_addresses")
+            endpoints = job_scheduler.pool.snapshot() if job_scheduler else []
+            if len(endpoints) > 1:
+                col = settings_box.column(align=True)
+                for address, healthy, rtt, load in endpoints:
+                    icon = 'QUESTION' if healthy is None else ('CHECKMARK' if healthy else 'ERROR')
+                    rtt_text = f"{rtt * 1000:.0f} ms" if rtt is not None else "-"
+                    col.label(text=f"{address}  延迟: {rtt_text}  负载: {load}", icon=icon)
+            settings_box.prop(props, "use_ipc")
+            settings_box.prop(props, "use_resumable_upload")
+            settings_box.prop(props, "pixel_transport")
+            if props.pixel_transport == 'RAW':
+                row = settings_box.row(align=True)
+                row.prop(props, "raw_dtype", text="")
+                row.prop(props, "raw_planar")
+            settings_box.prop(props, "return_mode")
+            if props.return_mode == 'HTTP':
+                settings_box.prop(props, "blender_receiver_port")
+                row = settings_box.row(align=True)
+                row.prop(props, "receiver_max_uploads")
+                row.prop(props, "receiver_max_queued_mb", text="上限 (MB)")
+                settings_box.prop(props, "public_address_override")
+                settings_box.prop(props, "progress_port")
+            settings_box.prop(props, "spool_size_mb")
+            row = settings_box.row(align=True)
+            row.prop(props, "enable_profiling")
+            sub = row.row(align=True)
+            sub.active = props.enable_profiling
+            sub.prop(props, "profile_dir", text="")
+            row = settings_box.row(align=True)
+            row.prop(props, "enable_trace")
+            sub = row.row(align=True)
+            sub.active = props.enable_trace
+            sub.prop(props, "trace_path", text="")
 
         # --- SSH 设置 (可折叠) ---
         ssh_box = layout.box()
@@ -108,7 +316,8 @@ class BRIDGE_PT_MainPanel(bpy.types.Panel):
                 col.prop(props, "ssh_key_path")
                 col.label(text="注意: 插件会自动处理端口转发。", icon='INFO')
                 col.label(text="ComfyUI地址应设为远程服务器的地址(如127.0.0.1:5555)。", icon='INFO')
-                col.label(text="Blender接收端口将自动在远程服务器上映射。", icon='INFO')
+                if props.return_mode == 'HTTP':
+                    col.label(text="Blender接收端口将自动在远程服务器上映射。", icon='INFO')
 
 # --- 注册 ---
 panel_classes = (
@@ -120,8 +329,14 @@ def register():
     bpy.types.Scene.get_active_image_from_editor = get_active_image_from_editor
     for cls in panel_classes:
         bpy.utils.register_class(cls)
+    for handlers in (bpy.app.handlers.depsgraph_update_post, bpy.app.handlers.load_post):
+        if _invalidate_batch_cache not in handlers:
+            handlers.append(_invalidate_batch_cache)
 
 def unregister():
+    for handlers in (bpy.app.handlers.depsgraph_update_post, bpy.app.handlers.load_post):
+        if _invalidate_batch_cache in handlers:
+            handlers.remove(_invalidate_batch_cache)
     for cls in reversed(panel_classes):
         bpy.utils.unregister_class(cls)
     if hasattr(bpy.types.Scene, 'get_active_image_from_editor'):
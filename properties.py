@@ -1,12 +1,49 @@
 import bpy
-from .utils import state
+from .utils import state, cache, spool, comms, profiling, trace
+
+def cache_size_update_callback(self, context):
+    """修改缓存容量时立即按新上限淘汰旧条目"""
+    cache.get_result_cache(self.cache_size_mb * 1024 * 1024)
+    return None
+
+def spool_size_update_callback(self, context):
+    """修改暂存目录上限时立即生效"""
+    spool.get_spool(self.spool_size_mb * 1024 * 1024)
+    return None
+
+def ipc_update_callback(self, context):
+    """将是否启用 ipc:// 的设置同步到后台线程使用的通信模块"""
+    comms.ipc_enabled = self.use_ipc
+    return None
+
+def resumable_update_callback(self, context):
+    """将是否使用可续传上传的设置同步到后台线程使用的通信模块"""
+    comms.resumable_enabled = self.use_resumable_upload
+    return None
+
+def profiling_update_callback(self, context):
+    """启用或关闭性能分析"""
+    profiling.configure(self.enable_profiling, bpy.path.abspath(self.profile_dir) if self.profile_dir else "")
+    return None
+
+def trace_update_callback(self, context):
+    """开始或停止记录通信轨迹"""
+    trace.configure(self.enable_trace, bpy.path.abspath(self.trace_path) if self.trace_path else "")
+    return None
+
+def receiver_limits_update_callback(self, context):
+    """接收服务器在运行时立即应用新的准入限制"""
+    if state.receiver_service is not None:
+        state.receiver_service.set_limits(self.receiver_max_uploads, self.receiver_max_queued_mb * 1024 * 1024)
+    return None
 
 def port_update_callback(self, context):
     """当用户在UI上修改端口号时，此函数被调用"""
     # 'self' 是属性组 (BridgeProperties) 的实例
     new_port = self.blender_receiver_port
-    # 使用 state 模块中的函数来安全地重启服务器
-    state.start_receiver_server(new_port)
+    # 接收服务器只在已经运行时才需要切换端口；切换时会先排空旧端口上的上传
+    if state.receiver_service is not None and state.receiver_service.is_running:
+        state.ensure_receiver_server(new_port)
     return None
 
 class BridgeProperties(bpy.types.PropertyGroup):
@@ -19,6 +56,12 @@ class BridgeProperties(bpy.types.PropertyGroup):
         default="127.0.0.1:5555",
     )
 
+    extra_comfyui_addresses: bpy.props.StringProperty(
+        name="其他 ComfyUI 服务器",
+        description="额外的 ComfyUI 服务器地址，用逗号分隔 (例如: 192.168.1.20:5555, 192.168.1.21:5555)。任务会分发到负载最低的健康服务器。使用SSH隧道时忽略",
+        default="",
+    )
+
     blender_receiver_port: bpy.props.IntProperty(
         name="Blender 接收端口",
         description="Blender 用于接收返回图像的端口",
@@ -28,6 +71,82 @@ class BridgeProperties(bpy.types.PropertyGroup):
         update=port_update_callback,
     )
 
+    receiver_max_uploads: bpy.props.IntProperty(
+        name="最多同时上传",
+        description="接收服务器同时接收的结果上传数量上限，超出时回复 503 并让 ComfyUI 稍后重试",
+        default=8,
+        min=1,
+        max=64,
+        update=receiver_limits_update_callback,
+    )
+
+    receiver_max_queued_mb: bpy.props.IntProperty(
+        name="待应用结果上限 (MB)",
+        description="已接收但尚未应用到 Blender 的结果总大小上限。超出时新的结果会被拒绝 (503 Retry-After)，防止大批量任务耗尽内存和磁盘",
+        default=1024,
+        min=16,
+        update=receiver_limits_update_callback,
+    )
+
+    use_ipc: bpy.props.BoolProperty(
+        name="本机使用 IPC",
+        description="ComfyUI 运行在本机时，自动改用 Unix 域套接字 (ipc://) 传输数据，无法使用时回退到 TCP",
+        default=True,
+        update=ipc_update_callback,
+    )
+
+    pixel_transport: bpy.props.EnumProperty(
+        name="像素传输",
+        description="发送图像像素的方式",
+        items=[
+            ('ENCODED', "编码文件", "将图像编码为 PNG/JPG/EXR 文件后发送"),
+            ('RAW', "原始数组", "直接发送 float16/float32 像素数组，两端都不需要编码和解码，适合快速的本地或局域网连接"),
+            ('SHARED_MEMORY', "共享内存", "ComfyUI 运行在本机时，像素直接写入共享内存，消息只携带段名和形状；无法使用时回退到编码文件"),
+        ],
+        default='ENCODED',
+    )
+
+    raw_dtype: bpy.props.EnumProperty(
+        name="数组类型",
+        description="原始数组传输使用的像素数据类型",
+        items=[
+            ('FLOAT16', "float16", "半精度，数据量减半"),
+            ('FLOAT32', "float32", "单精度，与 Blender 内部精度一致"),
+        ],
+        default='FLOAT16',
+    )
+
+    raw_planar: bpy.props.BoolProperty(
+        name="每通道一帧",
+        description="将每个通道 (R、G、B、A) 作为单独的消息帧发送，而不是交错排列",
+        default=False,
+    )
+
+    use_resumable_upload: bpy.props.BoolProperty(
+        name="可续传上传",
+        description="大于 8 MB 的数据分块上传，SSH 隧道或网络中断后从服务器已确认的位置继续，而不是从头重新发送。服务器不支持时自动回退",
+        default=True,
+        update=resumable_update_callback,
+    )
+
+    return_mode: bpy.props.EnumProperty(
+        name="结果返回方式",
+        description="ComfyUI 将处理结果返回给 Blender 的方式",
+        items=[
+            ('HTTP', "HTTP 回调", "ComfyUI 将结果 POST 到 Blender 的接收端口 (使用SSH时需要反向隧道)"),
+            ('ZMQ', "ZMQ 同一连接", "结果通过提交任务的同一个 ZMQ 连接返回，无需接收端口和反向隧道"),
+        ],
+        default='HTTP',
+    )
+
+    progress_port: bpy.props.IntProperty(
+        name="进度端口",
+        description="ComfyUI 发布进度事件的 ZMQ PUB 端口 (HTTP 返回模式)。0 表示不订阅。ZMQ 返回模式下进度直接通过任务连接返回",
+        default=0,
+        min=0,
+        max=65535,
+    )
+
     public_address_override: bpy.props.StringProperty(
         name="公网/覆盖地址",
         description="如果 Blender 和 ComfyUI 不在同一台机器或 Docker 网络中，请在此处指定 Blender 所在机器可被 ComfyUI 访问到的地址（不含端口）",
@@ -103,6 +222,22 @@ class BridgeProperties(bpy.types.PropertyGroup):
         type=bpy.types.Image
     )
 
+    batch_target: bpy.props.EnumProperty(
+        name="批量结果",
+        description="ComfyUI 一次返回多张图像时的应用方式",
+        items=[
+            ('DATABLOCKS', "多个数据块", "第一张写入目标图像，其余写入 '目标名_001'、'目标名_002' 等数据块"),
+            ('SEQUENCE', "图像序列", "将所有结果作为图像序列应用到目标图像"),
+        ],
+        default='DATABLOCKS',
+    )
+
+    stream_tiles: bpy.props.BoolProperty(
+        name="渐进显示结果",
+        description="请求 ComfyUI 在结果生成过程中按分块或逐遍返回，到达的区域直接写入目标图像，不必等待完整结果",
+        default=False,
+    )
+
     source_mode: bpy.props.EnumProperty(
         name="数据源",
         description="选择要发送到 ComfyUI 的数据来源",
@@ -113,6 +248,35 @@ class BridgeProperties(bpy.types.PropertyGroup):
         default='RENDER',
     )
 
+    batch_source: bpy.props.EnumProperty(
+        name="批量来源",
+        description="批量发送时要发送哪些图像",
+        items=[
+            ('EDITORS', "打开的图像", "所有图像编辑器中当前显示的图像"),
+            ('PATTERN', "名称匹配", "名称与通配符模式匹配的所有图像"),
+            ('COLLECTION', "集合纹理", "集合中物体的材质所使用的图像纹理"),
+        ],
+        default='EDITORS',
+    )
+
+    batch_pattern: bpy.props.StringProperty(
+        name="名称模式",
+        description="通配符模式，例如 'ref_*' 或 '*.png'",
+        default="*",
+    )
+
+    batch_collection: bpy.props.PointerProperty(
+        name="集合",
+        description="发送此集合中物体的材质所使用的图像纹理",
+        type=bpy.types.Collection,
+    )
+
+    batch_result_suffix: bpy.props.StringProperty(
+        name="结果后缀",
+        description="每张图像的结果写入 '图像名+后缀' 的图像数据块 (不存在时自动创建)。名称带此后缀的图像不会被批量发送",
+        default="_comfyui",
+    )
+
     render_mode: bpy.props.EnumProperty(
         name="渲染模式",
         description="选择渲染输出的格式",
@@ -122,3 +286,130 @@ class BridgeProperties(bpy.types.PropertyGroup):
         ],
         default='STANDARD',
     )
+
+    use_sweep: bpy.props.BoolProperty(
+        name="参数扫描",
+        description="只上传一次图像，连同一组参数变体 (例如多个种子或提示词) 发送，由 ComfyUI 为每个变体各运行一次工作流并逐个返回结果",
+        default=False,
+    )
+
+    sweep_parameter: bpy.props.StringProperty(
+        name="参数",
+        description="要扫描的工作流参数名 (例如 seed、prompt、cfg)",
+        default="seed",
+    )
+
+    sweep_values: bpy.props.StringProperty(
+        name="变体",
+        description="参数的各个取值，用逗号分隔 (例如 1, 2, 3, 4)；值中需要逗号时 (例如提示词) 改用 '|' 分隔",
+        default="1, 2, 3, 4",
+    )
+
+    sweep_target: bpy.props.EnumProperty(
+        name="扫描结果",
+        description="参数扫描结果的应用方式",
+        items=[
+            ('DATABLOCKS', "多个数据块", "第一个变体写入目标图像，其余写入 '目标名_001'、'目标名_002' 等数据块"),
+            ('CONTACT_SHEET', "缩略图", "所有变体按网格拼成一张 '目标名_sheet' 图像，每返回一个结果更新一次"),
+        ],
+        default='DATABLOCKS',
+    )
+
+    fan_out_cameras: bpy.props.BoolProperty(
+        name="所有选中的相机",
+        description="为每个选中的相机各渲染一次，作为一组任务并行发送。结果写入 '目标名_相机名' 的图像数据块 (不存在时自动创建)",
+        default=False,
+    )
+
+    fan_out_view_layers: bpy.props.BoolProperty(
+        name="所有视图层",
+        description="为每个启用渲染的视图层各渲染一次 (多通道 EXR 时分别构建通道映射表)，作为一组任务并行发送。结果写入 '目标名_视图层名' 的图像数据块",
+        default=False,
+    )
+
+    use_proxy: bpy.props.BoolProperty(
+        name="先发送低分辨率代理",
+        description="先发送一个缩小的代理并尽快显示其结果，完整分辨率的任务随后自动发送并替换代理结果",
+        default=False,
+    )
+
+    proxy_scale: bpy.props.IntProperty(
+        name="代理比例",
+        description="代理相对于完整分辨率的比例",
+        default=25,
+        min=5,
+        max=90,
+        subtype='PERCENTAGE',
+    )
+
+    png_compression: bpy.props.IntProperty(
+        name="PNG 压缩级别",
+        description="发送图像编辑器中生成或修改过的图像时使用的 zlib 压缩级别 (0-9)。级别越高文件越小，但编码越慢；编码在后台线程进行，不会阻塞界面",
+        default=1,
+        min=0,
+        max=9,
+    )
+
+    job_priority: bpy.props.EnumProperty(
+        name="任务优先级",
+        description="交互式任务会优先于批处理任务发送",
+        items=[
+            ('INTERACTIVE', "交互预览", "优先发送，插队到批处理任务之前"),
+            ('BATCH', "批处理", "在交互式任务空闲时发送"),
+        ],
+        default='INTERACTIVE',
+    )
+
+    # --- 调试 ---
+    enable_profiling: bpy.props.BoolProperty(
+        name="性能分析",
+        description="用 cProfile 和 tracemalloc 记录发送操作、网络发送、结果接收和结果应用，每次调用写入一个分析文件 (会明显降低速度，仅用于排查问题)",
+        default=False,
+        update=profiling_update_callback,
+    )
+
+    profile_dir: bpy.props.StringProperty(
+        name="分析输出目录",
+        description="性能分析文件的输出目录，留空时使用系统临时目录",
+        default="",
+        subtype='DIR_PATH',
+        update=profiling_update_callback,
+    )
+
+    enable_trace: bpy.props.BoolProperty(
+        name="记录通信轨迹",
+        description="记录每个任务的元数据、负载大小和哈希以及每条消息的时间 (不记录图像内容)，可以用 'python -m utils.replay' 在没有 Blender 和 ComfyUI 的情况下回放",
+        default=False,
+        update=trace_update_callback,
+    )
+
+    trace_path: bpy.props.StringProperty(
+        name="轨迹文件",
+        description="轨迹文件路径，留空时在系统临时目录中为每次记录新建一个文件",
+        default="",
+        subtype='FILE_PATH',
+        update=trace_update_callback,
+    )
+
+    # --- 结果缓存 ---
+    use_result_cache: bpy.props.BoolProperty(
+        name="使用结果缓存",
+        description="相同的输入和参数直接使用本地缓存的结果，不再发送到 ComfyUI。需要服务器在 ping 回复中报告工作流哈希 (workflow_hash)，否则不缓存",
+        default=False,
+    )
+
+    cache_size_mb: bpy.props.IntProperty(
+        name="缓存上限 (MB)",
+        description="结果缓存占用磁盘空间的上限，超出时淘汰最久未使用的结果",
+        default=1024,
+        min=16,
+        update=cache_size_update_callback,
+    )
+
+    spool_size_mb: bpy.props.IntProperty(
+        name="暂存上限 (MB)",
+        description="等待应用的结果在暂存目录中占用磁盘空间的上限，超出时接收端暂时拒绝新的结果 (503)，由服务器稍后重试",
+        default=2048,
+        min=64,
+        update=spool_size_update_callback,
+    )
@@ -0,0 +1,153 @@
+"""
+接收端的准入控制：分块传输和 multipart 请求体按实际读取的字节计入上限，
+每次 503 拒绝都计入 rejected，替身服务器按 Retry-After 重试，过载时不丢失结果。
+
+    python -m unittest discover -s tests
+"""
+import base64
+import os
+import queue
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import replay, state  # noqa: E402
+from utils.receiver import ReceiverService  # noqa: E402
+from utils.spool import get_spool  # noqa: E402
+from test_failover import wait_for  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def drain_task_queue():
+    """取出任务队列中的所有结果并释放暂存文件，返回 [(数据列表, 任务ID)]。"""
+    results = []
+    while True:
+        try:
+            image_paths, _, job_id = state.task_queue.get_nowait()
+        except queue.Empty:
+            return results
+        data = []
+        for image_path in image_paths:
+            with open(image_path, "rb") as f:
+                data.append(f.read())
+            get_spool().release(image_path)
+        results.append((data, job_id))
+
+
+def read_status(sock):
+    """读取一个完整的响应 (接收端的响应都带有 Content-Length)，返回状态码。"""
+    response = b""
+    while b"\r\n\r\n" not in response:
+        data = sock.recv(4096)
+        if not data:
+            break
+        response += data
+    head, _, body = response.partition(b"\r\n\r\n")
+    length = int(head.lower().split(b"content-length:")[1].split(b"\r\n")[0])
+    while len(body) < length:
+        body += sock.recv(4096)
+    return int(head.split(b" ", 2)[1])
+
+
+class ReceiverLimitTest(unittest.TestCase):
+
+    def setUp(self):
+        drain_task_queue()
+        self.addCleanup(drain_task_queue)
+        self.port = replay._free_port()
+        self.service = ReceiverService(max_uploads=8, max_queued_bytes=int(1.4 * MB))
+        self.service.configure(self.port, default_target="target")
+        self.addCleanup(self.service.stop)
+
+    def connect(self):
+        sock = socket.create_connection(("127.0.0.1", self.port), timeout=10)
+        self.addCleanup(sock.close)
+        return sock
+
+    def start_chunked(self, job_id, size):
+        """开始一个分块传输的上传，发送 size 字节后暂停 (不发送结束分块)。"""
+        sock = self.connect()
+        sock.sendall(
+            f"POST / HTTP/1.1\r\nHost: blender\r\nTransfer-Encoding: chunked\r\n"
+            f"Content-Type: image/png\r\nX-Bridge-Job-Id: {job_id}\r\n\r\n{size:x}\r\n".encode("latin-1")
+            + b"x" * size + b"\r\n"
+        )
+        return sock
+
+    def post(self, sock, body, headers=""):
+        sock.sendall(
+            f"POST / HTTP/1.1\r\nHost: blender\r\nContent-Length: {len(body)}\r\n"
+            f"Content-Type: image/png\r\nX-Bridge-Job-Id: small\r\n{headers}\r\n".encode("latin-1") + body
+        )
+        return read_status(sock)
+
+    def test_chunked_upload_reserves_the_bytes_it_has_read(self):
+        chunked = self.start_chunked("chunked", int(1.2 * MB))
+        # 分块上传没有声明大小，已读取的字节也必须计入上限
+        self.assertTrue(wait_for(lambda: self.service.metrics()["queued_bytes"] >= MB))
+        self.assertEqual(self.post(self.connect(), b"y" * (MB // 2), "Connection: close\r\n"), 503)
+
+        chunked.sendall(b"0\r\n\r\n")
+        self.assertEqual(read_status(chunked), 200)
+        # 上传结束后预留被释放，只剩暂存目录中等待应用的结果
+        self.assertTrue(wait_for(lambda: self.service.metrics()["queued_bytes"] == get_spool().total_bytes))
+        self.assertEqual([len(data[0]) for data, _ in drain_task_queue()], [int(1.2 * MB)])
+
+    def test_expect_continue_rejections_are_counted(self):
+        self.service.set_limits(max_uploads=1)
+        chunked = self.start_chunked("chunked", 1024)
+        self.assertTrue(wait_for(lambda: self.service.metrics()["active_uploads"] == 1))
+
+        self.assertEqual(self.post(self.connect(), b"", "Expect: 100-continue\r\n"), 503)
+        self.assertEqual(self.service.metrics()["rejected"], 1)
+        chunked.sendall(b"0\r\n\r\n")
+        self.assertEqual(read_status(chunked), 200)
+
+    def test_chunked_multipart_is_split_from_the_spool(self):
+        boundary = "bridge-test-boundary"
+        first, second = os.urandom(300 * 1024), os.urandom(1000)
+        body = (
+            f"--{boundary}\r\nContent-Type: image/png\r\nX-Bridge-Job-Id: a\r\n\r\n".encode("latin-1") + first
+            + f"\r\n--{boundary}\r\nContent-Type: image/png\r\nX-Bridge-Job-Id: a\r\n"
+              f"Content-Transfer-Encoding: base64\r\n\r\n".encode("latin-1") + base64.encodebytes(second)
+            + f"\r\n--{boundary}--\r\n".encode("latin-1")
+        )
+        sock = self.connect()
+        sock.sendall(
+            f"POST / HTTP/1.1\r\nHost: blender\r\nTransfer-Encoding: chunked\r\nX-Bridge-Job-Id: a\r\n"
+            f"Content-Type: multipart/mixed; boundary={boundary}\r\n\r\n{len(body):x}\r\n".encode("latin-1")
+            + body + b"\r\n0\r\n\r\n"
+        )
+        self.assertEqual(read_status(sock), 200)
+        self.assertEqual(drain_task_queue(), [([first, second], "a")])
+        # 暂存的请求体在拆分后立即释放
+        self.assertEqual(get_spool().total_bytes, 0)
+
+
+class ReplayBackpressureTest(unittest.TestCase):
+
+    def test_stand_in_retries_rejected_results(self):
+        events = []
+        for index in range(4):
+            job_id = f"job-{index}"
+            events.append({
+                "kind": "send", "t": index * 0.01, "start": index * 0.01, "duration": 0.001, "size": 1000,
+                "job_id": job_id, "sha": job_id, "metadata": {"type": "render_and_return"},
+            })
+            events.append({"kind": "result", "t": index * 0.01 + 0.05, "job_id": job_id, "size": 256 * 1024})
+
+        # 上限只够一个结果等待应用，主线程应用每个结果需要 0.2 秒，其余结果先被 503 拒绝，按 Retry-After 重试
+        jobs, metrics = replay.replay(events, timeout=30, apply_delay=0.2, max_queued_bytes=300 * 1024)
+        summary = replay.summarize(jobs, metrics)
+
+        self.assertEqual(summary["failed"], 0)
+        self.assertEqual(summary["missing_results"], 0)
+        self.assertGreater(summary["result_retries"], 0)
+        self.assertEqual(metrics["rejected"], summary["result_retries"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+结果缓存键：必须包含服务器报告的工作流哈希，服务器没有报告时不缓存。
+
+    python -m unittest discover -s tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import cache  # noqa: E402
+from utils.pool import EndpointPool  # noqa: E402
+from utils.replay import StandInServer  # noqa: E402
+
+
+class MakeKeyTest(unittest.TestCase):
+
+    def test_no_workflow_hash_means_no_key(self):
+        self.assertIsNone(cache.make_key(b"payload", {"type": "render_and_return"}, None))
+
+    def test_workflow_hash_is_part_of_the_key(self):
+        metadata = {"type": "render_and_return"}
+        key = cache.make_key(b"payload", metadata, "workflow-a")
+        self.assertEqual(key, cache.make_key(b"payload", metadata, "workflow-a"))
+        self.assertNotEqual(key, cache.make_key(b"payload", metadata, "workflow-b"))
+
+    def test_volatile_metadata_is_ignored(self):
+        key = cache.make_key(b"payload", {"type": "render_and_return", "return_info": {"job_id": "a"}}, "w")
+        self.assertEqual(key, cache.make_key(b"payload", {"type": "render_and_return", "return_info": {"job_id": "b"}}, "w"))
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="bridge-cache-test-")
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, size):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+        return path
+
+    def test_put_with_new_suffix_replaces_the_old_file(self):
+        result_cache = cache.ResultCache(os.path.join(self.directory, "cache"), 1024 * 1024)
+        result_cache.put("key", self.write("result.png", 100))
+        old_path = result_cache.get("key")
+        result_cache.put("key", self.write("result.exr", 300))
+
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(result_cache.get("key").endswith(".exr"))
+        self.assertEqual(result_cache.total_bytes, 300)
+        self.assertEqual(os.listdir(result_cache.directory), ["key.exr"])
+
+
+class PoolWorkflowHashTest(unittest.TestCase):
+
+    def start_server(self, workflow_hash):
+        server = StandInServer(workflow_hash=workflow_hash)
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def check(self, *servers):
+        pool = EndpointPool(ping_timeout=300)
+        pool.set_addresses([server.address for server in servers])
+        for server in servers:
+            pool._check(server.address)
+        return pool
+
+    def test_hash_from_ping_reply(self):
+        server = self.start_server("abc")
+        pool = self.check(server)
+        self.assertEqual(pool.workflow_hash(), "abc")
+        self.assertEqual(pool.workflow_hash(server.address), "abc")
+
+    def test_servers_without_hash_are_not_cacheable(self):
+        pool = self.check(self.start_server(None))
+        self.assertIsNone(pool.workflow_hash())
+
+    def test_servers_with_different_hashes_are_not_cacheable(self):
+        first, second = self.start_server("abc"), self.start_server("def")
+        pool = self.check(first, second)
+        self.assertIsNone(pool.workflow_hash())
+        self.assertEqual(pool.workflow_hash(second.address), "def")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+ZMQ 通道的确认匹配：迟到的确认不能完成其他任务。
+暂存目录超出上限时通道暂停接收结果，恢复后结果和确认都不会丢失。
+
+    python -m unittest discover -s tests
+"""
+import os
+import queue
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import comms, state  # noqa: E402
+from utils.channel import ZmqChannel  # noqa: E402
+from utils.spool import get_spool  # noqa: E402
+
+
+class AckMatchingTest(unittest.TestCase):
+
+    def setUp(self):
+        import msgspec
+
+        self.encode = msgspec.msgpack.encode
+        self.channel = ZmqChannel()
+        self.future = Future()
+        self.channel._pending["job-b"] = ("tcp://server", self.future, time.monotonic() + 10, None)
+
+    def reply(self, header):
+        self.channel._handle_message("tcp://server", [b"", self.encode(header)])
+
+    def test_ack_for_unknown_job_is_dropped(self):
+        # job-a 已经超时或被取消，它的迟到确认和错误都不能算到 job-b 头上
+        self.reply({"status": "ok", "job_id": "job-a"})
+        self.reply({"status": "error", "job_id": "job-a"})
+        self.assertFalse(self.future.done())
+        self.assertIn("job-b", self.channel._pending)
+
+    def test_ack_is_matched_by_job_id(self):
+        self.reply({"status": "ok", "job_id": "job-b"})
+        self.assertTrue(self.future.result(timeout=0))
+
+    def test_ack_without_job_id_falls_back_to_address(self):
+        self.reply({"status": "error"})
+        self.assertFalse(self.future.result(timeout=0))
+        self.assertEqual(self.channel._pending, {})
+
+
+class SpoolPauseTest(unittest.TestCase):
+
+    def setUp(self):
+        import zmq
+        import msgspec
+
+        self.encode, self.decode = msgspec.msgpack.encode, msgspec.msgpack.decode
+        self.router = comms.get_zmq_context().socket(zmq.ROUTER)
+        self.router.setsockopt(zmq.LINGER, 0)
+        self.address = f"127.0.0.1:{self.router.bind_to_random_port('tcp://127.0.0.1')}"
+        self.addCleanup(self.router.close)
+        self.channel = ZmqChannel()
+        self.channel.start()
+        self.addCleanup(self.channel.stop)
+
+    def fill_spool(self):
+        """写入一个未应用的结果并把上限降到它以下，返回恢复原状的函数。"""
+        spool = get_spool()
+        max_bytes = spool.max_bytes
+        path = spool.write(b"unapplied result")
+        spool.set_max_bytes(1)
+
+        def restore():
+            spool.set_max_bytes(max_bytes)
+            spool.release(path)
+        self.addCleanup(restore)
+        return restore
+
+    def test_results_wait_while_the_spool_is_full(self):
+        acked = []
+        sender = threading.Thread(target=lambda: acked.append(
+            self.channel.send(self.address, "job-1", {"type": "render_and_return"}, timeout=500)
+        ))
+        sender.start()
+        identity, _, _ = self.router.recv_multipart()
+
+        restore_spool = self.fill_spool()
+        time.sleep(0.2)  # 让通道线程完成当前的轮询并进入暂停状态
+        self.router.send_multipart([identity, b"", self.encode(
+            {"type": "result", "job_id": "job-1", "content_type": "image/png"}
+        ), b"result"])
+        self.router.send_multipart([identity, b"", self.encode({"status": "ok", "job_id": "job-1"})])
+
+        # 暂停时间超过确认超时 (0.5 秒)，但暂停期间不判定超时
+        time.sleep(1.0)
+        self.assertTrue(state.task_queue.empty())
+        self.assertEqual(acked, [])
+
+        restore_spool()
+        sender.join(timeout=5)
+        self.assertEqual(acked, [True])
+        image_paths, _, job_id = state.task_queue.get(timeout=5)
+        self.assertEqual(job_id, "job-1")
+        with open(image_paths[0], "rb") as f:
+            self.assertEqual(f.read(), b"result")
+        get_spool().release(image_paths[0])
+        self.assertRaises(queue.Empty, state.task_queue.get_nowait)
+
+
+if __name__ == "__main__":
+    unittest.main()
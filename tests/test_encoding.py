@@ -0,0 +1,80 @@
+"""
+代理图像的缩小：按精确的比例缩小，结果不比原图小时不生成代理。
+批量结果的后台解码：8 位 PNG 解码为与 grab_pixels 相同的布局，其他图像交给 Blender。
+
+    python -m unittest discover -s tests
+"""
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import encoding  # noqa: E402
+
+
+class DownscaleTest(unittest.TestCase):
+
+    def setUp(self):
+        import numpy as np
+
+        self.np = np
+        self.pixels = np.random.default_rng(0).random((1080, 1920, 4), dtype=np.float32)
+
+    def test_size_follows_the_exact_percentage(self):
+        # 67% 以前被取整为 1/1，发送的"代理"与完整分辨率相同
+        for scale, shape in ((0.25, (270, 480)), (0.67, (724, 1286)), (0.9, (972, 1728))):
+            proxy = encoding.downscale(self.pixels, scale)
+            self.assertEqual(proxy.shape, shape + (4,))
+            self.assertEqual(proxy.dtype, self.np.float32)
+            self.assertAlmostEqual(float(proxy.mean()), float(self.pixels.mean()), places=3)
+
+    def test_blocks_are_averaged(self):
+        pixels = self.np.arange(16, dtype=self.np.float32).reshape(4, 4, 1)
+        self.assertEqual(encoding.downscale(pixels, 0.5)[..., 0].tolist(), [[2.5, 4.5], [10.5, 12.5]])
+
+    def test_no_proxy_when_not_smaller(self):
+        self.assertIsNone(encoding.downscale(self.np.ones((2, 2, 4), dtype=self.np.float32), 0.9))
+
+
+@unittest.skipUnless(importlib.util.find_spec("PIL"), "Pillow is not installed")
+class DecodeImageFileTest(unittest.TestCase):
+
+    def setUp(self):
+        import numpy as np
+
+        self.np = np
+        self.directory = tempfile.mkdtemp(prefix="bridge-decode-test-")
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write_png(self, pixels, bit_depth=8):
+        path = os.path.join(self.directory, f"result-{pixels.shape[2]}-{bit_depth}.png")
+        with open(path, "wb") as f:
+            f.write(encoding.encode_png(pixels, bit_depth=bit_depth))
+        return path
+
+    def test_byte_images_round_trip(self):
+        rng = self.np.random.default_rng(1)
+        for channels in (1, 2, 3, 4):
+            pixels = (rng.integers(0, 256, (5, 7, channels)) / 255.0).astype(self.np.float32)
+            decoded = encoding.decode_image_file(self.write_png(pixels))
+            self.assertEqual(decoded.shape, pixels.shape)
+            # 两者的行都从下到上，数值与 Blender 读取字节图像的结果相同
+            self.np.testing.assert_allclose(decoded, pixels, atol=1e-6)
+
+    def test_sixteen_bit_images_are_left_to_blender(self):
+        pixels = self.np.full((4, 4, 3), 0.5, dtype=self.np.float32)
+        self.assertIsNone(encoding.decode_image_file(self.write_png(pixels, bit_depth=16)))
+
+    def test_undecodable_file_is_left_to_blender(self):
+        path = os.path.join(self.directory, "result.exr")
+        with open(path, "wb") as f:
+            f.write(b"not an image")
+        self.assertIsNone(encoding.decode_image_file(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
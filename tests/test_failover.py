@@ -0,0 +1,202 @@
+"""
+调度器和服务器池在多个替身服务器之间的故障转移：响应缓慢的服务器和失效的服务器。
+
+只使用不依赖 Blender 的 utils 模块 (需要 pyzmq 和 msgspec)，在插件目录中运行:
+
+    python -m unittest discover -s tests
+"""
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import scheduler  # noqa: E402
+from utils.pool import EndpointPool  # noqa: E402
+from utils.replay import StandInServer, _free_port  # noqa: E402
+
+
+def wait_for(condition, timeout=10.0, interval=0.05):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(interval)
+    return condition()
+
+
+def healthy(pool, address):
+    return {entry[0]: entry[1] for entry in pool.snapshot()}.get(address)
+
+
+class StandInTestCase(unittest.TestCase):
+    """启动替身服务器和调度器，测试结束时全部停止。"""
+
+    def start_server(self, ack_delay=0.0):
+        server = StandInServer(ack_delay=ack_delay)
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def start_scheduler(self, addresses):
+        # 健康检查间隔和超时都很短，使测试在几秒内完成
+        pool = EndpointPool(interval=0.2, ping_timeout=300, down_after=3, recheck_interval=0.1)
+        job_scheduler = scheduler.JobScheduler(max_workers=2, pool=pool)
+        pool.set_addresses(addresses)
+        job_scheduler.start()
+        self.addCleanup(job_scheduler.stop)
+        self.addCleanup(job_scheduler.cancel_all)
+        return job_scheduler
+
+    def submit(self, job_scheduler, label="job"):
+        job = scheduler.Job(None, {"type": "render_and_return", "return_info": {}}, b"payload", label=label)
+        return job_scheduler.submit(job)
+
+
+class SlowAckTest(StandInTestCase):
+
+    def test_slow_ack_does_not_fail_or_resend(self):
+        """服务器确认任务需要 3 秒，期间 ping 超时，但发送本身在超时之内，任务不应失败或重发。"""
+        server = self.start_server(ack_delay=3.0)
+        job_scheduler = self.start_scheduler([server.address])
+        self.assertTrue(wait_for(lambda: healthy(job_scheduler.pool, server.address) is True))
+
+        job = self.submit(job_scheduler)
+        self.assertTrue(wait_for(lambda: job.status not in ('QUEUED', 'SENDING'), timeout=15))
+        self.assertEqual(job.status, 'WAITING', job.error)
+        # 确认之后 ping 恢复，服务器仍被视为健康，任务没有被重新发送
+        time.sleep(1.0)
+        self.assertTrue(healthy(job_scheduler.pool, server.address))
+        self.assertEqual(job.status, 'WAITING')
+        self.assertEqual(server.received, [job.id])
+
+    def test_slow_ack_does_not_requeue_waiting_jobs(self):
+        """服务器忙于确认后续任务时，已在等待结果的任务不应被重新发送。"""
+        server = self.start_server(ack_delay=2.0)
+        job_scheduler = self.start_scheduler([server.address])
+        self.assertTrue(wait_for(lambda: healthy(job_scheduler.pool, server.address) is True))
+
+        jobs = [self.submit(job_scheduler, f"job{i}") for i in range(3)]
+        self.assertTrue(wait_for(lambda: all(job.status == 'WAITING' for job in jobs), timeout=20))
+        self.assertEqual(sorted(server.received), sorted(job.id for job in jobs))
+
+
+class DeadServerTest(StandInTestCase):
+
+    def test_dead_server_is_skipped(self):
+        """池中有一个无人监听的地址时，任务发送到存活的服务器。"""
+        live = self.start_server()
+        dead_address = f"127.0.0.1:{_free_port()}"
+        job_scheduler = self.start_scheduler([dead_address, live.address])
+        self.assertTrue(wait_for(lambda: healthy(job_scheduler.pool, dead_address) is False))
+
+        jobs = [self.submit(job_scheduler, f"job{i}") for i in range(3)]
+        self.assertTrue(wait_for(lambda: all(job.status == 'WAITING' for job in jobs)))
+        self.assertTrue(all(job.address == live.address for job in jobs))
+        self.assertEqual(sorted(live.received), sorted(job.id for job in jobs))
+
+    def test_waiting_job_moves_to_another_server(self):
+        """服务器确认失效后，等待其结果的任务转发到另一个服务器，并且只发送一次。"""
+        first = self.start_server()
+        second = self.start_server()
+        job_scheduler = self.start_scheduler([first.address, second.address])
+        self.assertTrue(wait_for(
+            lambda: healthy(job_scheduler.pool, first.address) and healthy(job_scheduler.pool, second.address)
+        ))
+
+        job = self.submit(job_scheduler)
+        self.assertTrue(wait_for(lambda: job.status == 'WAITING' and job.payload is not None))
+        # 等待结果期间负载只保存在磁盘上
+        self.assertIsInstance(job.payload, scheduler.SpilledPayload)
+        original, other = (first, second) if job.address == first.address else (second, first)
+        original.stop()
+
+        self.assertTrue(wait_for(lambda: job.status == 'WAITING' and job.address == other.address))
+        self.assertEqual(other.received, [job.id])
+        self.assertEqual(original.received, [job.id])
+        self.assertTrue(wait_for(lambda: job.payload is not None))
+        path = job.payload.path
+        job_scheduler.mark_done(job.id)
+        self.assertFalse(os.path.exists(path))
+
+    def test_waiting_job_stays_when_the_only_server_is_down(self):
+        """唯一的服务器失效时，等待中的任务继续等待，不会失败也不会重发。"""
+        server = self.start_server()
+        job_scheduler = self.start_scheduler([server.address])
+        job = self.submit(job_scheduler)
+        self.assertTrue(wait_for(lambda: job.status == 'WAITING'))
+        server.stop()
+
+        self.assertTrue(wait_for(lambda: healthy(job_scheduler.pool, server.address) is False, timeout=5))
+        time.sleep(0.5)
+        self.assertEqual(job.status, 'WAITING')
+        self.assertEqual(job.address, server.address)
+
+
+class SpilledPayloadTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for payload in (b"\x00" * 1000, [b"R" * 10, b"G" * 10, b"B" * 10]):
+            spilled = scheduler.SpilledPayload.write(f"test-{id(payload):x}", payload)
+            self.addCleanup(spilled.discard)
+            self.assertEqual(spilled(), payload)
+
+
+class HealthCheckTest(StandInTestCase):
+    """不启动监控线程，手动执行健康检查。"""
+
+    def test_single_missed_ping_does_not_mark_server_down(self):
+        server = self.start_server()
+        pool = EndpointPool(ping_timeout=300, down_after=3)
+        down = []
+        pool.on_endpoint_down = down.append
+        pool.set_addresses([server.address])
+        pool._check(server.address)
+        self.assertIs(healthy(pool, server.address), True)
+
+        server.stop()
+        for _ in range(2):
+            pool._check(server.address)
+            self.assertIs(healthy(pool, server.address), True)
+        pool._check(server.address)
+        self.assertIs(healthy(pool, server.address), False)
+        pool._check(server.address)
+        self.assertEqual(down, [server.address])
+
+    def test_send_failure_does_not_mark_server_down(self):
+        server = self.start_server()
+        pool = EndpointPool(ping_timeout=300)
+        pool.set_addresses([server.address])
+        pool._check(server.address)
+        address = pool.acquire()
+        pool.sent(address, False)
+        pool.release(address)
+        self.assertIs(healthy(pool, server.address), True)
+
+    def test_missed_ping_while_sending_is_ignored(self):
+        server = self.start_server()
+        pool = EndpointPool(ping_timeout=300, down_after=1)
+        pool.set_addresses([server.address])
+        pool._check(server.address)
+        address = pool.acquire()
+        server.stop()
+        pool._check(address)
+        self.assertIs(healthy(pool, address), True)
+        pool.sent(address, False)
+        pool._check(address)
+        self.assertIs(healthy(pool, address), False)
+
+    def test_down_servers_are_still_tried_when_no_healthy_server_is_left(self):
+        server = self.start_server()
+        pool = EndpointPool(ping_timeout=300, down_after=1)
+        pool.set_addresses([server.address])
+        server.stop()
+        pool._check(server.address)
+        self.assertIs(healthy(pool, server.address), False)
+        self.assertEqual(pool.acquire(), server.address)
+        self.assertIsNone(pool.acquire(exclude=(server.address,)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+HTTP 模式下通过 PUB socket 订阅的进度事件：只记录本客户端的任务，任务结束后删除条目。
+
+    python -m unittest discover -s tests
+"""
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import progress, scheduler  # noqa: E402
+from utils.pool import EndpointPool  # noqa: E402
+from utils.replay import StandInServer  # noqa: E402
+from test_failover import wait_for  # noqa: E402
+
+
+class ProgressSubscriptionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInServer(progress_steps=20, progress_interval=0.05)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+        self.board = progress.get_board()
+        self.subscriber = progress.ProgressSubscriber(self.board, poll_interval=50)
+        self.subscriber.set_addresses([self.server.progress_address])
+        self.addCleanup(self.subscriber.stop)
+        # 等待 SUB 连接建立，否则最早的事件会丢失
+        time.sleep(0.3)
+
+        pool = EndpointPool(interval=0.2, ping_timeout=300)
+        self.job_scheduler = scheduler.JobScheduler(max_workers=1, pool=pool)
+        pool.set_addresses([self.server.address])
+        self.job_scheduler.start()
+        self.addCleanup(self.job_scheduler.stop)
+        self.addCleanup(self.job_scheduler.cancel_all)
+
+    def submit(self):
+        job = scheduler.Job(None, {"type": "render_and_return", "return_info": {}}, b"payload")
+        return self.job_scheduler.submit(job)
+
+    def test_only_own_jobs_are_recorded(self):
+        job = self.submit()
+        self.assertTrue(wait_for(lambda: (self.board.get(job.id) or {}).get("step") == 20))
+        self.assertEqual(self.board.get(job.id)["node"], "KSampler")
+        # 服务器为其他客户端的任务发布了同样多的事件，但它们不会进入进度模型
+        self.assertIsNone(self.board.get(f"other-{job.id}"))
+
+    def test_entry_is_removed_when_job_finishes(self):
+        job = self.submit()
+        self.assertTrue(wait_for(lambda: self.board.get(job.id) is not None))
+        self.job_scheduler.mark_done(job.id)
+        self.assertIsNone(self.board.get(job.id))
+        # 任务结束后迟到的事件不会重新创建条目
+        published = self.server.published
+        self.assertTrue(wait_for(lambda: self.server.published >= published + 4))
+        time.sleep(0.2)
+        self.assertIsNone(self.board.get(job.id))
+
+
+if __name__ == "__main__":
+    unittest.main()
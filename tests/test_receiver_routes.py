@@ -0,0 +1,52 @@
+"""
+接收服务器的路由表：一次提交超过路由上限的批次时，等待中的任务不会丢失目标图像。
+
+    python -m unittest discover -s tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import scheduler  # noqa: E402
+from utils.receiver import ReceiverService  # noqa: E402
+
+
+class RouteTest(unittest.TestCase):
+
+    def setUp(self):
+        # 不启动工作线程：任务保持排队状态，相当于等待发送或等待结果
+        self.job_scheduler = scheduler.JobScheduler(max_workers=1)
+        self.previous, scheduler._scheduler_instance = scheduler._scheduler_instance, self.job_scheduler
+        self.addCleanup(setattr, scheduler, "_scheduler_instance", self.previous)
+        self.service = ReceiverService()
+        self.service.default_target = "default"
+
+    def submit(self, index):
+        job = scheduler.Job(None, {"type": "render_and_return"}, b"payload", target_image_name=f"image{index}")
+        self.service.add_route(job.id, job.target_image_name)
+        return self.job_scheduler.submit(job)
+
+    def test_active_routes_survive_large_batches(self):
+        jobs = [self.submit(i) for i in range(ReceiverService._ROUTE_LIMIT + 50)]
+        for index, job in enumerate(jobs):
+            self.assertEqual(self.service.resolve(job.id), f"image{index}")
+
+    def test_finished_routes_are_evicted(self):
+        jobs = [self.submit(i) for i in range(ReceiverService._ROUTE_LIMIT)]
+        for job in jobs[:10]:
+            self.job_scheduler.cancel(job.id)
+        self.submit(ReceiverService._ROUTE_LIMIT)
+        self.assertEqual(len(self.service._routes), ReceiverService._ROUTE_LIMIT + 1 - 10)
+
+    def test_missing_route_falls_back_to_job_target(self):
+        job = self.job_scheduler.submit(
+            scheduler.Job(None, {"type": "render_and_return"}, b"payload", target_image_name="unrouted")
+        )
+        self.assertEqual(self.service.resolve(job.id), "unrouted")
+        self.assertEqual(self.service.resolve("unknown"), "default")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+"""
+通信轨迹的录制和回放：回放时录制的轨迹可以再次加载和回放，所有结果都应返回。
+
+    python -m unittest discover -s tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import replay, trace  # noqa: E402
+from test_backpressure import drain_task_queue  # noqa: E402
+
+
+def synthetic_trace(count, server_delay=0.1, size=4096, result_size=8192):
+    """count 次发送，每次的结果在确认后 server_delay 秒返回。"""
+    events = []
+    for index in range(count):
+        job_id = f"job-{index}"
+        start = index * 0.02
+        events.append({
+            "kind": "send", "t": start + 0.001, "start": start, "duration": 0.001, "size": size,
+            "frames": 1, "job_id": job_id, "sha": job_id, "metadata": {"type": "render_and_return"},
+        })
+        events.append({"kind": "result", "t": start + 0.001 + server_delay, "job_id": job_id, "size": result_size})
+    return events
+
+
+class TraceRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        drain_task_queue()
+        self.addCleanup(drain_task_queue)
+        self.directory = tempfile.mkdtemp(prefix="bridge-trace-test-")
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.addCleanup(trace.configure, False)
+
+    def test_recorded_replay_replays_without_losses(self):
+        path = os.path.join(self.directory, "trace.jsonl")
+        trace.configure(True, path)
+        jobs, _ = replay.replay(synthetic_trace(3), timeout=30)
+        trace.configure(False)
+        self.assertTrue(all(job.ok and job.total_seconds is not None for job in jobs))
+
+        events = replay.load_trace(path)
+        self.assertEqual(events[0]["kind"], "start")
+        self.assertEqual(sum(1 for event in events if event["kind"] == "send"), 3)
+        self.assertEqual(sum(1 for event in events if event["kind"] == "result"), 3)
+
+        jobs, metrics = replay.replay(events, timeout=30)
+        summary = replay.summarize(jobs, metrics)
+        self.assertEqual(summary["jobs"], 3)
+        self.assertEqual(summary["failed"], 0)
+        self.assertEqual(summary["missing_results"], 0)
+        for job in jobs:
+            # 服务器处理时间和录制时的端到端耗时来自轨迹中的发送和结果事件
+            self.assertGreaterEqual(job.server_delay, 0.05)
+            self.assertGreaterEqual(job.recorded_total, job.server_delay)
+            self.assertEqual(job.result_size, 8192)
+        self.assertIsNotNone(summary["recorded_total"])
+        self.assertIsNotNone(summary["replayed_total"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+"""
+可续传上传的故障注入测试：在客户端和替身服务器之间放一个 TCP 代理，
+代理在数据块传输到一半时切断连接，检查上传从服务器报告的偏移继续，而不是从头重新发送。
+
+可以单独运行:
+
+    python tests/test_resumable_upload.py
+
+或与其他测试一起运行:
+
+    python -m unittest discover -s tests
+"""
+import hashlib
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import comms  # noqa: E402
+from utils.replay import StandInServer, _free_port, deterministic_payload  # noqa: E402
+
+CHUNK = comms.RESUMABLE_CHUNK_SIZE
+
+
+class FaultInjectingProxy:
+    """
+    转发 TCP 连接的代理。kill_at 是客户端发往服务器的累计字节数 (所有连接合计)，
+    每到达一个位置就切断当时的连接 (两个方向同时关闭)。
+    按累计字节计算是因为 ZMQ 会在后台自动重连，连接的数量和顺序不确定。
+    """
+
+    def __init__(self, upstream, kill_at):
+        self.upstream = upstream
+        self.kill_at = sorted(kill_at)
+        self.kills = 0
+        self.forwarded = 0
+        self._lock = threading.Lock()
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.listen()
+        self.address = f"127.0.0.1:{self._listener.getsockname()[1]}"
+        self._running = True
+        threading.Thread(target=self._accept_loop, name="FaultInjectingProxy", daemon=True).start()
+
+    def stop(self):
+        self._running = False
+        self._listener.close()
+
+    def _accept_loop(self):
+        host, port = self.upstream.rsplit(":", 1)
+        while self._running:
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            server = socket.create_connection((host, int(port)))
+            pair = (client, server)
+            threading.Thread(target=self._pump, args=(client, server, True, pair), daemon=True).start()
+            threading.Thread(target=self._pump, args=(server, client, False, pair), daemon=True).start()
+
+    def _pump(self, source, target, inject, pair):
+        try:
+            while True:
+                data = source.recv(64 * 1024)
+                if not data:
+                    break
+                if inject:
+                    with self._lock:
+                        limit = self.kill_at[0] if self.kill_at else None
+                        if limit is not None and self.forwarded + len(data) >= limit:
+                            data = data[:limit - self.forwarded]
+                            self.kill_at.pop(0)
+                            self.kills += 1
+                        else:
+                            limit = None
+                        self.forwarded += len(data)
+                    target.sendall(data)
+                    if limit is not None:
+                        break
+                else:
+                    target.sendall(data)
+        except OSError:
+            pass
+        for sock in pair:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+
+class ResumableUploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def start_proxy(self, kill_at):
+        proxy = FaultInjectingProxy(self.server.address, kill_at)
+        self.addCleanup(proxy.stop)
+        return proxy
+
+    def test_resumes_from_server_offset_after_mid_chunk_kill(self):
+        payload = deterministic_payload(3 * CHUNK + CHUNK // 2, "resumable")
+        # 第二个数据块传输到一半时切断连接；续传后重新发送第二、三个数据块，在第四个数据块中途再次切断
+        proxy = self.start_proxy([CHUNK + CHUNK // 2, CHUNK + CHUNK // 2 + 2 * CHUNK + CHUNK // 4])
+
+        upload_id = comms.upload_resumable(proxy.address, payload, timeout=1000)
+
+        self.assertEqual(upload_id, hashlib.sha256(payload).hexdigest())
+        self.assertEqual(proxy.kills, 2)
+        self.assertEqual(self.server.uploaded_hash(upload_id), upload_id)
+        # 每次重连后先询问偏移，然后从服务器报告的偏移继续；已确认的数据块不会重新发送
+        self.assertEqual(self.server.upload_offsets, [
+            ("begin", 0), ("chunk", 0),
+            ("begin", CHUNK), ("chunk", CHUNK), ("chunk", 2 * CHUNK),
+            ("begin", 3 * CHUNK), ("chunk", 3 * CHUNK),
+        ])
+
+    def test_repeated_upload_of_same_content_is_not_resent(self):
+        payload = deterministic_payload(2 * CHUNK, "repeat")
+        upload_id = comms.upload_resumable(self.server.address, payload, timeout=1000)
+        chunks = len(self.server.upload_offsets)
+        self.assertEqual(comms.upload_resumable(self.server.address, payload, timeout=1000), upload_id)
+        self.assertEqual(self.server.upload_offsets[chunks:], [("begin", 2 * CHUNK)])
+
+    def test_gives_up_when_every_connection_is_killed(self):
+        payload = deterministic_payload(2 * CHUNK, "stalled")
+        # 切断位置的间隔小于一个数据块，每个数据块都无法完整到达服务器
+        proxy = self.start_proxy([(k + 1) * CHUNK // 2 for k in range(20)])
+        with self.assertRaises(ConnectionError):
+            comms.upload_resumable(proxy.address, payload, timeout=500, max_stalls=2)
+        self.assertLessEqual(proxy.kills, 4)
+
+    def test_unreachable_server_fails_after_one_timeout(self):
+        # 没有任何服务器监听的端口：第一次请求超时后立即失败，不再重试，也不回退到一次性发送
+        address = f"127.0.0.1:{_free_port()}"
+        payload = deterministic_payload(comms.RESUMABLE_THRESHOLD, "unreachable")
+        started = time.monotonic()
+        with self.assertRaises(ConnectionError):
+            comms.upload_resumable(address, payload, timeout=300)
+        self.assertLess(time.monotonic() - started, 1.0)
+
+        started = time.monotonic()
+        self.assertFalse(comms.send_data(address, {"type": "render_and_return"}, payload, timeout=300))
+        self.assertLess(time.monotonic() - started, 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
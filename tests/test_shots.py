@@ -0,0 +1,68 @@
+"""
+无界面批量渲染的帧范围解析和镜头展开：镜头名称用作输出文件名，必须不含路径分隔符且互不相同。
+
+    python -m unittest discover -s tests
+"""
+import os
+import re
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.shots import expand_shots, parse_frames  # noqa: E402
+
+
+def clean_name(name):
+    """与 bpy.path.clean_name 相同：非字母数字、下划线、连字符和点的字符替换为下划线。"""
+    return re.sub(r"[^A-Za-z0-9_.\-]", "_", name)
+
+
+class ParseFramesTest(unittest.TestCase):
+
+    def test_empty_uses_default(self):
+        self.assertEqual(parse_frames("", 7), [7])
+        self.assertEqual(parse_frames(None, 7), [7])
+
+    def test_ranges_lists_and_steps(self):
+        self.assertEqual(parse_frames("1-3", 0), [1, 2, 3])
+        self.assertEqual(parse_frames("1, 5, 10-12", 0), [1, 5, 10, 11, 12])
+        self.assertEqual(parse_frames("1-10x4", 0), [1, 5, 9])
+        self.assertEqual(parse_frames("-2-1", 0), [-2, -1, 0, 1])
+
+    def test_duplicates_keep_first_order(self):
+        self.assertEqual(parse_frames("3,1-3,2", 0), [3, 1, 2])
+
+    def test_invalid_range_raises(self):
+        for text in ("a", "1-", "1..3", "1-3x"):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                parse_frames(text, 0)
+
+
+class ExpandShotsTest(unittest.TestCase):
+
+    def test_order_is_frame_camera_layer(self):
+        shots = expand_shots("Scene", [1, 2], ["CamA", "CamB"], ["Layer"], clean_name)
+        self.assertEqual(
+            [(shot.frame, shot.camera, shot.view_layer) for shot in shots],
+            [(1, "CamA", "Layer"), (1, "CamB", "Layer"), (2, "CamA", "Layer"), (2, "CamB", "Layer")],
+        )
+        self.assertEqual(shots[0].name, "Scene_CamA_Layer_0001")
+
+    def test_names_are_sanitized(self):
+        shots = expand_shots("Shot/01", [1], ["../Cam"], ["View Layer"], clean_name)
+        self.assertEqual(shots[0].name, "Shot_01_.._Cam_View_Layer_0001")
+        self.assertNotIn(os.sep, shots[0].name)
+        # 原始名称保留，用于查找相机和视图层
+        self.assertEqual((shots[0].camera, shots[0].view_layer), ("../Cam", "View Layer"))
+
+    def test_colliding_names_are_made_unique(self):
+        shots = expand_shots("Scene", [1], ["Cam A", "Cam/A", "Cam_A"], ["Layer"], clean_name)
+        self.assertEqual(
+            [shot.name for shot in shots],
+            ["Scene_Cam_A_Layer_0001", "Scene_Cam_A_Layer_0001_1", "Scene_Cam_A_Layer_0001_2"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
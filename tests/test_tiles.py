@@ -0,0 +1,157 @@
+"""
+渐进返回的分块：分块信息的检查、原始像素的解码，以及写入画布时图像边缘的不完整分块、
+低分辨率遍数的放大和乱序到达的遍数。
+
+    python -m unittest discover -s tests
+"""
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import tiles  # noqa: E402
+
+
+def tile_info(x, y, width, height, image_width=100, image_height=70, **extra):
+    return dict(x=x, y=y, width=width, height=height, image_width=image_width, image_height=image_height, **extra)
+
+
+class ParseTileInfoTest(unittest.TestCase):
+
+    def test_json_and_defaults(self):
+        info = tiles.parse_tile_info(json.dumps(tile_info(64, 64, 36, 6)))
+        self.assertEqual((info["x"], info["y"], info["width"], info["height"]), (64, 64, 36, 6))
+        self.assertEqual((info["pass"], info["final"]), (0, False))
+        self.assertNotIn("dtype", info)
+
+    def test_edge_tile_touching_the_border_is_accepted(self):
+        info = tiles.parse_tile_info(tile_info(99, 69, 1, 1))
+        self.assertEqual((info["x"], info["y"]), (99, 69))
+
+    def test_out_of_range_tiles_are_rejected(self):
+        for value in (tile_info(64, 0, 37, 64), tile_info(0, 64, 64, 7), tile_info(-1, 0, 10, 10),
+                      tile_info(0, 0, 0, 10), tile_info(0, 0, 10, 10, image_width=0)):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                tiles.parse_tile_info(value)
+
+    def test_incomplete_or_malformed_info_is_rejected(self):
+        missing = tile_info(0, 0, 10, 10)
+        del missing["image_height"]
+        for value in (missing, tile_info("a", 0, 10, 10), "{not json", "[1, 2]"):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                tiles.parse_tile_info(value)
+
+    def test_raw_tiles_need_a_supported_dtype_and_shape(self):
+        info = tiles.parse_tile_info(tile_info(0, 0, 10, 10, dtype="float16", shape=[10, 10, 4]))
+        self.assertEqual((info["dtype"], info["shape"]), ("float16", [10, 10, 4]))
+        for extra in ({"dtype": "float64", "shape": [10, 10]}, {"dtype": "uint8"},
+                      {"dtype": "uint8", "shape": [10]}, {"dtype": "uint8", "shape": [10, 0]}):
+            with self.subTest(extra=extra), self.assertRaises(ValueError):
+                tiles.parse_tile_info(tile_info(0, 0, 10, 10, **extra))
+
+
+class DecodeRawTest(unittest.TestCase):
+
+    def setUp(self):
+        import numpy as np
+
+        self.np = np
+
+    def test_uint8_rows_are_flipped_and_normalized(self):
+        data = self.np.array([[0, 255], [51, 102]], dtype=self.np.uint8).tobytes()
+        pixels, is_float = tiles.decode_raw(data, {"dtype": "uint8", "shape": [2, 2]})
+        self.assertFalse(is_float)
+        self.assertEqual(pixels.shape, (2, 2, 1))
+        self.assertEqual(pixels.dtype, self.np.float32)
+        # 分块的行从上到下存储，画布的行从下到上
+        self.np.testing.assert_allclose(pixels[..., 0], [[0.2, 0.4], [0.0, 1.0]], rtol=1e-6)
+
+    def test_float16_is_little_endian(self):
+        values = self.np.arange(12, dtype="<f2").reshape(1, 3, 4)
+        pixels, is_float = tiles.decode_raw(values.tobytes(), {"dtype": "float16", "shape": [1, 3, 4]})
+        self.assertTrue(is_float)
+        self.assertEqual(pixels.tolist(), values.astype(self.np.float32).tolist())
+
+    def test_size_mismatch_raises(self):
+        with self.assertRaises(ValueError):
+            tiles.decode_raw(b"\0" * 5, {"dtype": "uint8", "shape": [2, 2]})
+
+
+class FitChannelsTest(unittest.TestCase):
+
+    def setUp(self):
+        import numpy as np
+
+        self.np = np
+
+    def test_grey_and_alpha_expand_to_rgba(self):
+        cell = self.np.array([[[0.5, 0.25]]], dtype=self.np.float32)
+        self.assertEqual(tiles._fit_channels(cell, 4).tolist(), [[[0.5, 0.5, 0.5, 0.25]]])
+
+    def test_rgb_gets_opaque_alpha(self):
+        cell = self.np.array([[[0.1, 0.2, 0.3]]], dtype=self.np.float32)
+        self.assertEqual(tiles._fit_channels(cell, 4)[0, 0, 3], 1.0)
+
+    def test_rgba_to_rgb_drops_alpha(self):
+        cell = self.np.array([[[0.5, 0.25, 0.125, 0.0]]], dtype=self.np.float32)
+        self.assertEqual(tiles._fit_channels(cell, 3).tolist(), [[[0.5, 0.25, 0.125]]])
+
+
+class TileCanvasTest(unittest.TestCase):
+
+    def setUp(self):
+        import numpy as np
+
+        self.np = np
+        # 100x70 的图像按 64 像素分块，右侧和顶部的分块不完整
+        self.canvas = tiles.TileCanvas("target", np.zeros((70, 100, 4), dtype=np.float32))
+
+    def cell(self, height, width, value, channels=4):
+        return self.np.full((height, width, channels), value, dtype=self.np.float32)
+
+    def paste(self, x, y, width, height, cell, **extra):
+        self.canvas.paste(tiles.parse_tile_info(tile_info(x, y, width, height, **extra)), cell)
+
+    def test_partial_tiles_cover_the_image_exactly(self):
+        for index, (x, y) in enumerate(((0, 0), (64, 0), (0, 64), (64, 64))):
+            width, height = min(64, 100 - x), min(64, 70 - y)
+            self.paste(x, y, width, height, self.cell(height, width, index + 1))
+        self.assertEqual(self.canvas.tiles, 4)
+        self.assertTrue(self.canvas.dirty)
+        self.assertTrue((self.canvas.passes == 0).all())
+        pixels = self.canvas.pixels[..., 0]
+        # 画布的行从下到上：图像顶部 (y=0) 的分块位于缓冲区的最后几行
+        self.assertTrue((pixels[6:, :64] == 1).all())
+        self.assertTrue((pixels[6:, 64:] == 2).all())
+        self.assertTrue((pixels[:6, :64] == 3).all())
+        self.assertTrue((pixels[:6, 64:] == 4).all())
+
+    def test_corner_tile_lands_in_the_corner(self):
+        self.paste(99, 69, 1, 1, self.cell(1, 1, 1.0))
+        self.assertEqual(self.canvas.pixels[0, 99, 0], 1.0)
+        self.assertEqual(float(self.canvas.pixels[..., 0].sum()), 1.0)
+
+    def test_low_resolution_pass_is_upscaled_to_the_region(self):
+        cell = self.np.arange(2 * 3, dtype=self.np.float32).reshape(2, 3, 1)
+        self.paste(64, 64, 36, 6, cell)
+        region = self.canvas.pixels[:6, 64:, 0]
+        self.assertEqual(region.shape, (6, 36))
+        self.assertEqual(region[:3, :12].tolist(), [[0.0] * 12] * 3)
+        self.assertEqual(region[3:, 24:].tolist(), [[5.0] * 12] * 3)
+        # 灰度分块扩展为 RGB，Alpha 为不透明
+        self.assertTrue((self.canvas.pixels[:6, 64:, 3] == 1.0).all())
+
+    def test_lower_pass_arriving_late_does_not_overwrite(self):
+        self.paste(0, 0, 64, 64, self.cell(64, 64, 2.0), **{"pass": 2})
+        self.paste(0, 0, 100, 70, self.cell(7, 10, 1.0), **{"pass": 1})
+        pixels = self.canvas.pixels[..., 0]
+        self.assertTrue((pixels[6:, :64] == 2.0).all())
+        self.assertTrue((pixels[:6, :] == 1.0).all())
+        self.assertTrue((pixels[:, 64:] == 1.0).all())
+        self.assertEqual(int(self.canvas.passes.min()), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
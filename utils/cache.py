@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import logging
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# 这些元数据字段每次发送都会变化 (任务ID、回调地址、临时文件名、批次和任务组信息)，不参与缓存键的计算
+_VOLATILE_METADATA_KEYS = ("return_info", "filename", "batch", "group")
+
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+
+def make_key(payload, metadata, workflow_hash):
+    """
+    根据负载内容的哈希、任务元数据和服务器报告的工作流哈希生成缓存键。
+    结果还取决于服务器上的工作流、节点参数和种子，这些只有服务器知道，
+    因此服务器没有报告工作流哈希时返回 None (不缓存)。
+    """
+    if not workflow_hash:
+        return None
+    digest = hashlib.sha256(workflow_hash.encode("utf-8"))
+    for frame in payload if isinstance(payload, (list, tuple)) else [payload or b""]:
+        digest.update(frame)
+    stable_metadata = {k: v for k, v in metadata.items() if k not in _VOLATILE_METADATA_KEYS}
+    digest.update(json.dumps(stable_metadata, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    磁盘上的 LRU 结果缓存。
+
+    每个条目是一个以缓存键命名的结果文件。文件的修改时间用作最近使用时间，
+    因此重启 Blender 后 LRU 顺序依然有效。总大小超过上限时，最久未使用的条目被删除。
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (path, size)，按最近使用排序
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".part") or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, os.path.splitext(name)[0], path, stat.st_size))
+        for _, key, path, size in sorted(files):
+            self._entries[key] = (path, size)
+            self._total_bytes += size
+        log.info(f"结果缓存已加载: {len(self._entries)} 个条目, {self._total_bytes / 1024 / 1024:.1f} MB。")
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key):
+        """返回缓存结果文件的路径，未命中时返回 None。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and not os.path.exists(entry[0]):
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        try:
+            os.utime(entry[0])
+        except OSError:
+            pass
+        return entry[0]
+
+    def put(self, key, source_path):
+        """将结果文件复制到缓存中。"""
+        suffix = os.path.splitext(source_path)[1]
+        path = os.path.join(self.directory, f"{key}{suffix}")
+        temp_path = f"{path}.part"
+        try:
+            shutil.copyfile(source_path, temp_path)
+            os.replace(temp_path, path)
+        except OSError as e:
+            log.warning(f"写入结果缓存失败: {e}")
+            return
+        size = os.path.getsize(path)
+        with self._lock:
+            if key in self._entries:
+                # 后缀不同时旧文件不会被覆盖，需要删除，否则它会成为孤立文件并继续占用磁盘
+                self._drop(key, remove_file=self._entries[key][0] != path)
+            self._entries[key] = (path, size)
+            self._total_bytes += size
+            self._evict()
+
+    def set_max_bytes(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+            self.hits = 0
+            self.misses = 0
+
+    def _drop(self, key, remove_file=True):
+        path, size = self._entries.pop(key)
+        self._total_bytes -= size
+        if remove_file:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            log.info(f"结果缓存超出上限，淘汰条目 {key[:12]}。")
+            self._drop(key)
+
+
+def get_result_cache(max_bytes=None):
+    """获取 ResultCache 的单例实例。传入 max_bytes 时同时更新容量上限。"""
+    global _cache_instance
+    with _cache_lock:
+        if _cache_instance is None:
+            directory = os.path.join(tempfile.gettempdir(), "blender_comfyui_bridge", "cache")
+            _cache_instance = ResultCache(directory, max_bytes or 1024 * 1024 * 1024)
+        elif max_bytes is not None and max_bytes != _cache_instance.max_bytes:
+            _cache_instance.set_max_bytes(max_bytes)
+        return _cache_instance
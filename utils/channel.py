@@ -0,0 +1,298 @@
+import json
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from .comms import get_zmq_context, _prepare_address
+from .state import task_queue, tile_queue
+from .spool import get_spool, suffix_for
+from .progress import get_board
+from .shm import SHM_SUFFIX
+from . import trace, tiles
+
+log = logging.getLogger(__name__)
+
+_channel_instance = None
+_channel_lock = threading.Lock()
+
+
+class ZmqChannel:
+    """
+    与 ComfyUI 之间的双向 ZMQ 通道 (DEALER/ROUTER)。
+
+    每个服务器地址对应一个长期存在的 DEALER socket，所有 socket 只在通道线程中使用。
+    任务通过同一个连接提交，服务器先回复确认，处理完成后在同一个连接上推送结果，
+    因此不需要 Blender 端的 HTTP 接收服务器，也不需要 SSH 反向隧道。
+
+    消息格式 (每条消息以一个空帧开头，与 REQ/REP 的信封兼容):
+      提交:  ["", metadata, payload...]
+      确认:  ["", {"status": "ok", "job_id": ...}]
+      结果:  ["", {"type": "result", "job_id": ..., "content_type": "image/png"}, image...]
+      共享内存结果: ["", {"type": "result", "job_id": ..., "shared_memory": {"name", "shape", "dtype"}}]
+      分块:  ["", {"type": "tile", "job_id": ..., "tile": {"x", "y", "width", "height", ...}, "content_type": ...}, data]
+      进度:  ["", {"type": "progress", "job_id": ..., "node": ..., "step": k, "total": N, "queue_position": q}]
+    """
+
+    def __init__(self, poll_interval=50):
+        self.poll_interval = poll_interval
+        self._outbox = queue.Queue()
+        self._sockets = {}  # address -> socket
+        self._pending = {}  # job_id -> (address, future, deadline, cancel_event)
+        self._paused_since = None  # 暂存目录超出上限而暂停接收的开始时间
+        self._running = False
+        self._thread = None
+
+    # --- 生命周期 ---
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="BridgeZmqChannel", daemon=True)
+        self._thread.start()
+        log.info("ZMQ 双向通道已启动。")
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=2)
+        self._thread = None
+        log.info("ZMQ 双向通道已停止。")
+
+    # --- 公共接口 (可在任意线程调用) ---
+
+    @trace.traced_send("channel", lambda args, kwargs: (args[1], args[3], args[4] if len(args) > 4 else kwargs.get("payload")))
+    def send(self, address, job_id, metadata, payload=None, timeout=10000, cancel_event=None):
+        """
+        通过通道提交一个任务并等待服务器确认。
+        :return: 服务器确认成功时返回 True，否则返回 False
+        """
+        import msgspec
+
+        frames = [b"", msgspec.msgpack.encode(metadata)]
+        if isinstance(payload, (list, tuple)):
+            frames.extend(payload)
+        elif payload:
+            frames.append(payload)
+        future = Future()
+        deadline = time.monotonic() + timeout / 1000.0
+        self._outbox.put((address, frames, job_id, future, deadline, cancel_event))
+        try:
+            # 正常情况下通道线程会在截止时间内给出结果，这里的超时只是防止通道线程已退出
+            return future.result(timeout=timeout / 1000.0 + 1.0)
+        except FutureTimeoutError:
+            log.warning(f"ZMQ 通道未在超时时间内响应任务 {job_id}。")
+            return False
+
+    def notify(self, address, message):
+        """发送一条不需要确认的控制消息 (例如取消任务)。"""
+        import msgspec
+
+        self._outbox.put((address, [b"", msgspec.msgpack.encode(message)], None, None, None, None))
+
+    # --- 通道线程 ---
+
+    def _socket_for(self, address, poller):
+        import zmq
+
+        socket = self._sockets.get(address)
+        if socket is None:
+            socket = get_zmq_context().socket(zmq.DEALER)
+            socket.setsockopt(zmq.LINGER, 0)
+            # 通过 ZMTP 心跳检测失效的连接
+            socket.setsockopt(zmq.HEARTBEAT_IVL, 5000)
+            socket.setsockopt(zmq.HEARTBEAT_TIMEOUT, 15000)
+            # 暂停接收时只在内存中缓冲少量消息，其余的留在 TCP 缓冲区和服务器端，形成背压
+            socket.setsockopt(zmq.RCVHWM, 8)
+            socket.connect(_prepare_address(address))
+            poller.register(socket, zmq.POLLIN)
+            self._sockets[address] = socket
+            log.info(f"已建立到 {address} 的 ZMQ 通道。")
+        return socket
+
+    def _drain_outbox(self, poller):
+        import zmq
+
+        while True:
+            try:
+                address, frames, job_id, future, deadline, cancel_event = self._outbox.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                self._socket_for(address, poller).send_multipart(frames, zmq.NOBLOCK)
+            except zmq.ZMQError as e:
+                log.warning(f"通过通道发送到 {address} 失败: {e}")
+                if future:
+                    future.set_result(False)
+                continue
+            if future:
+                self._pending[job_id] = (address, future, deadline, cancel_event)
+
+    def _update_paused(self):
+        """
+        暂存目录超出上限时暂停从 socket 读取消息，与 HTTP 接收端回复 503 相同，
+        服务器的结果留在 ZMQ/TCP 缓冲区中，直到主线程应用了已接收的结果。
+        确认消息也因此暂停读取，所以恢复时将等待确认的截止时间顺延暂停的时长。
+        :return: 是否处于暂停状态
+        """
+        spool = get_spool()
+        if spool.is_full:
+            if self._paused_since is None:
+                self._paused_since = time.monotonic()
+                log.warning(
+                    f"暂存目录中等待应用的结果 ({spool.total_bytes / 1024 / 1024:.0f} MB) 超出上限，"
+                    f"暂停接收 ZMQ 通道的消息。"
+                )
+            return True
+        if self._paused_since is not None:
+            paused = time.monotonic() - self._paused_since
+            self._paused_since = None
+            for job_id, (address, future, deadline, cancel_event) in self._pending.items():
+                self._pending[job_id] = (address, future, deadline + paused, cancel_event)
+            log.info(f"暂存目录已低于上限，恢复接收 ZMQ 通道的消息 (暂停了 {paused:.1f} 秒)。")
+        return False
+
+    def _expire_pending(self):
+        now = time.monotonic()
+        for job_id, (address, future, deadline, cancel_event) in list(self._pending.items()):
+            if cancel_event is not None and cancel_event.is_set():
+                log.info(f"任务 {job_id} 在等待确认时被中断。")
+            elif now >= deadline and self._paused_since is None:
+                log.warning(f"等待 {address} 确认任务 {job_id} 超时。")
+            else:
+                continue
+            del self._pending[job_id]
+            future.set_result(False)
+
+    def _handle_message(self, address, frames):
+        import msgspec
+
+        # 去掉信封中的空帧
+        while frames and not frames[0]:
+            frames = frames[1:]
+        if not frames:
+            return
+        try:
+            header = msgspec.msgpack.decode(frames[0])
+        except msgspec.DecodeError as e:
+            log.error(f"无法解码来自 {address} 的通道消息: {e}")
+            return
+        if not isinstance(header, dict):
+            return
+
+        if header.get("type") == "result":
+            self._handle_result(header, frames[1:])
+            return
+        if header.get("type") == "tile":
+            self._handle_tile(header, frames[1:])
+            return
+        if header.get("type") == "progress":
+            get_board().update(header)
+            return
+
+        # 确认消息：按 job_id 匹配；只有回复不带 job_id 时才匹配该地址上最早的等待项。
+        # 带有未知 job_id 的回复 (例如已超时或已取消任务的迟到确认) 直接丢弃，不能算到其他任务头上
+        job_id = header.get("job_id")
+        if job_id is None:
+            job_id = next((jid for jid, entry in self._pending.items() if entry[0] == address), None)
+        if job_id not in self._pending:
+            log.info(f"丢弃来自 {address} 的未匹配回复: {header}")
+            return
+        _, future, _, _ = self._pending.pop(job_id)
+        if header.get("status") == "ok":
+            future.set_result(True)
+        else:
+            log.warning(f"服务器拒绝任务 {job_id}: {header}")
+            future.set_result(False)
+
+    def _handle_result(self, header, data_frames):
+        job_id = header.get("job_id")
+        target_image_name = header.get("image_datablock_name")
+        if header.get("shared_memory"):
+            # 结果放在服务器创建的共享内存段中，消息只携带描述符
+            descriptors = header["shared_memory"]
+            if isinstance(descriptors, dict):
+                descriptors = [descriptors]
+            items = [(json.dumps(descriptor).encode("utf-8"), SHM_SUFFIX) for descriptor in descriptors]
+            task_queue.put((get_spool().write_batch(items), target_image_name, job_id))
+            trace.record("result", via="channel", job_id=job_id, count=len(items), size=0, content_type=SHM_SUFFIX)
+            log.info(f"通过 ZMQ 通道收到任务 {job_id} 的 {len(items)} 个共享内存结果。")
+            return
+        suffix = suffix_for(header.get("content_type"))
+        if not data_frames:
+            return
+        # 一条结果消息可以携带一批图像，并行写入暂存目录后作为一个任务入队
+        temp_paths = get_spool().write_batch([(bytes(data), suffix) for data in data_frames])
+        trace.record(
+            "result", via="channel", job_id=job_id, count=len(data_frames),
+            size=sum(len(data) for data in data_frames), content_type=header.get("content_type"),
+        )
+        log.info(f"通过 ZMQ 通道收到任务 {job_id} 的 {len(temp_paths)} 个结果。")
+        task_queue.put((temp_paths, target_image_name, job_id))
+
+    def _handle_tile(self, header, data_frames):
+        job_id = header.get("job_id")
+        try:
+            info = tiles.parse_tile_info(header.get("tile"))
+        except ValueError as e:
+            log.error(f"任务 {job_id} 的分块信息无效: {e}")
+            return
+        if not data_frames:
+            return
+        content_type = header.get("content_type")
+        temp_path = get_spool().write(bytes(data_frames[0]), suffix_for(content_type))
+        trace.record("tile", via="channel", job_id=job_id, size=len(data_frames[0]), content_type=content_type, tile=info)
+        tile_queue.put((temp_path, header.get("image_datablock_name"), job_id, info))
+
+    def _run(self):
+        import zmq
+
+        poller = zmq.Poller()
+        try:
+            while self._running:
+                self._drain_outbox(poller)
+                if self._update_paused():
+                    time.sleep(self.poll_interval / 1000.0)
+                    self._expire_pending()
+                    continue
+                for socket, _ in poller.poll(self.poll_interval):
+                    address = next(addr for addr, sock in self._sockets.items() if sock is socket)
+                    while True:
+                        try:
+                            frames = socket.recv_multipart(zmq.NOBLOCK)
+                        except zmq.Again:
+                            break
+                        try:
+                            self._handle_message(address, frames)
+                        except Exception as e:
+                            log.error(f"处理通道消息时出错: {e}", exc_info=True)
+                self._expire_pending()
+        finally:
+            for _, future, _, _ in self._pending.values():
+                future.set_result(False)
+            self._pending.clear()
+            for socket in self._sockets.values():
+                socket.close()
+            self._sockets.clear()
+
+
+def get_channel():
+    """获取 ZmqChannel 的单例实例，首次调用时启动通道线程。"""
+    global _channel_instance
+    with _channel_lock:
+        if _channel_instance is None:
+            _channel_instance = ZmqChannel()
+            _channel_instance.start()
+        return _channel_instance
+
+
+def stop_channel():
+    global _channel_instance
+    with _channel_lock:
+        if _channel_instance:
+            _channel_instance.stop()
+            _channel_instance = None
@@ -1,4 +1,9 @@
 import logging
+import os
+import threading
+import time
+
+from . import profiling, trace
 
 # 获取一个日志记录器
 log = logging.getLogger(__name__)
@@ -18,11 +23,88 @@ def get_zmq_context():
         _zmq_context = zmq.Context()
     return _zmq_context
 
+# 是否允许对本机服务器自动使用 ipc:// (由 Blender 设置同步)
+ipc_enabled = True
+
+# 已协商的 Unix 域套接字端点: "host:port" -> "ipc://..."
+_ipc_endpoints = {}
+_ipc_lock = threading.Lock()
+
+_LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1", "[::1]")
+
+# 是否对大负载使用可续传上传 (由 Blender 设置同步)
+resumable_enabled = True
+# 超过此大小的负载分块上传，连接中断后可以从最后确认的偏移继续
+RESUMABLE_THRESHOLD = 8 * 1024 * 1024
+RESUMABLE_CHUNK_SIZE = 2 * 1024 * 1024
+
+def is_local_address(address):
+    """判断地址是否指向本机。"""
+    host = address.replace('tcp://', '').rsplit(':', 1)[0]
+    return host in _LOCAL_HOSTS
+
+def _ipc_supported():
+    import zmq
+    return zmq.has('ipc')
+
+def _update_ipc_endpoint(address, reply):
+    """
+    根据本机服务器 ping 回复中的 ipc_endpoint 字段协商 ipc:// 端点。
+    只有当套接字文件在本机存在时才会采用，从而确认服务器确实运行在同一台机器上。
+    """
+    endpoint = reply.get("ipc_endpoint") if isinstance(reply, dict) else None
+    usable = (
+        ipc_enabled
+        and is_local_address(address)
+        and isinstance(endpoint, str)
+        and endpoint.startswith('ipc://')
+        and os.path.exists(endpoint[len('ipc://'):])
+        and _ipc_supported()
+    )
+    with _ipc_lock:
+        previous = _ipc_endpoints.get(address)
+        if usable and previous != endpoint:
+            _ipc_endpoints[address] = endpoint
+            log.info(f"Using IPC transport {endpoint} for local server {address}.")
+        elif not usable and previous:
+            del _ipc_endpoints[address]
+            log.info(f"IPC transport for {address} no longer available, falling back to TCP.")
+
+def _drop_ipc_endpoint(address):
+    """ipc:// 通信失败时回退到 TCP。"""
+    with _ipc_lock:
+        if _ipc_endpoints.pop(address, None):
+            log.warning(f"IPC transport for {address} failed, falling back to TCP.")
+
 def _prepare_address(address):
-    """确保地址包含 tcp:// 协议头"""
-    if not address.startswith('tcp://'):
-        return f'tcp://{address}'
-    return address
+    """
+    确保地址包含协议头。
+    对已协商 ipc:// 端点的本机服务器返回 ipc 地址，否则返回 tcp:// 地址。
+    """
+    if address.startswith(('tcp://', 'ipc://')):
+        return address
+    if ipc_enabled:
+        with _ipc_lock:
+            endpoint = _ipc_endpoints.get(address)
+        if endpoint:
+            return endpoint
+    return f'tcp://{address}'
+
+def _wait_for_reply(socket, timeout, cancel_event=None, interval=100):
+    """轮询 socket 直到有回复可读。超时或被取消时返回 False。"""
+    import zmq
+
+    poller = zmq.Poller()
+    poller.register(socket, zmq.POLLIN)
+    deadline = time.monotonic() + timeout / 1000.0
+    while True:
+        if cancel_event is not None and cancel_event.is_set():
+            return False
+        remaining_ms = (deadline - time.monotonic()) * 1000.0
+        if remaining_ms <= 0:
+            return False
+        if poller.poll(min(remaining_ms, interval)):
+            return True
 
 def send_request(address, data, timeout=5000):
     """一个通用函数，用于向ZMQ地址发送请求并等待回复。"""
@@ -71,13 +153,17 @@ def send_request(address, data, timeout=5000):
             log.info("Closing ZMQ socket.")
             socket.close()
 
-def send_ping(address, timeout=2000):
-    """向服务器发送一个简单的 ping，只检查是否收到回复，不关心内容。"""
+def probe(address, timeout=2000):
+    """
+    向服务器发送 ping 并测量往返时间。
+    
+    :return: 成功时返回 (rtt 秒, 回复字典)，失败时返回 None。
+             回复中可能包含服务器负载信息 (如 queue_remaining)，无法解码时为空字典。
+    """
     import zmq
     import msgspec
 
-    address = _prepare_address(address)
-    log.info(f"Pinging {address}...")
+    endpoint = _prepare_address(address)
     socket = None
     try:
         context = get_zmq_context()
@@ -85,40 +171,186 @@ def send_ping(address, timeout=2000):
         socket.setsockopt(zmq.LINGER, 0)
         socket.setsockopt(zmq.RCVTIMEO, timeout)
         socket.setsockopt(zmq.SNDTIMEO, timeout)
-        socket.connect(address)
+        socket.connect(endpoint)
         
         encoder = msgspec.msgpack.Encoder()
+        start = time.monotonic()
         socket.send(encoder.encode({"type": "ping"}))
         
-        socket.recv()
-        log.info("Ping successful.")
-        return True
+        packed_reply = socket.recv()
+        rtt = time.monotonic() - start
+        try:
+            reply = msgspec.msgpack.decode(packed_reply)
+        except msgspec.DecodeError:
+            reply = None
+        reply = reply if isinstance(reply, dict) else {}
+        if not endpoint.startswith('ipc://') or reply.get("ipc_endpoint"):
+            _update_ipc_endpoint(address, reply)
+        return rtt, reply
 
     except zmq.error.Again:
-        log.warning(f"Ping timed out to {address}.")
-        return False
+        log.debug(f"Ping timed out to {endpoint}.")
+        if endpoint.startswith('ipc://'):
+            _drop_ipc_endpoint(address)
+        return None
     except Exception as e:
         log.error(f"An unexpected error occurred during ping: {e}", exc_info=True)
+        return None
+    finally:
+        if socket:
+            socket.close()
+
+def send_ping(address, timeout=2000):
+    """向服务器发送一个简单的 ping，只检查是否收到回复，不关心内容。"""
+    log.info(f"Pinging {address}...")
+    if probe(address, timeout) is None:
+        log.warning(f"Ping failed to {address}.")
         return False
+    log.info("Ping successful.")
+    return True
+
+def _new_req_socket(address, timeout):
+    import zmq
+
+    socket = get_zmq_context().socket(zmq.REQ)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.setsockopt(zmq.RCVTIMEO, timeout)
+    socket.setsockopt(zmq.SNDTIMEO, timeout)
+    socket.connect(_prepare_address(address))
+    return socket
+
+def upload_resumable(address, payload, timeout=10000, cancel_event=None, max_stalls=3):
+    """
+    以内容哈希为标识分块上传负载，服务器对每一块回复已确认的偏移。
+
+    协议 (REQ/REP):
+      ["upload_begin" {upload_id, size}]            -> {"status": "ok", "offset": 已收到的字节数}
+      ["upload_chunk" {upload_id, offset}, 数据块]  -> {"status": "ok", "offset": 新的偏移}
+    请求超时或连接中断时丢弃 socket，重新发送 upload_begin 询问服务器已收到多少，
+    然后从该偏移继续，而不是从头重新发送。同一内容的再次发送 (例如任务失败后重试) 同样会续传。
+
+    只处理单帧 (bytes) 负载；多帧负载 (按通道拆分的原始像素) 仍由 send_data 一次发送。
+
+    :return: upload_id；服务器明确回复不支持续传时返回 None (调用方应回退到普通发送)
+    :raises ConnectionError: 第一次请求超时、连续 max_stalls 次没有进展，或上传被取消
+    """
+    import hashlib
+    import zmq
+    import msgspec
+
+    upload_id = hashlib.sha256(payload).hexdigest()
+    size = len(payload)
+    view = memoryview(payload)
+    encoder = msgspec.msgpack.Encoder()
+    decoder = msgspec.msgpack.Decoder()
+
+    socket = None
+    offset = None  # None 表示需要向服务器询问当前偏移
+    acked = -1
+    stalls = 0
+    try:
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise ConnectionError("Upload cancelled.")
+            if offset is not None and offset >= size:
+                return upload_id
+            if socket is None:
+                socket = _new_req_socket(address, timeout)
+
+            sent_at = trace.now()
+            if offset is None:
+                parts = [encoder.encode({"type": "upload_begin", "upload_id": upload_id, "size": size})]
+            else:
+                end = min(offset + RESUMABLE_CHUNK_SIZE, size)
+                parts = [encoder.encode({"type": "upload_chunk", "upload_id": upload_id, "offset": offset}), view[offset:end]]
+
+            try:
+                socket.send_multipart(parts)
+                replied = _wait_for_reply(socket, timeout, cancel_event)
+            except zmq.error.Again:
+                replied = False
+            if not replied:
+                if cancel_event is not None and cancel_event.is_set():
+                    continue
+                # REQ socket 在没有回复时无法继续使用：重建连接并重新询问偏移
+                socket.close()
+                socket = None
+                offset = None
+                stalls += 1
+                trace.record("upload_stall", upload=upload_id[:16], acked=max(acked, 0), start=sent_at)
+                if acked < 0:
+                    # 第一次联系就没有回复：服务器不可达，立即失败，让连接池和调度器尽快切换到其他服务器
+                    raise ConnectionError(f"Server {address} did not answer upload {upload_id[:12]}.")
+                if stalls > max_stalls:
+                    raise ConnectionError(f"Upload {upload_id[:12]} stalled at offset {max(acked, 0)}.")
+                log.warning(f"Upload {upload_id[:12]} interrupted, resuming (attempt {stalls}/{max_stalls}).")
+                continue
+
+            reply = decoder.decode(socket.recv())
+            if not isinstance(reply, dict) or "offset" not in reply:
+                if offset is None and acked < 0:
+                    log.info(f"Server {address} does not support resumable uploads.")
+                    return None
+                raise ConnectionError(f"Unexpected upload reply: {reply}")
+            if reply.get("status") != "ok":
+                raise ConnectionError(f"Server rejected upload: {reply}")
+
+            new_offset = int(reply["offset"])
+            trace.record(
+                "upload", upload=upload_id[:16], size=size, offset=offset, acked=new_offset,
+                start=sent_at, duration=round(trace.now() - sent_at, 6),
+            )
+            if offset is None and new_offset:
+                log.info(f"Resuming upload {upload_id[:12]} at offset {new_offset}/{size}.")
+            if new_offset > acked:
+                acked = new_offset
+                stalls = 0
+            offset = new_offset
     finally:
         if socket:
             socket.close()
 
-def send_data(address, metadata, image_data=None, timeout=10000):
+def _send_arguments(args, kwargs):
+    address = args[0] if args else kwargs.get("address")
+    metadata = args[1] if len(args) > 1 else kwargs.get("metadata")
+    image_data = args[2] if len(args) > 2 else kwargs.get("image_data")
+    return address, metadata, image_data
+
+def _job_id_of_send(args, kwargs):
+    return _send_arguments(args, kwargs)[1].get("return_info", {}).get("job_id")
+
+@profiling.profiled("send_data", job_id_of=_job_id_of_send)
+@trace.traced_send("zmq", _send_arguments)
+def send_data(address, metadata, image_data=None, timeout=10000, cancel_event=None):
     """
     向服务器发送元数据，并可选择性地附加图像二进制数据。
     
     :param address: 服务器地址
     :param metadata: 要发送的元数据 (字典)
-    :param image_data: (可选) 图像的原始二进制数据
+    :param image_data: (可选) 图像的原始二进制数据，或多帧数据的列表
     :param timeout: 超时时间 (毫秒)
+    :param cancel_event: (可选) threading.Event，被设置时放弃等待回复
     :return: 成功时返回 True，否则返回 False
     """
     import zmq
     import msgspec
 
-    address = _prepare_address(address)
-    log.info(f"Sending data to {address}: {metadata}")
+    if resumable_enabled and isinstance(image_data, bytes) and len(image_data) >= RESUMABLE_THRESHOLD:
+        # 大负载先分块上传，成功后只发送引用上传内容的元数据
+        try:
+            upload_id = upload_resumable(address, image_data, timeout, cancel_event)
+        except ConnectionError as e:
+            log.warning(f"Resumable upload to {address} failed: {e}")
+            return False
+        except Exception as e:
+            log.error(f"An unexpected error occurred during upload: {e}", exc_info=True)
+            return False
+        if upload_id is not None:
+            metadata = dict(metadata, upload={"id": upload_id, "size": len(image_data)})
+            image_data = None
+
+    endpoint = _prepare_address(address)
+    log.info(f"Sending data to {endpoint}: {metadata}")
     
     encoder = msgspec.msgpack.Encoder()
     decoder = msgspec.msgpack.Decoder()
@@ -132,18 +364,31 @@ def send_data(address, metadata, image_data=None, timeout=10000):
         socket.setsockopt(zmq.LINGER, 0)
         socket.setsockopt(zmq.RCVTIMEO, timeout)
         socket.setsockopt(zmq.SNDTIMEO, timeout)
-        socket.connect(address)
+        socket.connect(endpoint)
         
         # 构建消息
         message_parts = [packed_metadata]
-        if image_data:
+        if isinstance(image_data, (list, tuple)):
+            # 多帧负载 (例如按通道拆分的原始像素)
+            log.info(f"Attaching {len(image_data)} data frames ({sum(len(frame) for frame in image_data)} bytes).")
+            message_parts.extend(image_data)
+        elif image_data:
             log.info(f"Attaching image data ({len(image_data)} bytes).")
             message_parts.append(image_data)
         
         # 发送多部分消息
         socket.send_multipart(message_parts)
 
-        # 等待回复
+        # 等待回复，期间定期检查是否被取消
+        if not _wait_for_reply(socket, timeout, cancel_event):
+            if cancel_event is not None and cancel_event.is_set():
+                log.info(f"Request to {endpoint} cancelled.")
+            else:
+                log.warning(f"ZMQ request to {endpoint} timed out.")
+                if endpoint.startswith('ipc://'):
+                    _drop_ipc_endpoint(address)
+            return False
+
         packed_reply = socket.recv()
         response = decoder.decode(packed_reply)
 
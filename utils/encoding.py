@@ -0,0 +1,216 @@
+import os
+import struct
+import threading
+import zlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from . import profiling
+
+log = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# 通道数 -> PNG 颜色类型 (灰度, 灰度+Alpha, RGB, RGBA)
+_PNG_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
+# 这些色彩空间存储的是非颜色数据，编码时不做 sRGB 转换
+_DATA_COLOR_SPACES = ("Non-Color", "Raw", "Generic Data")
+
+
+def defer(func, *args, **kwargs):
+    """
+    在编码线程池中立即开始 func(*args, **kwargs)，返回一个等待其结果的无参数可调用对象，
+    可直接用作任务负载。多张图像的编码因此可以并行进行，而不是在调度器的工作线程中依次进行。
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 2), thread_name_prefix="BridgeEncoder")
+        future = _executor.submit(func, *args, **kwargs)
+    return future.result
+
+
+def shutdown():
+    """停止编码线程池，丢弃尚未开始的编码。"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def grab_pixels(image):
+    """
+    在主线程中用 foreach_get 一次性读取图像像素。
+    :return: 形状为 (height, width, channels) 的 float32 数组 (行从下到上)；图像没有像素缓冲区时返回 None
+    """
+    import numpy as np
+
+    width, height = image.size
+    channels = image.channels
+    if not width * height * channels:
+        return None
+    pixels = np.empty(width * height * channels, dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    return pixels.reshape(height, width, channels)
+
+
+def downscale(pixels, scale):
+    """
+    按比例 (0-1) 把像素缩小到 round(尺寸 * scale)，用于生成低分辨率代理。
+    每个目标像素取它覆盖的源像素块的平均值；比例不是整数分之一时块的大小相差一个像素。
+    :return: 缩小后的数组；结果不比原图小时返回 None
+    """
+    import numpy as np
+
+    height, width, channels = pixels.shape
+    new_height, new_width = max(1, round(height * scale)), max(1, round(width * scale))
+    if new_height * new_width >= height * width:
+        return None
+    rows = np.arange(new_height) * height // new_height
+    columns = np.arange(new_width) * width // new_width
+    sums = np.add.reduceat(np.add.reduceat(pixels, rows, axis=0), columns, axis=1)
+    counts = np.outer(np.diff(rows, append=height), np.diff(columns, append=width))
+    return (sums / counts[..., None]).astype(pixels.dtype, copy=False)
+
+
+def needs_srgb_transform(image):
+    """浮点图像的像素是线性的，编码为 PNG 时需要转换到 sRGB；字节图像的像素已经在其色彩空间中。"""
+    return image.is_float and image.colorspace_settings.name not in _DATA_COLOR_SPACES
+
+
+def matches_save_render(image, scene):
+    """
+    encode_png 只做线性到 sRGB 的转换，而 save_render 会应用场景的视图变换 (Filmic、AgX、胶片效果、曝光、曲线)。
+    只有场景使用中性的 Standard 视图变换 (或图像是非颜色数据) 时两者的结果才一致，
+    其他情况应继续使用 save_render，发送给 ComfyUI 的颜色才与图像编辑器中看到的相同。
+    """
+    if image.colorspace_settings.name in _DATA_COLOR_SPACES:
+        return True
+    view = scene.view_settings
+    return (
+        scene.display_settings.display_device == 'sRGB'
+        and view.view_transform == 'Standard'
+        and view.look == 'None'
+        and view.exposure == 0.0
+        and view.gamma == 1.0
+        and not view.use_curve_mapping
+    )
+
+
+def _linear_to_srgb(values):
+    import numpy as np
+
+    return np.where(values <= 0.0031308, values * 12.92, 1.055 * np.power(values, 1 / 2.4) - 0.055)
+
+
+def _chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+
+@profiling.profiled("encode_png")
+def encode_png(pixels, compression=1, bit_depth=8, to_srgb=False):
+    """
+    将 grab_pixels 得到的像素编码为 PNG。只依赖 numpy 和 zlib，可以在工作线程中运行
+    (zlib 压缩期间会释放 GIL，不会阻塞 Blender 主线程)。
+    :param compression: zlib 压缩级别 0-9
+    :param bit_depth: 8 或 16
+    :param to_srgb: 是否先将线性值转换到 sRGB
+    """
+    import numpy as np
+
+    height, width, channels = pixels.shape
+    if channels not in _PNG_COLOR_TYPES:
+        raise ValueError(f"不支持 {channels} 通道的图像。")
+
+    values = np.clip(pixels[::-1], 0.0, 1.0)  # Blender 的第一行在底部，PNG 的第一行在顶部
+    if to_srgb:
+        color_channels = 3 if channels >= 3 else 1
+        values[..., :color_channels] = _linear_to_srgb(values[..., :color_channels])
+    if bit_depth == 16:
+        samples = (values * 65535.0 + 0.5).astype(">u2")
+    else:
+        samples = (values * 255.0 + 0.5).astype(np.uint8)
+
+    # 每行前加一个过滤类型字节 (0 = 不过滤)
+    rows = samples.reshape(height, -1).view(np.uint8)
+    raw = np.zeros((height, rows.shape[1] + 1), dtype=np.uint8)
+    raw[:, 1:] = rows
+
+    header = struct.pack(">IIBBBBB", width, height, bit_depth, _PNG_COLOR_TYPES[channels], 0, 0, 0)
+    return b"".join((
+        _PNG_SIGNATURE,
+        _chunk(b"IHDR", header),
+        _chunk(b"IDAT", zlib.compress(raw.tobytes(), compression)),
+        _chunk(b"IEND", b""),
+    ))
+
+
+# Pillow 解码后与 Blender 字节图像精度相同的格式和模式；16 位和浮点图像交给 Blender 解码以保留精度
+# (Pillow 会把 16 位 RGB 的 PNG 截断为 8 位的 RGB 模式，因此 PNG 还要检查位深)
+_PILLOW_BYTE_FORMATS = ("PNG", "JPEG", "WEBP")
+_PILLOW_BYTE_MODES = ("L", "LA", "RGB", "RGBA")
+
+
+def decode_image_file(path):
+    """
+    用 Pillow (可选依赖) 将结果文件解码为与 grab_pixels 布局一致的 float32 数组，可以在工作线程中运行
+    (Pillow 解码期间会释放 GIL)。只处理 8 位图像，数值与 Blender 加载的字节图像相同。
+    :return: 像素数组 (h, w, c)，行从下到上；Pillow 未安装或不是 8 位图像时返回 None (应交给 Blender 加载)
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    import numpy as np
+
+    try:
+        with open(path, "rb") as f:
+            header = f.read(25)
+        if header.startswith(_PNG_SIGNATURE) and header[24:25] != b"\x08":
+            return None
+        with Image.open(path) as decoded:
+            if decoded.format not in _PILLOW_BYTE_FORMATS or decoded.mode not in _PILLOW_BYTE_MODES:
+                return None
+            values = np.asarray(decoded)
+    except OSError as e:
+        log.debug(f"Pillow 无法解码 {path}: {e}")
+        return None
+    if values.ndim == 2:
+        values = values[..., None]
+    return values[::-1].astype(np.float32) / 255.0
+
+
+# Blender 图像像素的通道名称 (按通道数)
+_CHANNEL_NAMES = {1: ["V"], 2: ["V", "A"], 3: ["R", "G", "B"], 4: ["R", "G", "B", "A"]}
+
+
+def describe_raw(pixels, dtype="float32", planar=False, color_space=""):
+    """生成原始像素数组的元数据，服务器据此用 np.frombuffer 直接还原数组。"""
+    height, width, channels = pixels.shape
+    return {
+        "dtype": dtype,
+        "byte_order": "little",
+        "shape": [height, width] if planar else [height, width, channels],
+        "channels": _CHANNEL_NAMES.get(channels, [f"C{i}" for i in range(channels)]),
+        "layout": "planar" if planar else "interleaved",
+        "color_space": color_space,
+        # Blender 的像素从左下角开始逐行存储
+        "origin": "bottom_left",
+    }
+
+
+@profiling.profiled("encode_raw")
+def encode_raw(pixels, dtype="float32", planar=False):
+    """
+    将像素转换为原始的小端 float16/float32 数组，不做任何压缩或编码。
+    :return: 帧列表。交错布局时只有一帧；平面布局时每个通道一帧
+    """
+    import numpy as np
+
+    data = pixels.astype(np.dtype(dtype).newbyteorder("<"), copy=False)
+    if planar:
+        return [np.ascontiguousarray(data[..., index]).tobytes() for index in range(data.shape[-1])]
+    return [np.ascontiguousarray(data).tobytes()]
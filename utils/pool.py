@@ -0,0 +1,255 @@
+import threading
+import time
+import logging
+
+from . import comms
+
+log = logging.getLogger(__name__)
+
+# 往返时间的指数移动平均系数
+_RTT_ALPHA = 0.3
+# 连续多少次健康检查失败才认为服务器失效
+_DOWN_AFTER = 3
+# 健康检查失败后、确认失效之前的复查间隔 (秒)
+_RECHECK_INTERVAL = 1.0
+
+
+def parse_addresses(text):
+    """将逗号/空白分隔的地址列表解析为去重后的列表，保持原有顺序。"""
+    addresses = []
+    for item in text.replace(';', ',').replace('\n', ',').split(','):
+        item = item.strip()
+        if item and item not in addresses:
+            addresses.append(item)
+    return addresses
+
+
+class Endpoint:
+    """一个 ComfyUI 服务器的健康与负载信息。"""
+
+    def __init__(self, address):
+        self.address = address
+        self.healthy = None  # None 表示尚未检测
+        self.rtt = None
+        self.queue_depth = 0
+        self.in_flight = 0
+        # 正在向此服务器发送的任务数。单线程的服务器在接收任务期间无法回复 ping
+        self.sending = 0
+        # 连续失败的健康检查次数，达到阈值才标记为不可用
+        self.probe_failures = 0
+        # 发送失败的累计次数 (只用于统计，不影响健康状态)
+        self.send_failures = 0
+        # 服务器在 ping 回复中报告的工作流哈希 (工作流、参数和种子)，None 表示结果不可缓存
+        self.workflow_hash = None
+        self.last_checked = None
+
+    def load(self):
+        """用于比较负载的键：先比较排队/进行中的任务数，再比较延迟。"""
+        return (self.in_flight + self.queue_depth, self.rtt if self.rtt is not None else float('inf'))
+
+    def record_rtt(self, rtt):
+        self.rtt = rtt if self.rtt is None else (1 - _RTT_ALPHA) * self.rtt + _RTT_ALPHA * rtt
+
+
+class EndpointPool:
+    """
+    多个 ComfyUI 服务器组成的池。
+
+    后台线程定期 ping 每个服务器以更新健康状态、延迟和队列深度。
+    acquire() 返回负载最低的健康服务器；服务器失效时通知 on_endpoint_down 回调，
+    以便调度器将等待中的任务转移到其他服务器。
+
+    只有连续 down_after 次健康检查失败才认为服务器失效；正在向服务器发送任务时
+    (服务器忙于接收，可能无法回复 ping) 检查失败不计数。发送失败只说明这一次发送失败，
+    不会把服务器标记为不可用，而是立即安排一次健康检查。
+    """
+
+    def __init__(self, interval=5.0, ping_timeout=1500, down_after=_DOWN_AFTER, recheck_interval=_RECHECK_INTERVAL):
+        self.interval = interval
+        self.ping_timeout = ping_timeout
+        self.down_after = max(1, down_after)
+        self.recheck_interval = recheck_interval
+        self.on_endpoint_down = None
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = False
+        self._thread = None
+        # 每次健康状态、延迟或负载变化时递增，供主线程判断是否需要同步连接状态和重绘面板
+        self.version = 0
+
+    # --- 生命周期 ---
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._monitor_loop, name="BridgeEndpointMonitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=self.ping_timeout / 1000.0 * 2)
+        self._thread = None
+
+    # --- 配置 ---
+
+    def set_addresses(self, addresses):
+        """更新服务器列表。保留已有服务器的统计信息。"""
+        with self._lock:
+            if list(self._endpoints) == list(addresses):
+                return
+            self._endpoints = {
+                address: self._endpoints.get(address) or Endpoint(address)
+                for address in addresses
+            }
+            self.version += 1
+            log.info(f"服务器池已更新: {list(self._endpoints)}")
+        self._wake.set()
+
+    # --- 调度 ---
+
+    def acquire(self, exclude=()):
+        """
+        选出负载最低的健康服务器，占用一个名额并登记为正在发送 (发送结束后调用 sent())。
+        没有健康的服务器时仍然选择一个被标记为不可用的服务器实际尝试，
+        而不是仅凭健康检查的结果就让任务失败。所有服务器都已排除时返回 None。
+        """
+        with self._lock:
+            candidates = [endpoint for endpoint in self._endpoints.values() if endpoint.address not in exclude]
+            if not candidates:
+                return None
+            healthy = [endpoint for endpoint in candidates if endpoint.healthy is not False]
+            endpoint = min(healthy or candidates, key=Endpoint.load)
+            endpoint.in_flight += 1
+            endpoint.sending += 1
+            return endpoint.address
+
+    def sent(self, address, success):
+        """一次发送结束。失败时立即安排健康检查，由检查结果决定服务器是否失效。"""
+        with self._lock:
+            endpoint = self._endpoints.get(address)
+            if not endpoint:
+                return
+            endpoint.sending = max(0, endpoint.sending - 1)
+            if not success:
+                endpoint.send_failures += 1
+            self.version += 1
+        if not success:
+            log.warning(f"向服务器 {address} 发送失败，将立即检查其状态。")
+            self._wake.set()
+
+    def release(self, address):
+        """释放 acquire() 占用的名额 (任务结束或转移到其他服务器时)。"""
+        with self._lock:
+            endpoint = self._endpoints.get(address)
+            if not endpoint:
+                return
+            endpoint.in_flight = max(0, endpoint.in_flight - 1)
+            self.version += 1
+
+    def has_healthy(self, exclude=()):
+        """是否还有其他确认健康的服务器可以接手任务。"""
+        with self._lock:
+            return any(
+                endpoint.healthy for endpoint in self._endpoints.values() if endpoint.address not in exclude
+            )
+
+    def workflow_hash(self, address=None):
+        """
+        返回服务器报告的工作流哈希。
+        指定地址时返回该服务器的哈希；否则只有所有健康的服务器报告同一个哈希时才返回它，
+        任务可能被发送到其中任何一个。没有哈希时返回 None，此时结果不能缓存。
+        """
+        with self._lock:
+            if address is not None:
+                endpoint = self._endpoints.get(address)
+                return endpoint.workflow_hash if endpoint else None
+            hashes = {endpoint.workflow_hash for endpoint in self._endpoints.values() if endpoint.healthy}
+        return hashes.pop() if len(hashes) == 1 else None
+
+    def check_now(self):
+        """唤醒监控线程立即检查所有服务器，不等待下一个检查周期。"""
+        self._wake.set()
+
+    def summary(self):
+        """
+        汇总整个池的连接状态，供面板和发送按钮使用 (只读取缓存的检查结果，不会阻塞)。
+        :return: (状态, 延迟秒, 负载)。状态为 'CONNECTED' (至少一个服务器健康)、
+                 'FAILED' (所有服务器都不可用) 或 'DISCONNECTED' (尚未检查完成)；
+                 延迟和负载取自负载最低的健康服务器。池为空时返回 None
+        """
+        with self._lock:
+            endpoints = list(self._endpoints.values())
+            if not endpoints:
+                return None
+            healthy = [endpoint for endpoint in endpoints if endpoint.healthy]
+            if healthy:
+                best = min(healthy, key=Endpoint.load)
+                return 'CONNECTED', best.rtt, best.in_flight + best.queue_depth
+            if all(endpoint.healthy is False for endpoint in endpoints):
+                return 'FAILED', None, None
+            return 'DISCONNECTED', None, None
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                (endpoint.address, endpoint.healthy, endpoint.rtt, endpoint.in_flight + endpoint.queue_depth)
+                for endpoint in self._endpoints.values()
+            ]
+
+    # --- 健康检查 ---
+
+    def _check(self, address):
+        result = comms.probe(address, timeout=self.ping_timeout)
+        went_down = False
+        with self._lock:
+            endpoint = self._endpoints.get(address)
+            if not endpoint:
+                return
+            endpoint.last_checked = time.time()
+            if result is None:
+                if endpoint.sending:
+                    # 服务器正在接收我们的任务，无法回复 ping 是正常的；发送本身有超时
+                    log.debug(f"服务器 {address} 正在接收任务，忽略这次健康检查失败。")
+                    return
+                endpoint.probe_failures += 1
+                if endpoint.probe_failures >= self.down_after:
+                    went_down = endpoint.healthy is not False
+                    endpoint.healthy = False
+                else:
+                    log.debug(f"服务器 {address} 健康检查失败 ({endpoint.probe_failures}/{self.down_after})。")
+            else:
+                rtt, reply = result
+                if endpoint.healthy is False:
+                    log.info(f"服务器 {address} 已恢复。")
+                endpoint.healthy = True
+                endpoint.probe_failures = 0
+                endpoint.record_rtt(rtt)
+                try:
+                    endpoint.queue_depth = int(reply.get("queue_remaining", 0))
+                except (TypeError, ValueError):
+                    endpoint.queue_depth = 0
+                workflow_hash = reply.get("workflow_hash")
+                endpoint.workflow_hash = str(workflow_hash) if workflow_hash else None
+            self.version += 1
+        if went_down:
+            log.warning(f"服务器 {address} 连续 {self.down_after} 次健康检查失败，已标记为不可用。")
+            if self.on_endpoint_down:
+                self.on_endpoint_down(address)
+
+    def _monitor_loop(self):
+        while self._running:
+            with self._lock:
+                addresses = list(self._endpoints)
+            for address in addresses:
+                if not self._running:
+                    return
+                self._check(address)
+            with self._lock:
+                # 有服务器检查失败但尚未确认失效时，较快地复查
+                suspect = any(0 < endpoint.probe_failures < self.down_after for endpoint in self._endpoints.values())
+            self._wake.wait(self.recheck_interval if suspect else self.interval)
+            self._wake.clear()
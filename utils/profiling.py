@@ -0,0 +1,127 @@
+import cProfile
+import functools
+import io
+import itertools
+import os
+import pstats
+import tempfile
+import threading
+import time
+import tracemalloc
+import logging
+
+log = logging.getLogger(__name__)
+
+# 是否启用性能分析 (由 Blender 设置同步)。关闭时被包装的函数只多一次属性检查
+enabled = False
+# 输出目录，为空时使用临时目录下的 profiles 子目录
+output_dir = ""
+
+_TRACEMALLOC_FRAMES = 25
+_TOP_ALLOCATIONS = 30
+
+_counter = itertools.count(1)
+_index_lock = threading.Lock()
+
+
+def configure(enable, directory=""):
+    """启用或关闭性能分析。启用时开始 tracemalloc 跟踪，关闭时停止。"""
+    global enabled, output_dir
+    output_dir = directory
+    if enable and not enabled:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(_TRACEMALLOC_FRAMES)
+        log.info(f"性能分析已启用，输出目录: {get_output_dir()}")
+    elif not enable and enabled:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        log.info("性能分析已关闭。")
+    enabled = enable
+
+
+def get_output_dir():
+    return output_dir or os.path.join(tempfile.gettempdir(), "blender_comfyui_bridge", "profiles")
+
+
+def profiled(name, job_id_of=None, min_duration=0.0):
+    """
+    装饰器：启用性能分析时，用 cProfile 和 tracemalloc 记录每次调用，
+    并将 .prof 文件和内存分配差异写入输出目录 (文件名带任务ID，便于附加到问题报告)。
+
+    :param job_id_of: (可选) 从调用参数中取出任务ID的函数 (args, kwargs) -> str
+    :param min_duration: 耗时低于此秒数的调用不写文件 (用于频繁运行的定时器)
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            return _call(name, func, args, kwargs, job_id_of, min_duration)
+        return wrapper
+    return decorator
+
+
+def call(name, func, *args, **kwargs):
+    """
+    与 profiled 相同，用于不能被装饰的函数 (Blender 会检查 Operator.execute 的参数个数)。
+    """
+    if not enabled:
+        return func(*args, **kwargs)
+    return _call(name, func, args, kwargs, None, 0.0)
+
+
+def _call(name, func, args, kwargs, job_id_of, min_duration):
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # 其他分析工具已在运行 (例如另一个线程中的调用)，只记录耗时和内存
+        profiler = None
+    before = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        duration = time.perf_counter() - start
+        if profiler:
+            profiler.disable()
+        if duration >= min_duration:
+            try:
+                job_id = job_id_of(args, kwargs) if job_id_of else None
+            except Exception:
+                job_id = None
+            try:
+                _dump(name, job_id, duration, profiler, before)
+            except Exception as e:
+                log.warning(f"写入性能分析结果失败: {e}")
+
+
+def _dump(name, job_id, duration, profiler, before):
+    directory = get_output_dir()
+    os.makedirs(directory, exist_ok=True)
+    stem = f"{time.strftime('%Y%m%d-%H%M%S')}_{next(_counter):05d}_{name}"
+    if job_id:
+        stem += f"_{job_id}"
+    base = os.path.join(directory, stem)
+
+    if profiler:
+        profiler.dump_stats(f"{base}.prof")
+
+    lines = [f"{name}  job={job_id or '-'}  thread={threading.current_thread().name}  duration={duration * 1000:.1f} ms"]
+    if profiler:
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(20)
+        lines.append(stream.getvalue())
+    if before is not None and tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        lines.append(f"traced memory: current={current / 1024 / 1024:.1f} MB  peak={peak / 1024 / 1024:.1f} MB")
+        lines.append(f"top {_TOP_ALLOCATIONS} allocation changes:")
+        stats = tracemalloc.take_snapshot().compare_to(before, "lineno")
+        lines.extend(str(stat) for stat in stats[:_TOP_ALLOCATIONS])
+    with open(f"{base}.txt", "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+    # 汇总索引，方便快速找到慢的调用
+    with _index_lock:
+        with open(os.path.join(directory, "index.log"), "a", encoding="utf-8") as f:
+            f.write(f"{stem}\t{duration * 1000:.1f} ms\n")
@@ -0,0 +1,171 @@
+import threading
+import time
+import logging
+
+from .comms import get_zmq_context, _prepare_address
+
+log = logging.getLogger(__name__)
+
+# 进度事件中会被记录的字段
+_PROGRESS_FIELDS = ("node", "step", "total", "queue_position", "status")
+
+_board_instance = None
+_subscriber_instance = None
+_instance_lock = threading.Lock()
+
+
+class ProgressBoard:
+    """
+    线程安全的任务进度模型。
+
+    后台线程写入服务器推送的进度事件，面板只读取快照，从不阻塞。
+    每次更新都会递增 version，主线程定时器据此决定是否重绘面板。
+
+    服务器的 PUB socket 会发布所有客户端的任务进度，因此只记录通过 watch 登记的
+    (本客户端提交的) 任务；任务结束时 discard 同时取消登记，之后迟到的事件被忽略。
+    """
+
+    def __init__(self):
+        self._entries = {}  # job_id -> dict
+        self._watched = set()
+        self._lock = threading.Lock()
+        self.version = 0
+
+    def watch(self, job_id):
+        with self._lock:
+            self._watched.add(job_id)
+
+    def update(self, event):
+        job_id = event.get("job_id")
+        if not job_id:
+            return
+        with self._lock:
+            if job_id not in self._watched:
+                return
+            entry = self._entries.setdefault(job_id, {})
+            for field in _PROGRESS_FIELDS:
+                if field in event:
+                    entry[field] = event[field]
+            entry["updated_at"] = time.time()
+            self.version += 1
+
+    def get(self, job_id):
+        with self._lock:
+            entry = self._entries.get(job_id)
+            return dict(entry) if entry else None
+
+    def discard(self, job_id):
+        with self._lock:
+            self._watched.discard(job_id)
+            if self._entries.pop(job_id, None) is not None:
+                self.version += 1
+
+
+def describe(entry):
+    """将进度条目转换为 (进度比例或 None, 显示文本)。"""
+    step, total = entry.get("step"), entry.get("total")
+    parts = []
+    if entry.get("queue_position"):
+        parts.append(f"排队 #{entry['queue_position']}")
+    if entry.get("node"):
+        parts.append(str(entry["node"]))
+    factor = None
+    if isinstance(step, (int, float)) and isinstance(total, (int, float)) and total > 0:
+        factor = max(0.0, min(1.0, step / total))
+        parts.append(f"{step}/{total}")
+    return factor, "  ".join(parts) or entry.get("status", "")
+
+
+class ProgressSubscriber:
+    """
+    通过 SUB socket 订阅 ComfyUI 发布的进度事件 (用于 HTTP 返回模式)。
+    ZMQ 返回模式下进度事件直接在任务通道上到达，不需要此订阅者。
+
+    服务器可以发送单帧 msgpack 事件，或 [主题, msgpack 事件] 两帧消息。
+    其他客户端的任务的事件由 ProgressBoard 过滤。
+    """
+
+    def __init__(self, board, poll_interval=200):
+        self.board = board
+        self.poll_interval = poll_interval
+        self._addresses = []
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    def set_addresses(self, addresses):
+        with self._lock:
+            self._addresses = list(addresses)
+            should_start = bool(addresses) and not self._running
+            if should_start:
+                self._running = True
+        if should_start:
+            self._thread = threading.Thread(target=self._run, name="BridgeProgressSubscriber", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=2)
+        self._thread = None
+
+    def _run(self):
+        import zmq
+        import msgspec
+
+        socket = get_zmq_context().socket(zmq.SUB)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.setsockopt(zmq.SUBSCRIBE, b"")
+        connected = set()
+        try:
+            while self._running:
+                with self._lock:
+                    wanted = set(_prepare_address(address) for address in self._addresses)
+                for address in wanted - connected:
+                    socket.connect(address)
+                    log.info(f"已订阅 {address} 的进度事件。")
+                for address in connected - wanted:
+                    socket.disconnect(address)
+                connected = wanted
+
+                if not socket.poll(self.poll_interval):
+                    continue
+                while True:
+                    try:
+                        frames = socket.recv_multipart(zmq.NOBLOCK)
+                    except zmq.Again:
+                        break
+                    try:
+                        event = msgspec.msgpack.decode(frames[-1])
+                    except msgspec.DecodeError:
+                        log.debug("忽略无法解码的进度事件。")
+                        continue
+                    if isinstance(event, dict):
+                        self.board.update(event)
+        finally:
+            socket.close()
+
+
+def get_board():
+    global _board_instance
+    with _instance_lock:
+        if _board_instance is None:
+            _board_instance = ProgressBoard()
+        return _board_instance
+
+
+def get_subscriber():
+    global _subscriber_instance
+    board = get_board()
+    with _instance_lock:
+        if _subscriber_instance is None:
+            _subscriber_instance = ProgressSubscriber(board)
+        return _subscriber_instance
+
+
+def stop_subscriber():
+    global _subscriber_instance
+    with _instance_lock:
+        if _subscriber_instance:
+            _subscriber_instance.stop()
+            _subscriber_instance = None
@@ -1,95 +1,536 @@
+import binascii
+import math
+import mmap
+import os
 import threading
 import logging
-import json
-import tempfile
-import os
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import bpy
-from .state import task_queue
+from collections import OrderedDict
+from email import policy
+from email.parser import BytesHeaderParser, BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .state import task_queue, tile_queue
+from .spool import get_spool, suffix_for
+from . import profiling, trace, tiles, scheduler
 
 log = logging.getLogger(__name__)
 
+# 拒绝上传时最多读取并丢弃的请求体大小，超过时直接关闭连接
+_DRAIN_LIMIT = 64 * 1024 * 1024
+
+
+class ChunkedReader:
+    """将 HTTP/1.1 分块传输编码的请求体包装为普通的可读流。"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._remaining = 0
+        self._done = False
+
+    def _next_chunk(self):
+        line = self._stream.readline()
+        if not line:
+            raise ConnectionError("连接在分块数据中途关闭。")
+        size = int(line.split(b';')[0].strip(), 16)
+        if size == 0:
+            # 跳过可选的 trailer，直到空行
+            while self._stream.readline() not in (b'\r\n', b'\n', b''):
+                pass
+            self._done = True
+        self._remaining = size
+
+    def read(self, size=-1):
+        parts = []
+        while not self._done and (size < 0 or size > 0):
+            if self._remaining == 0:
+                self._next_chunk()
+                continue
+            want = self._remaining if size < 0 else min(size, self._remaining)
+            data = self._stream.read(want)
+            if not data:
+                raise ConnectionError("连接在分块数据中途关闭。")
+            parts.append(data)
+            self._remaining -= len(data)
+            if size > 0:
+                size -= len(data)
+            if self._remaining == 0:
+                self._stream.readline()  # 每个分块后的 CRLF
+        return b''.join(parts)
+
+
+class _ReservingReader:
+    """包装大小未知的请求体 (分块传输编码)，读取到的字节随即计入接收端的预留空间。"""
+
+    def __init__(self, stream, handler):
+        self._stream = stream
+        self._handler = handler
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        if data:
+            self._handler.server.service.reserve(len(data))
+            self._handler.reserved_bytes += len(data)
+        return data
+
+
+def _split_multipart(body, content_type):
+    """
+    将 multipart 请求体拆分为 (部分的头, 部分的数据) 列表。body 可以是 bytes 或 mmap，
+    部分的数据是 body 的 memoryview 切片 (经过 base64/quoted-printable 编码的部分为解码后的 bytes)，
+    用完后应调用 release()，否则 mmap 无法关闭。
+    只用 email 解析每个部分的头：完整解析整个请求体会逐行处理二进制数据，1 MB 需要约 60 毫秒。
+    """
+    boundary = BytesParser(policy=policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode('latin-1')
+    ).get_boundary()
+    if not boundary:
+        raise ValueError("multipart 请求缺少 boundary 参数。")
+    # 分隔符之前的 CRLF 属于分隔符；第一个分隔符可以直接位于请求体开头
+    delimiter = b"\r\n--" + boundary.encode('latin-1')
+    if body[:len(delimiter) - 2] == delimiter[2:]:
+        position = len(delimiter) - 2
+    else:
+        position = body.find(delimiter)
+        if position < 0:
+            return []
+        position += len(delimiter)
+
+    view = memoryview(body)
+    parts = []
+    while body[position:position + 2] != b"--":  # 结束分隔符
+        end = body.find(delimiter, position)
+        segment_end = end if end >= 0 else len(body)
+        head_end = body.find(b"\r\n\r\n", position, segment_end)
+        if head_end >= 0:
+            # 分隔符所在行的其余部分 (可能有空白) 不属于部分的头
+            head = bytes(body[position:head_end]).partition(b"\r\n")[2]
+            headers = BytesHeaderParser(policy=policy.HTTP).parsebytes(head + b"\r\n\r\n")
+            data = view[head_end + 4:segment_end]
+            encoding = headers.get('Content-Transfer-Encoding', '').strip().lower()
+            if encoding in ('base64', 'quoted-printable'):
+                encoded = data
+                data = binascii.a2b_base64(encoded) if encoding == 'base64' else binascii.a2b_qp(encoded)
+                encoded.release()
+            parts.append((headers, data))
+        if end < 0:
+            break
+        position = end + len(delimiter)
+    view.release()
+    return parts
+
 
 class ReceiverRequestHandler(BaseHTTPRequestHandler):
-    """处理来自 ComfyUI 的 HTTP POST 请求。"""
+    """
+    处理来自 ComfyUI 的 HTTP POST 请求。
 
+    使用 HTTP/1.1 持久连接，同一个 TCP 连接可以连续发送多个结果；
+    请求体可以使用 Content-Length 或分块传输编码，
+    也可以是一个 multipart 请求体，一次携带多张结果图像。
+    """
+
+    protocol_version = "HTTP/1.1"
+    # 持久连接上响应头和响应体分两次写出，Nagle 算法与客户端的延迟确认叠加后每个请求会多等约 40 毫秒
+    disable_nagle_algorithm = True
+
+    def _reply(self, code, body, headers=None):
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _declared_length(self):
+        """请求头中声明的请求体大小，分块传输时为 None。"""
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            return None
+        try:
+            return int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            return 0  # 读取请求体时会再次解析并报错
+
+    def _reject_overloaded(self, retry_after, drain=False):
+        """
+        接收队列已满：回复 503 并建议稍后重试。
+        drain 为 True 且请求体不大时先读取并丢弃请求体 (不写入磁盘)，否则客户端在发送途中被断开，
+        只会看到连接错误而收不到 Retry-After；请求体过大或大小未知时直接关闭连接。
+        """
+        length = self._declared_length() if drain else None
+        if length is not None and length <= _DRAIN_LIMIT:
+            remaining = length
+            while remaining > 0:
+                chunk = self.rfile.read(min(1024 * 1024, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+        else:
+            self.close_connection = True
+        self._reply(503, b'Service Unavailable: result queue is full, retry later.', {'Retry-After': str(retry_after)})
+
+    def handle_expect_100(self):
+        # 客户端先询问是否可以发送请求体时，超出限制则直接拒绝，不必先传输整个结果
+        declared = self._declared_length()
+        retry_after = self.server.service.retry_after(declared)
+        if retry_after is not None:
+            job_id = self.headers.get('X-Bridge-Job-Id')
+            log.warning(f"接收队列已满，拒绝任务 {job_id} 的结果 (Expect: 100-continue)，建议 {retry_after} 秒后重试。")
+            trace.record("result_rejected", via="http", job_id=job_id, size=declared, retry_after=retry_after)
+            self._reject_overloaded(retry_after)
+            return False
+        return super().handle_expect_100()
+
+    def _body_stream(self):
+        """返回 (stream, length)。分块传输时 length 为 None，读取到的字节随即计入预留空间。"""
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            return _ReservingReader(ChunkedReader(self.rfile), self), None
+        return self.rfile, int(self.headers.get('Content-Length', 0))
+
+    @profiling.profiled("do_POST", job_id_of=lambda args, kwargs: args[0].headers.get('X-Bridge-Job-Id'))
     def do_POST(self):
+        service = self.server.service
+        service.request_started(self.server)
         try:
-            content_length = int(self.headers['Content-Length'])
-            content_type = self.headers['Content-Type']
+            self._handle_post(service)
+        finally:
+            service.request_finished(self.server)
 
-            # 从 server 实例获取目标图像名称
-            target_image_name = self.server.target_image_name
+    def _handle_post(self, service):
+        started = trace.now()
+        declared = self._declared_length()
+        retry_after = service.admit(declared)
+        if retry_after is not None:
+            job_id = self.headers.get('X-Bridge-Job-Id')
+            log.warning(f"接收队列已满，拒绝任务 {job_id} 的结果，建议 {retry_after} 秒后重试。")
+            trace.record("result_rejected", via="http", job_id=job_id, size=declared, retry_after=retry_after)
+            self._reject_overloaded(retry_after, drain=True)
+            return
+        # 声明了大小的请求体已全部预留；分块传输的请求体在读取时逐步预留
+        self.reserved_bytes = declared or 0
+        try:
+            self._receive(service, started)
+        finally:
+            service.finish_upload(self.reserved_bytes)
+
+    def _receive(self, service, started):
+        try:
+            content_type = self.headers.get('Content-Type', '')
+
+            # ComfyUI 会在此请求头中原样带回发送时的任务ID
+            job_id = self.headers.get('X-Bridge-Job-Id')
+
+            # 按任务ID查找目标图像，未登记的任务使用默认目标
+            target_image_name = service.resolve(job_id)
             if not target_image_name:
                 log.error("接收服务器未配置目标图像名称。")
-                self.send_response(400)
-                self.end_headers()
-                self.wfile.write(b'Bad Request: Target image not configured on Blender side.')
+                # 请求体未读取，无法继续复用此连接
+                self.close_connection = True
+                self._reply(400, b'Bad Request: Target image not configured on Blender side.')
                 return
 
-            log.info(f"收到 POST 请求，目标图像: '{target_image_name}'")
+            log.info(f"收到 POST 请求，目标图像: '{target_image_name}'，任务: {job_id}")
+
+            tile_header = self.headers.get(tiles.TILE_HEADER)
+            if tile_header is not None:
+                self._receive_tile(tile_header, content_type, target_image_name, job_id, started)
+                return
 
-            # 所有情况都将接收到的数据保存为临时文件
-            image_data = self.rfile.read(content_length)
-            suffix = f".{content_type.split('/')[-1]}" if '/' in content_type else ".tmp"
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-                tmp_file.write(image_data)
-                temp_path = tmp_file.name
-            
-            log.info(f"数据已保存到临时文件: '{temp_path}'")
-            task_queue.put((temp_path, target_image_name))
+            stream, length = self._body_stream()
+            if content_type.lower().startswith('multipart/'):
+                count = self._receive_multipart(stream, length, content_type, target_image_name, job_id)
+                log.info(f"multipart 请求中的 {count} 个结果已保存到暂存目录。")
+            else:
+                # 所有情况都将接收到的数据流式写入暂存目录，应用后由任务队列释放
+                temp_path = get_spool().write_from(stream, length, suffix_for(content_type))
+                log.info(f"数据已保存到暂存文件: '{temp_path}'")
+                task_queue.put(([temp_path], target_image_name, job_id))
+                count = 1
 
-            self.send_response(200)
-            self.end_headers()
-            self.wfile.write(b'OK')
+            self._reply(200, b'OK')
+            trace.record(
+                "result", via="http", job_id=job_id, count=count, size=length, content_type=content_type,
+                start=started, duration=round(trace.now() - started, 6),
+            )
 
         except Exception as e:
             log.error(f"处理 POST 请求时出错: {e}", exc_info=True)
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(b'Internal Server Error')
+            # 请求体可能只读取了一部分，连接上的数据流已不可信
+            self.close_connection = True
+            self._reply(500, b'Internal Server Error')
+
+    def _receive_tile(self, tile_header, content_type, target_image_name, job_id, started):
+        """接收结果图像的一个分块 (或一遍渐进结果)，由主线程直接写入目标图像的像素缓冲区。"""
+        try:
+            info = tiles.parse_tile_info(tile_header)
+        except ValueError as e:
+            log.error(f"任务 {job_id} 的分块信息无效: {e}")
+            self.close_connection = True
+            self._reply(400, f'Bad Request: {e}'.encode('utf-8'))
+            return
+        stream, length = self._body_stream()
+        temp_path = get_spool().write_from(stream, length, suffix_for(content_type))
+        tile_queue.put((temp_path, target_image_name, job_id, info))
+        self._reply(200, b'OK')
+        trace.record(
+            "tile", via="http", job_id=job_id, size=length, content_type=content_type, tile=info,
+            start=started, duration=round(trace.now() - started, 6),
+        )
+
+    def _receive_multipart(self, stream, length, content_type, target_image_name, job_id):
+        """
+        接收 multipart 请求体中的一批结果图像。
+        每个部分可以通过自己的 X-Bridge-Job-Id 头指定任务，否则使用请求级别的任务ID。
+        属于同一任务的部分作为一批结果入队，由主线程一次性应用。
+        请求体先流式写入暂存目录 (与单个结果一样计入字节数上限)，再通过 mmap 拆分，不会整个读入内存。
+        """
+        spool = get_spool()
+        body_path = spool.write_from(stream, length, ".multipart")
+        try:
+            with open(body_path, "rb") as f:
+                body = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+            parts = []
+            try:
+                parts = _split_multipart(body, content_type)
+                batches = {}
+                for headers, data in parts:
+                    if not len(data):
+                        continue
+                    part_job_id = headers.get('X-Bridge-Job-Id', job_id)
+                    batches.setdefault(part_job_id, []).append((data, suffix_for(headers.get_content_type())))
+                count = 0
+                for part_job_id, items in batches.items():
+                    temp_paths = spool.write_batch(items)
+                    task_queue.put((temp_paths, target_image_name, part_job_id))
+                    count += len(temp_paths)
+            finally:
+                for _, data in parts:
+                    if isinstance(data, memoryview):
+                        data.release()
+                if isinstance(body, mmap.mmap):
+                    body.close()
+        finally:
+            spool.release(body_path)
+        return count
 
     def log_message(self, format, *args):
         log.debug(format % args)
 
 
-class BlenderReceiverServer(HTTPServer):
-    """自定义的 HTTPServer，用于持有目标图像名称。"""
-    def __init__(self, server_address, RequestHandlerClass, target_image_name):
-        self.target_image_name = target_image_name
+class BlenderReceiverServer(ThreadingHTTPServer):
+    """
+    自定义的 HTTPServer，通过所属的 ReceiverService 解析目标图像。
+    每个连接在独立线程中处理，使空闲的持久连接不会阻塞其他连接。
+    """
+    daemon_threads = True
+    block_on_close = False
+
+    def __init__(self, server_address, RequestHandlerClass, service):
+        self.service = service
+        # 正在处理的上传数量，关闭前等待其归零
+        self.in_flight = 0
+        self.idle = threading.Condition()
         super().__init__(server_address, RequestHandlerClass)
 
 
 class HttpReceiver(threading.Thread):
     """在一个独立的线程中运行 HTTP 服务器。"""
-    def __init__(self, port):
-        super().__init__(daemon=True)
-        self.port = port
-        self.server = None
+    def __init__(self, server):
+        super().__init__(daemon=True, name=f"BridgeHttpReceiver-{server.server_address[1]}")
+        self.server = server
 
     def run(self):
         try:
-            # 启动时从Blender主线程获取当前的目标图像名称
-            context = bpy.context
-            target_image_name = context.scene.bridge_props.target_image_datablock.name if context.scene.bridge_props.target_image_datablock else None
+            self.server.serve_forever()
+        except Exception as e:
+            log.error(f"HTTP 服务器运行出错: {e}", exc_info=True)
+        log.info(f"端口 {self.server.server_address[1]} 上的 HTTP 接收服务器已停止。")
 
-            if not target_image_name:
-                log.error("无法启动接收服务器：未在Blender中设置目标图像。")
+
+class ReceiverService:
+    """
+    长期运行的 HTTP 接收服务。
+
+    路由表 (任务ID -> 目标图像) 和默认目标图像可以在运行时更新，不需要重启服务器。
+    只有端口改变时才会重新绑定：先在新端口上启动服务器，再在后台等待旧服务器上
+    正在上传的请求完成后关闭它，因此重新绑定期间不会丢失结果。
+    """
+
+    _ROUTE_LIMIT = 256
+    # 主线程每隔此秒数应用一个结果，用于估算建议的重试等待时间
+    _APPLY_INTERVAL = 0.5
+    _MAX_RETRY_AFTER = 30
+
+    def __init__(self, max_uploads=8, max_queued_bytes=1024 * 1024 * 1024):
+        self.port = None
+        self.default_target = None
+        self._routes = OrderedDict()  # job_id -> 目标图像名称
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+        # --- 准入控制 ---
+        # 同时接收的上传数量上限，以及已接收但尚未应用 (加上正在上传) 的结果字节数上限
+        self.max_uploads = max_uploads
+        self.max_queued_bytes = max_queued_bytes
+        self._active_uploads = 0
+        self._reserved_bytes = 0  # 正在上传的请求声明的大小
+        self.accepted = 0
+        self.rejected = 0
+        self.peak_queue_depth = 0
+        self.peak_queued_bytes = 0
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def configure(self, port, default_target=None):
+        """更新设置。端口未改变且服务器在运行时只更新路由信息，不会重启。"""
+        with self._lock:
+            if default_target:
+                self.default_target = default_target
+            if self.is_running and port == self.port:
                 return
+            old_server, old_thread = self._server, self._thread
+            self._server = BlenderReceiverServer(("", port), ReceiverRequestHandler, self)
+            self._thread = HttpReceiver(self._server)
+            self._thread.start()
+            self.port = port
+            log.info(f"HTTP 接收服务器已在端口 {port} 上启动。")
+        if old_server is not None:
+            threading.Thread(
+                target=self._retire, args=(old_server, old_thread), name="BridgeReceiverDrain", daemon=True,
+            ).start()
 
-            self.server = BlenderReceiverServer(("", self.port), ReceiverRequestHandler, target_image_name)
-            
-            log.info(f"正在端口 {self.port} 上启动 Blender HTTP 接收服务器...")
-            self.server.serve_forever()
-            log.info("Blender HTTP 接收服务器已停止。")
+    def add_route(self, job_id, target_image_name):
+        with self._lock:
+            self._routes[job_id] = target_image_name
+            if len(self._routes) > self._ROUTE_LIMIT:
+                self._evict_finished_routes(keep=job_id)
 
-        except Exception as e:
-            log.error(f"无法启动或运行 HTTP 服务器: {e}", exc_info=True)
+    def _evict_finished_routes(self, keep):
+        """
+        删除已结束任务的路由。仍在排队或等待结果的任务 (以及刚登记、尚未提交的任务 keep) 保留路由，
+        因此一次提交超过上限的批次时路由表会暂时超过上限。
+        """
+        job_scheduler = scheduler.current_scheduler()
+        for job_id in list(self._routes):
+            if job_id == keep:
+                continue
+            job = job_scheduler.get(job_id) if job_scheduler else None
+            if job is None or not job.is_active:
+                del self._routes[job_id]
+
+    def resolve(self, job_id):
+        """返回任务结果应写入的目标图像名称。"""
+        with self._lock:
+            target = self._routes.get(job_id)
+        if target:
+            return target
+        # 没有路由时使用调度器中任务记录的目标图像
+        job_scheduler = scheduler.current_scheduler()
+        job = job_scheduler.get(job_id) if job_scheduler and job_id else None
+        return (job and job.target_image_name) or self.default_target
+
+    def set_limits(self, max_uploads=None, max_queued_bytes=None):
+        with self._lock:
+            if max_uploads is not None:
+                self.max_uploads = max(1, max_uploads)
+            if max_queued_bytes is not None:
+                self.max_queued_bytes = max_queued_bytes
+
+    def _queued_bytes(self):
+        # 暂存目录中的结果在应用后即被释放，因此其总大小就是等待应用的结果大小
+        return get_spool().total_bytes + self._reserved_bytes
+
+    def _overloaded(self, length):
+        """
+        在持有锁的情况下检查是否超出限制。字节数上限取接收端设置和暂存目录上限中较小的一个。
+        队列为空时总是接受，否则超过上限的单个结果永远无法接收。
+        """
+        if self._active_uploads >= self.max_uploads:
+            return True
+        queued = self._queued_bytes()
+        limit = min(self.max_queued_bytes, get_spool().max_bytes)
+        return queued > 0 and queued + (length or 0) > limit
+
+    def _suggest_retry_after(self):
+        """按等待应用的结果数量估算队列排空所需的秒数。"""
+        depth = task_queue.qsize()
+        return max(1, min(self._MAX_RETRY_AFTER, math.ceil(depth * self._APPLY_INTERVAL)))
+
+    def retry_after(self, length):
+        """只检查不预留 (用于 Expect: 100-continue)：可以接收时返回 None，否则计为一次拒绝并返回建议的重试等待秒数。"""
+        with self._lock:
+            if not self._overloaded(length):
+                return None
+            self.rejected += 1
+            return self._suggest_retry_after()
+
+    def admit(self, length):
+        """
+        为一个上传预留名额和空间。
+        :return: 接受时返回 None (之后必须调用 finish_upload)，拒绝时返回建议的重试等待秒数
+        """
+        with self._lock:
+            if self._overloaded(length):
+                self.rejected += 1
+                return self._suggest_retry_after()
+            self.accepted += 1
+            self._active_uploads += 1
+            self._reserved_bytes += length or 0
+            return None
+
+    def reserve(self, length):
+        """为大小未知的请求体追加预留实际读取到的字节，上传结束时由 finish_upload 一并释放。"""
+        with self._lock:
+            self._reserved_bytes += length
+
+    def finish_upload(self, length):
+        with self._lock:
+            self._active_uploads -= 1
+            self._reserved_bytes -= length or 0
+            self.peak_queue_depth = max(self.peak_queue_depth, task_queue.qsize())
+            self.peak_queued_bytes = max(self.peak_queued_bytes, self._queued_bytes())
+
+    def metrics(self):
+        """接收队列的当前状态和累计计数，供面板显示。"""
+        with self._lock:
+            return {
+                "active_uploads": self._active_uploads,
+                "queue_depth": task_queue.qsize(),
+                "queued_bytes": self._queued_bytes(),
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "peak_queue_depth": self.peak_queue_depth,
+                "peak_queued_bytes": self.peak_queued_bytes,
+            }
+
+    def request_started(self, server):
+        with server.idle:
+            server.in_flight += 1
+
+    def request_finished(self, server):
+        with server.idle:
+            server.in_flight -= 1
+            server.idle.notify_all()
+
+    def _retire(self, server, thread, timeout=30):
+        """停止接受新连接，等待正在上传的请求完成后关闭旧服务器。"""
+        server.shutdown()
+        with server.idle:
+            if not server.idle.wait_for(lambda: server.in_flight <= 0, timeout):
+                log.warning(f"等待端口 {server.server_address[1]} 上 {server.in_flight} 个上传完成超时。")
+        server.server_close()
+        if thread:
+            thread.join(timeout=2)
 
-    def stop(self):
-        if self.server:
+    def stop(self, timeout=5):
+        with self._lock:
+            server, thread = self._server, self._thread
+            self._server = self._thread = None
+            self.port = None
+        if server is not None:
             log.info("正在关闭 Blender HTTP 接收服务器...")
-            self.server.shutdown()
-            self.server.server_close()
-            self.server = None
+            self._retire(server, thread, timeout)
+            log.info("接收服务器已停止。")
@@ -0,0 +1,213 @@
+import bpy
+import queue
+import logging
+from collections import deque
+from bpy.app.handlers import persistent
+
+log = logging.getLogger(__name__)
+
+# 等待开始的渲染请求
+_pending = deque()
+# 正在渲染的请求 (同一时间 Blender 只能运行一个渲染任务)
+_active = None
+# 渲染处理器 (可能在渲染线程中调用) 向主线程定时器传递事件的队列
+_events = queue.Queue()
+
+
+class RenderRequest:
+    """
+    一次"渲染并发送"请求。
+
+    渲染期间场景的输出路径、格式、分辨率比例、相机和启用的视图层被临时覆盖 (write_still 在渲染结束时才读取它们)，
+    渲染完成或取消后恢复为用户的原始设置，再调用 on_complete / on_cancel。
+    """
+
+    def __init__(self, scene_name, filepath, on_complete, on_cancel=None, file_format=None, color_depth=None,
+                 resolution_percentage=None, camera=None, view_layer=None):
+        self.scene_name = scene_name
+        self.filepath = filepath
+        self.file_format = file_format
+        self.color_depth = color_depth
+        # 用于快速的低分辨率代理渲染
+        self.resolution_percentage = resolution_percentage
+        # (可选) 使用的相机物体名称，以及只渲染的视图层名称 (其他视图层在渲染期间被停用)
+        self.camera = camera
+        self.view_layer = view_layer
+        self.on_complete = on_complete
+        self.on_cancel = on_cancel
+        self._original = None
+        self._original_layers = None
+
+    def apply(self, scene):
+        image_settings = scene.render.image_settings
+        self._original = (
+            scene.render.filepath, image_settings.file_format, image_settings.color_depth,
+            scene.render.resolution_percentage, scene.camera,
+        )
+        if self.camera:
+            scene.camera = bpy.data.objects[self.camera]
+        if self.view_layer:
+            self._original_layers = {layer.name: layer.use for layer in scene.view_layers}
+            for layer in scene.view_layers:
+                layer.use = layer.name == self.view_layer
+        scene.render.filepath = self.filepath
+        if self.resolution_percentage:
+            scene.render.resolution_percentage = self.resolution_percentage
+        if self.file_format:
+            image_settings.file_format = self.file_format
+        if self.color_depth:
+            image_settings.color_depth = self.color_depth
+
+    def restore(self):
+        scene = bpy.data.scenes.get(self.scene_name)
+        if scene is None or self._original is None:
+            return
+        image_settings = scene.render.image_settings
+        (scene.render.filepath, image_settings.file_format, image_settings.color_depth,
+         scene.render.resolution_percentage, camera) = self._original
+        if self.camera:
+            scene.camera = camera
+        if self._original_layers:
+            for layer in scene.view_layers:
+                layer.use = self._original_layers.get(layer.name, layer.use)
+        self._original = None
+        self._original_layers = None
+        log.info("用户原始渲染设置已恢复。")
+
+
+def enqueue(request):
+    """
+    将渲染请求加入队列，没有正在进行的渲染时立即开始。
+    :return: 请求前面还在等待的渲染数量 (0 表示已经开始渲染)
+    """
+    _pending.append(request)
+    position = len(_pending) - 1 + (1 if _active else 0)
+    _start_next()
+    return position
+
+
+def pending_count():
+    """正在进行和等待中的渲染请求数量。"""
+    return len(_pending) + (1 if _active else 0)
+
+
+def _render_running():
+    is_job_running = getattr(bpy.app, "is_job_running", None)
+    return bool(is_job_running and is_job_running('RENDER'))
+
+
+def _window_override():
+    """定时器回调中没有窗口上下文，INVOKE 渲染需要显式指定一个窗口。"""
+    wm = bpy.context.window_manager
+    if wm and wm.windows:
+        window = wm.windows[0]
+        return {"window": window, "screen": window.screen}
+    return {}
+
+
+def _start_next():
+    global _active
+    while _active is None and _pending:
+        if _render_running():
+            # 用户自己启动的渲染还在进行，由定时器稍后重试
+            return
+        request = _pending.popleft()
+        scene = bpy.data.scenes.get(request.scene_name)
+        if scene is None:
+            log.warning(f"场景 '{request.scene_name}' 已不存在，跳过渲染请求。")
+            continue
+
+        request.apply(scene)
+        _active = request
+        log.info(f"正在渲染场景到: {request.filepath}...")
+        try:
+            if bpy.app.background:
+                # 后台模式没有事件循环，INVOKE 不可用：同步渲染后立即处理完成事件
+                bpy.ops.render.render(write_still=True, scene=scene.name)
+                _process_events()
+            else:
+                with bpy.context.temp_override(**_window_override()):
+                    result = bpy.ops.render.render('INVOKE_DEFAULT', write_still=True, scene=scene.name)
+                if 'CANCELLED' in result:
+                    raise RuntimeError("Blender refused to start the render.")
+        except Exception as e:
+            log.error(f"渲染操作失败: {e}", exc_info=True)
+            _active = None
+            request.restore()
+            if request.on_cancel:
+                request.on_cancel(request, str(e))
+
+
+def _process_events():
+    """在主线程中处理渲染处理器产生的事件。"""
+    global _active
+    while True:
+        try:
+            event = _events.get_nowait()
+        except queue.Empty:
+            return
+        request, _active = _active, None
+        if request is None:
+            continue
+        request.restore()
+        try:
+            if event == 'COMPLETE':
+                log.info("渲染完成。")
+                request.on_complete(request)
+            else:
+                log.info("渲染已被取消。")
+                if request.on_cancel:
+                    request.on_cancel(request, "Render cancelled.")
+        except Exception as e:
+            log.error(f"处理渲染结果时出错: {e}", exc_info=True)
+
+
+@persistent
+def _on_render_complete(scene, *args):
+    # 只关心由本插件发起的渲染；用户自己的渲染同样会触发此处理器
+    if _active is not None:
+        _events.put('COMPLETE')
+
+
+@persistent
+def _on_render_cancel(scene, *args):
+    if _active is not None:
+        _events.put('CANCEL')
+
+
+def process_render_queue():
+    """
+    处理渲染完成/取消事件并启动下一个排队的渲染。
+    此函数设计为由 bpy.app.timers 运行。
+    """
+    try:
+        _process_events()
+        _start_next()
+    except Exception as e:
+        log.error(f"处理渲染队列时出错: {e}", exc_info=True)
+    return 0.2
+
+
+def register():
+    if _on_render_complete not in bpy.app.handlers.render_complete:
+        bpy.app.handlers.render_complete.append(_on_render_complete)
+    if _on_render_cancel not in bpy.app.handlers.render_cancel:
+        bpy.app.handlers.render_cancel.append(_on_render_cancel)
+    if not bpy.app.timers.is_registered(process_render_queue):
+        bpy.app.timers.register(process_render_queue, first_interval=0.5, persistent=True)
+
+
+def unregister():
+    global _active
+    if _on_render_complete in bpy.app.handlers.render_complete:
+        bpy.app.handlers.render_complete.remove(_on_render_complete)
+    if _on_render_cancel in bpy.app.handlers.render_cancel:
+        bpy.app.handlers.render_cancel.remove(_on_render_cancel)
+    if bpy.app.timers.is_registered(process_render_queue):
+        bpy.app.timers.unregister(process_render_queue)
+    if _active is not None:
+        _active.restore()
+        _active = None
+    _pending.clear()
+    while not _events.empty():
+        _events.get_nowait()
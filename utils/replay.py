@@ -0,0 +1,436 @@
+"""
+通信轨迹回放工具，用于离线复现和二分定位性能回退，不需要 Blender 或真实的 ComfyUI。
+
+在插件目录中运行:
+
+    python -m utils.replay trace.jsonl [--speed 2] [--report report.json] [--record replay.jsonl]
+
+轨迹中的每次发送按原来的时间间隔 (除以 --speed) 重新发送：负载为同样大小的确定性数据，
+经过插件自己的 comms.send_data (包括可续传上传) 发送到本地替身服务器。
+替身服务器按轨迹中服务器的处理时间延迟后，将同样大小的结果 POST 回插件自己的 HTTP 接收服务。
+通道方式 (ZMQ DEALER/ROUTER) 的轨迹同样以请求-回复方式回放，结果统一通过 HTTP 返回。
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import queue
+import socket
+import statistics
+import sys
+import threading
+import time
+import logging
+from urllib.parse import urlparse
+
+from . import comms, state, spool, trace
+from .receiver import ReceiverService
+
+log = logging.getLogger(__name__)
+
+_BLOCK_SIZE = 64 * 1024
+# 替身服务器回传结果被拒绝 (503) 时的最多尝试次数
+_MAX_RESULT_ATTEMPTS = 20
+
+
+def load_trace(path):
+    """读取轨迹文件，返回事件列表 (按时间排序)。"""
+    events = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                events.append(json.loads(line))
+    return sorted(events, key=lambda event: event.get("start", event.get("t", 0.0)))
+
+
+def deterministic_payload(size, seed):
+    """由种子 (原负载的哈希) 生成固定内容的数据，多次回放发送完全相同的字节。"""
+    block = b"".join(hashlib.sha256(f"{seed}:{i}".encode()).digest() for i in range(_BLOCK_SIZE // 32))
+    return (block * (size // len(block) + 1))[:size]
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+class ReplayJob:
+    """一次回放的发送，以及轨迹中记录的原始耗时。"""
+
+    def __init__(self, event, results):
+        self.job_id = event.get("job_id") or f"replay-{id(self):x}"
+        self.offset = event.get("start", event["t"])
+        self.event = event
+        self.recorded_send = event.get("duration")
+        self.recorded_total = None
+        self.server_delay = 0.0
+        self.result_size = event.get("size", 0)
+        if results:
+            first = results[0]
+            # 服务器处理时间: 发送确认后到第一个结果到达
+            self.server_delay = max(0.0, first.get("start", first["t"]) - event["t"])
+            self.recorded_total = first["t"] - self.offset
+            sizes = [result.get("size") for result in results if result.get("size")]
+            if sizes:
+                self.result_size = sizes[0]
+        self.result_retries = 0
+        self.sent_at = None
+        self.send_seconds = None
+        self.total_seconds = None
+        self.ok = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "size": self.event.get("size", 0),
+            "ok": self.ok,
+            "recorded_send_seconds": self.recorded_send,
+            "replayed_send_seconds": self.send_seconds,
+            "recorded_total_seconds": self.recorded_total,
+            "replayed_total_seconds": self.total_seconds,
+            "result_retries": self.result_retries,
+        }
+
+
+class StandInServer:
+    """
+    本地替身服务器，在 REP socket 上模拟 ComfyUI 端的协议:
+    ping、可续传上传 (upload_begin/upload_chunk) 和任务确认；确认后按轨迹中的服务器处理时间延迟，
+    再将结果 POST 到任务元数据中的回调地址。
+
+    与真实的单线程服务器一样一次只处理一个请求：ack_delay 大于 0 时确认任务前先等待，
+    期间 ping 也得不到回复。received 和 cancelled 按到达顺序记录收到和被取消的任务ID，供测试检查。
+    upload_offsets 按到达顺序记录每次 upload_begin 回复的偏移和每个被接受的数据块的偏移，
+    uploaded_hash(upload_id) 返回已组装内容的 SHA-256 (应等于 upload_id)。
+    workflow_hash 不为 None 时在 ping 回复中报告，用于测试结果缓存。
+
+    ipc_path 不为 None 时同时在该 Unix 域套接字上监听，并在 ping 回复中报告 ipc_endpoint。
+
+    progress_steps 大于 0 时还在 PUB socket (progress_address) 上为每个确认的任务发布合成的进度事件
+    ([任务ID, 事件] 两帧)，同时为一个名为 "other-<任务ID>" 的任务发布同样的事件，模拟同一服务器上的其他客户端。
+    """
+
+    def __init__(self, jobs=(), ack_delay=0.0, workflow_hash=None, progress_steps=0, progress_interval=0.05,
+                 ipc_path=None):
+        self._jobs = {job.job_id: job for job in jobs}
+        self.ack_delay = ack_delay
+        self.workflow_hash = workflow_hash
+        self.ipc_endpoint = f"ipc://{ipc_path}" if ipc_path else None
+        self.progress_steps = progress_steps
+        self.progress_interval = progress_interval
+        self.progress_address = None
+        self.published = 0
+        self._progress_queue = queue.Queue()
+        self._publisher = None
+        self.received = []
+        self.cancelled = []
+        self._uploads = {}  # upload_id -> [已收到的字节数, 内容的增量哈希]
+        self.upload_offsets = []
+        self._running = False
+        self._thread = None
+        self._timers = []
+        self.address = None
+
+    def start(self):
+        import zmq
+
+        self._socket = comms.get_zmq_context().socket(zmq.REP)
+        self._socket.setsockopt(zmq.LINGER, 0)
+        port = self._socket.bind_to_random_port("tcp://127.0.0.1")
+        self.address = f"127.0.0.1:{port}"
+        if self.ipc_endpoint:
+            self._socket.bind(self.ipc_endpoint)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="ReplayStandInServer", daemon=True)
+        self._thread.start()
+        if self.progress_steps:
+            pub = comms.get_zmq_context().socket(zmq.PUB)
+            pub.setsockopt(zmq.LINGER, 0)
+            self.progress_address = f"127.0.0.1:{pub.bind_to_random_port('tcp://127.0.0.1')}"
+            self._publisher = threading.Thread(
+                target=self._publish, args=(pub,), name="ReplayStandInProgress", daemon=True,
+            )
+            self._publisher.start()
+
+    def stop(self):
+        self._running = False
+        for timer in self._timers:
+            timer.cancel()
+        for thread in (self._thread, self._publisher):
+            if thread:
+                thread.join(timeout=2)
+
+    def _run(self):
+        import zmq
+        import msgspec
+
+        poller = zmq.Poller()
+        poller.register(self._socket, zmq.POLLIN)
+        try:
+            while self._running:
+                if not poller.poll(100):
+                    continue
+                frames = self._socket.recv_multipart()
+                header = msgspec.msgpack.decode(frames[0])
+                self._socket.send(msgspec.msgpack.encode(self._handle(header, frames[1:])))
+        finally:
+            self._socket.close()
+
+    def _handle(self, header, data_frames):
+        kind = header.get("type")
+        if kind == "ping":
+            reply = {"status": "ok", "queue_remaining": 0}
+            if self.workflow_hash is not None:
+                reply["workflow_hash"] = self.workflow_hash
+            if self.ipc_endpoint:
+                reply["ipc_endpoint"] = self.ipc_endpoint
+            return reply
+        if kind == "upload_begin":
+            upload = self._uploads.setdefault(header["upload_id"], [0, hashlib.sha256()])
+            self.upload_offsets.append(("begin", upload[0]))
+            return {"status": "ok", "offset": upload[0]}
+        if kind == "upload_chunk":
+            upload = self._uploads.setdefault(header["upload_id"], [0, hashlib.sha256()])
+            if header.get("offset") == upload[0] and data_frames:
+                # 只接受从当前偏移开始的数据块，其余的直接回复当前偏移
+                self.upload_offsets.append(("chunk", upload[0]))
+                upload[0] += len(data_frames[0])
+                upload[1].update(data_frames[0])
+            return {"status": "ok", "offset": upload[0]}
+        if kind == "cancel":
+            self.cancelled.append(header.get("job_id"))
+            return {"status": "ok"}
+
+        return_info = header.get("return_info") or {}
+        self.received.append(return_info.get("job_id"))
+        if self.progress_steps and return_info.get("job_id"):
+            self._progress_queue.put(return_info["job_id"])
+        if self.ack_delay:
+            time.sleep(self.ack_delay)
+        job = self._jobs.get(return_info.get("job_id"))
+        if job is not None and return_info.get("blender_server_address"):
+            timer = threading.Timer(job.server_delay, self._post_result, args=(return_info, job))
+            timer.daemon = True
+            self._timers.append(timer)
+            timer.start()
+        return {"status": "ok"}
+
+    def uploaded_hash(self, upload_id):
+        upload = self._uploads.get(upload_id)
+        return upload[1].hexdigest() if upload else None
+
+    def _publish(self, pub):
+        """按顺序为每个确认的任务 (以及对应的其他客户端任务) 发布 progress_steps 个进度事件。"""
+        import msgspec
+
+        try:
+            while self._running:
+                try:
+                    job_id = self._progress_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                for step in range(1, self.progress_steps + 1):
+                    if not self._running:
+                        return
+                    for event_job_id in (job_id, f"other-{job_id}"):
+                        event = {
+                            "type": "progress", "job_id": event_job_id, "node": "KSampler",
+                            "step": step, "total": self.progress_steps, "queue_position": 0,
+                        }
+                        pub.send_multipart([event_job_id.encode("utf-8"), msgspec.msgpack.encode(event)])
+                        self.published += 1
+                    time.sleep(self.progress_interval)
+        finally:
+            pub.close()
+
+    def _post_result(self, return_info, job):
+        """回传结果。接收端过载 (503) 时按 Retry-After 等待后重试，与 ComfyUI 端的行为一致。"""
+        url = urlparse(return_info["blender_server_address"])
+        body = deterministic_payload(job.result_size or 1, f"result:{job.job_id}")
+        for _ in range(_MAX_RESULT_ATTEMPTS):
+            if not self._running:
+                return
+            connection = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+            try:
+                connection.request("POST", "/", body=body, headers={
+                    "Content-Type": "image/png", "X-Bridge-Job-Id": job.job_id,
+                })
+                response = connection.getresponse()
+                response.read()
+                if response.status != 503:
+                    return
+                retry_after = float(response.getheader("Retry-After") or 1)
+            except (BrokenPipeError, ConnectionResetError):
+                # 接收端在请求体发送完之前拒绝并关闭了连接
+                retry_after = 1.0
+            except OSError as e:
+                log.error(f"替身服务器回传任务 {job.job_id} 的结果失败: {e}")
+                return
+            finally:
+                connection.close()
+            job.result_retries += 1
+            time.sleep(retry_after)
+        log.error(f"任务 {job.job_id} 的结果被拒绝 {_MAX_RESULT_ATTEMPTS} 次，放弃回传。")
+
+
+def replay(events, speed=1.0, timeout=60.0, apply_delay=0.0, max_uploads=None, max_queued_bytes=None):
+    """
+    按轨迹回放所有发送并等待结果。
+    :param apply_delay: 每个结果"应用"所需的秒数，用于模拟繁忙的 Blender 主线程
+    :param max_uploads: (可选) 接收端同时上传数量上限
+    :param max_queued_bytes: (可选) 接收端待应用结果字节数上限
+    :return: (ReplayJob 列表 (按发送顺序), 接收端指标)
+    """
+    results = {}
+    for event in events:
+        if event.get("kind") == "result" and event.get("job_id"):
+            results.setdefault(event["job_id"], []).append(event)
+    jobs = [ReplayJob(event, results.get(event.get("job_id"), [])) for event in events if event.get("kind") == "send"]
+    if not jobs:
+        return jobs, {}
+    by_id = {}
+    for job in jobs:
+        # 同一任务的重试在轨迹中有多条发送记录，回放时各自独立
+        if job.job_id in by_id:
+            job.job_id = f"{job.job_id}-{len(by_id)}"
+        by_id[job.job_id] = job
+
+    server = StandInServer(jobs)
+    server.start()
+    receiver_port = _free_port()
+    service = ReceiverService()
+    service.set_limits(max_uploads, max_queued_bytes)
+    service.configure(receiver_port, default_target="replay")
+    callback = f"http://127.0.0.1:{receiver_port}"
+
+    pending = set(by_id)
+    pending_lock = threading.Lock()
+    done = threading.Event()
+
+    def collect():
+        while not done.is_set():
+            try:
+                image_paths, _, job_id = state.task_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if apply_delay:
+                time.sleep(apply_delay)
+            for image_path in image_paths:
+                spool.get_spool().release(image_path)
+            job = by_id.get(job_id)
+            if job is None or job.total_seconds is not None:
+                continue
+            job.total_seconds = time.monotonic() - job.sent_at
+            with pending_lock:
+                pending.discard(job_id)
+                if not pending:
+                    done.set()
+
+    def send(job):
+        event = job.event
+        frames = max(1, event.get("frames", 1))
+        size = event.get("size", 0)
+        if frames > 1:
+            frame_size = size // frames
+            payload = [deterministic_payload(frame_size, f"{event.get('sha')}:{i}") for i in range(frames)]
+        else:
+            payload = deterministic_payload(size, event.get("sha")) if size else None
+        metadata = dict(event.get("metadata") or {})
+        metadata["return_info"] = {"blender_server_address": callback, "job_id": job.job_id}
+        job.sent_at = time.monotonic()
+        job.ok = comms.send_data(server.address, metadata, payload)
+        job.send_seconds = time.monotonic() - job.sent_at
+        if not job.ok:
+            with pending_lock:
+                pending.discard(job.job_id)
+                if not pending:
+                    done.set()
+
+    collector = threading.Thread(target=collect, name="ReplayCollector", daemon=True)
+    collector.start()
+    senders = []
+    origin = jobs[0].offset
+    started = time.monotonic()
+    try:
+        for job in jobs:
+            # 保持原来的发送间隔
+            delay = (job.offset - origin) / speed - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+            sender = threading.Thread(target=send, args=(job,), name=f"ReplaySend-{job.job_id}", daemon=True)
+            sender.start()
+            senders.append(sender)
+        for sender in senders:
+            sender.join()
+        done.wait(timeout)
+    finally:
+        done.set()
+        collector.join(timeout=1)
+        server.stop()
+        metrics = service.metrics()
+        service.stop()
+    return jobs, metrics
+
+
+def summarize(jobs, receiver_metrics=None):
+    """录制时和回放时的发送耗时、端到端耗时的统计 (中位数、P95、最大值)。"""
+    def stats(values):
+        values = sorted(value for value in values if value is not None)
+        if not values:
+            return None
+        return {
+            "p50": round(statistics.median(values), 4),
+            "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 4),
+            "max": round(values[-1], 4),
+        }
+
+    return {
+        "jobs": len(jobs),
+        "failed": sum(1 for job in jobs if not job.ok),
+        "missing_results": sum(1 for job in jobs if job.ok and job.total_seconds is None),
+        "recorded_send": stats(job.recorded_send for job in jobs),
+        "replayed_send": stats(job.send_seconds for job in jobs),
+        "recorded_total": stats(job.recorded_total for job in jobs),
+        "replayed_total": stats(job.total_seconds for job in jobs),
+        "result_retries": sum(job.result_retries for job in jobs),
+        "receiver": receiver_metrics or {},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m utils.replay", description="Replay a recorded bridge trace against a local stand-in server.")
+    parser.add_argument("trace", help="Trace file recorded by the add-on (.jsonl)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed factor for the gaps between sends (default: 1.0)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for outstanding results after the last send")
+    parser.add_argument("--report", help="Write per-job timings and the summary to this JSON file")
+    parser.add_argument("--record", help="Record the replayed traffic to a new trace file")
+    parser.add_argument("--apply-delay", type=float, default=0.0, help="Seconds the simulated main thread spends applying each result")
+    parser.add_argument("--max-uploads", type=int, help="Receiver limit on concurrent result uploads")
+    parser.add_argument("--max-queued-mb", type=float, help="Receiver limit on results waiting to be applied (MB)")
+    parser.add_argument("--verbose", action="store_true", help="Show the add-on's log output")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    if args.record:
+        trace.configure(True, args.record)
+    try:
+        jobs, receiver_metrics = replay(
+            load_trace(args.trace), speed=max(args.speed, 1e-6), timeout=args.timeout, apply_delay=args.apply_delay,
+            max_uploads=args.max_uploads,
+            max_queued_bytes=int(args.max_queued_mb * 1024 * 1024) if args.max_queued_mb else None,
+        )
+    finally:
+        trace.configure(False)
+
+    summary = summarize(jobs, receiver_metrics)
+    print(json.dumps(summary, indent=2))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "jobs": [job.to_dict() for job in jobs]}, f, indent=2)
+    return 1 if summary["failed"] or summary["missing_results"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,486 @@
+import heapq
+import itertools
+import os
+import tempfile
+import threading
+import time
+import uuid
+import logging
+
+from . import comms, channel, progress, cache, state, spool
+from .pool import EndpointPool
+
+log = logging.getLogger(__name__)
+
+# --- 优先级 ---
+# 数值越小越优先。交互式预览总是排在批处理任务之前。
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+PRIORITY_BY_NAME = {
+    'INTERACTIVE': PRIORITY_INTERACTIVE,
+    'BATCH': PRIORITY_BATCH,
+}
+
+# --- 任务状态 ---
+# QUEUED   -> 在调度器队列中等待发送
+# SENDING  -> 工作线程正在发送
+# WAITING  -> 已发送，等待 ComfyUI 返回结果
+# DONE / FAILED / CANCELLED -> 终止状态
+ACTIVE_STATES = ('QUEUED', 'SENDING', 'WAITING')
+
+# 面板中最多保留的已结束任务数量
+_HISTORY_LIMIT = 20
+
+_scheduler_instance = None
+_scheduler_lock = threading.Lock()
+
+# 已确认任务的负载写入此目录 (每个进程一个子目录)，任务需要转移到其他服务器时再读回
+_PAYLOAD_BASE = os.path.join(tempfile.gettempdir(), "blender_comfyui_bridge", "payloads")
+_payload_directory = None
+
+
+class SpilledPayload:
+    """
+    写入磁盘的负载。服务器确认任务后，等待结果期间不再在内存中保留整个负载；
+    作为无参数的可调用对象，任务被重新调度时由工作线程读回 (与延迟编码的负载相同)。
+    """
+
+    def __init__(self, path, frames):
+        self.path = path
+        self.frames = frames
+
+    @classmethod
+    def write(cls, job_id, payload):
+        import msgspec
+
+        global _payload_directory
+        if _payload_directory is None:
+            _payload_directory = spool.process_directory(_PAYLOAD_BASE)
+        path = os.path.join(_payload_directory, f"{job_id}.payload")
+        frames = isinstance(payload, (list, tuple))
+        with open(path, "wb") as f:
+            # 多帧负载 (例如按通道拆分的原始像素) 编码为一个 msgpack 列表
+            f.write(msgspec.msgpack.encode(list(payload)) if frames else payload)
+        return cls(path, frames)
+
+    def __call__(self):
+        import msgspec
+
+        with open(self.path, "rb") as f:
+            data = f.read()
+        return msgspec.msgpack.decode(data) if self.frames else data
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class Job:
+    """
+    一个发送到 ComfyUI 的任务。
+    address 为 None 时，由调度器从服务器池中选择负载最低的服务器。
+    payload 可以是一个无参数的可调用对象 (例如图像编码)，由工作线程在发送前求值，不占用主线程。
+    """
+
+    def __init__(self, address, metadata, payload=None, priority=PRIORITY_INTERACTIVE,
+                 label="", target_image_name=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.address = address
+        self.pinned = address is not None
+        self.metadata = metadata
+        self.payload = payload
+        self.priority = priority
+        self.label = label or self.id
+        self.target_image_name = target_image_name
+        # 结果是否通过提交任务的同一个 ZMQ 连接返回 (而不是 HTTP 回调)
+        self.return_via_channel = self.metadata.get("return_info", {}).get("transport") == "zmq"
+        # 结果返回后写入结果缓存时使用的键，None 表示不缓存
+        self.cache_key = None
+        # 延迟负载求值后再计算缓存键并查找缓存 (主线程此时还没有负载内容)
+        self.use_cache = False
+        # 计算缓存键时服务器报告的工作流哈希；结果返回时工作流已改变则不写入缓存
+        self.workflow_hash = None
+        # 低分辨率代理任务的结果不能覆盖更新的完整分辨率结果
+        self.is_proxy = "proxy" in self.metadata
+        # 一批结果的应用方式: 'DATABLOCKS' (编号的兄弟数据块) 或 'SEQUENCE' (图像序列)
+        self.batch_target = 'DATABLOCKS'
+        # 任务结束 (完成、失败或取消) 时调用的回调，例如释放共享内存段
+        self.on_finish = None
+        # 参数扫描：负载只上传一次，服务器为每个变体返回一个结果，全部返回后任务才结束
+        self.sweep_count = len((self.metadata.get("sweep") or {}).get("variants", []))
+        self.sweep_received = 0
+        # 扫描结果的应用方式: 'DATABLOCKS' (每个变体一个数据块) 或 'CONTACT_SHEET' (拼成一张缩略图)
+        self.sweep_target = 'DATABLOCKS'
+
+        self.status = 'QUEUED'
+        self.error = None
+        self.cancel_event = threading.Event()
+        # 中断当前这一次发送 (取消时设置)，每次发送前重新创建
+        self.abort_event = threading.Event()
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        # 将任务ID写入回传信息，ComfyUI 返回结果时需要原样带回
+        self.metadata.setdefault("return_info", {})["job_id"] = self.id
+
+    @property
+    def is_active(self):
+        return self.status in ACTIVE_STATES
+
+
+class JobScheduler:
+    """
+    Blender 端的任务调度器。
+
+    任务按 (优先级, 提交顺序) 排队，由少量后台工作线程发送。
+    批处理任务最多占用 max_workers - 1 个工作线程，
+    这样总会留出一个空闲线程给交互式任务，使其无需等待长批次。
+    """
+
+    def __init__(self, max_workers=2, pool=None):
+        self.max_workers = max(2, max_workers)
+        self.pool = pool or EndpointPool()
+        self.pool.on_endpoint_down = self._on_endpoint_down
+        self._heap = []
+        self._counter = itertools.count()
+        self._jobs = {}
+        self._cond = threading.Condition()
+        self._running = False
+        self._active_batch = 0
+        self._workers = []
+        # 每次任务状态变化时递增，供主线程判断是否需要重绘面板
+        self.version = 0
+
+    # --- 生命周期 ---
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"BridgeJobWorker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        self.pool.start()
+        log.info(f"任务调度器已启动 ({self.max_workers} 个工作线程)。")
+
+    def stop(self):
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            for job in self._jobs.values():
+                if job.is_active:
+                    job.cancel_event.set()
+                    job.abort_event.set()
+            self._cond.notify_all()
+        self.pool.stop()
+        for worker in self._workers:
+            worker.join(timeout=2)
+        self._workers = []
+        log.info("任务调度器已停止。")
+
+    # --- 公共接口 ---
+
+    def submit(self, job):
+        """将任务加入队列并立即返回。"""
+        with self._cond:
+            self._jobs[job.id] = job
+            progress.get_board().watch(job.id)
+            heapq.heappush(self._heap, (job.priority, next(self._counter), job))
+            self._touch()
+            self._cond.notify_all()
+        log.info(f"任务 {job.id} ('{job.label}') 已加入队列，优先级 {job.priority}。")
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        取消一个任务。
+        排队中的任务直接移出队列；正在发送的任务会中断发送；
+        已发送的任务会通知服务器取消，并丢弃之后返回的结果。
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if not job or not job.is_active:
+                return False
+            previous_status = job.status
+            job.cancel_event.set()
+            job.abort_event.set()
+            self._finish(job, 'CANCELLED')
+
+        log.info(f"任务 {job_id} 已取消 (原状态: {previous_status})。")
+        if previous_status == 'WAITING':
+            self._notify_cancel(job, job.address)
+        return True
+
+    def _notify_cancel(self, job, address):
+        """通知服务器不再需要任务的结果 (尽力而为，不等待回复)。"""
+        if job.return_via_channel:
+            channel.get_channel().notify(address, {"type": "cancel", "job_id": job.id})
+            return
+        threading.Thread(
+            target=comms.send_request,
+            args=(address, {"type": "cancel", "job_id": job.id}, 2000),
+            daemon=True,
+        ).start()
+
+    def cancel_all(self):
+        with self._cond:
+            job_ids = [job.id for job in self._jobs.values() if job.is_active]
+        for job_id in job_ids:
+            self.cancel(job_id)
+
+    def mark_done(self, job_id, error=None):
+        """结果已应用到 Blender 后由主线程调用。"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job and job.is_active:
+                job.error = error
+                self._finish(job, 'FAILED' if error else 'DONE')
+
+    def snapshot(self):
+        """返回任务列表的快照 (按创建时间排序)，供面板绘制使用。"""
+        with self._cond:
+            return sorted(self._jobs.values(), key=lambda job: job.created_at)
+
+    # --- 内部实现 ---
+
+    def _touch(self):
+        self.version += 1
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        if isinstance(job.payload, SpilledPayload):
+            job.payload.discard()
+        job.payload = None  # 尽早释放大块数据
+        if not job.pinned and job.address:
+            self.pool.release(job.address)
+        progress.get_board().discard(job.id)
+        if job.on_finish:
+            try:
+                job.on_finish(job)
+            except Exception as e:
+                log.error(f"任务 {job.id} 的结束回调出错: {e}", exc_info=True)
+        self._touch()
+        self._prune_history()
+
+    def _on_endpoint_down(self, address):
+        """
+        服务器确认失效 (连续多次健康检查失败) 时，将仍在等待其结果的任务重新排队，转发到其他服务器。
+        正在发送的任务不会被中断，由发送自身的超时决定成败。
+        没有其他健康的服务器时任务继续等待，服务器恢复后仍可能返回结果。
+        """
+        if not self.pool.has_healthy(exclude=(address,)):
+            log.warning(f"服务器 {address} 失效，但没有其他可用的服务器，等待中的任务将继续等待。")
+            return
+        requeued = []
+        with self._cond:
+            for job in self._jobs.values():
+                if job.pinned or job.address != address:
+                    continue
+                if job.status != 'WAITING' or job.payload is None:
+                    continue
+                log.warning(f"服务器 {address} 失效，任务 {job.id} 将重新调度。")
+                self.pool.release(address)
+                job.address = None
+                job.status = 'QUEUED'
+                heapq.heappush(self._heap, (job.priority, next(self._counter), job))
+                requeued.append(job)
+                self._touch()
+            self._cond.notify_all()
+        for job in requeued:
+            # 服务器恢复后不应再处理已转移的任务；之后到达的重复结果会被主线程丢弃
+            self._notify_cancel(job, address)
+
+    def _prune_history(self):
+        finished = [job for job in self._jobs.values() if not job.is_active]
+        if len(finished) <= _HISTORY_LIMIT:
+            return
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[:len(finished) - _HISTORY_LIMIT]:
+            del self._jobs[job.id]
+
+    def _take_next(self):
+        """在持有锁的情况下取出下一个可执行的任务，没有则返回 None。"""
+        while self._heap:
+            priority, _, job = self._heap[0]
+            if job.status != 'QUEUED':
+                heapq.heappop(self._heap)  # 已取消的任务，惰性移除
+                continue
+            if priority >= PRIORITY_BATCH and self._active_batch >= self.max_workers - 1:
+                return None
+            heapq.heappop(self._heap)
+            return job
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                job = None
+                while self._running:
+                    job = self._take_next()
+                    if job:
+                        break
+                    self._cond.wait()
+                if not self._running:
+                    return
+                job.status = 'SENDING'
+                job.started_at = time.time()
+                if job.priority >= PRIORITY_BATCH:
+                    self._active_batch += 1
+                self._touch()
+
+            try:
+                self._run_job(job)
+            finally:
+                with self._cond:
+                    if job.priority >= PRIORITY_BATCH:
+                        self._active_batch -= 1
+                    self._cond.notify_all()
+
+    def _prepare_payload(self, job):
+        """
+        在工作线程中生成延迟的负载，并在此时查找结果缓存。
+        :return: 需要继续发送时返回 True
+        """
+        try:
+            payload = job.payload()
+            if isinstance(job.payload, SpilledPayload):
+                # 已读回内存，确认后会重新写入
+                job.payload.discard()
+        except Exception as e:
+            log.error(f"生成任务 {job.id} 的负载失败: {e}", exc_info=True)
+            with self._cond:
+                if job.status == 'SENDING':
+                    job.error = f"Failed to prepare payload: {e}"
+                    self._finish(job, 'FAILED')
+            return False
+
+        if job.use_cache and job.cache_key is None:
+            job.workflow_hash = self.pool.workflow_hash()
+            job.cache_key = cache.make_key(payload, job.metadata, job.workflow_hash)
+            cached_path = job.cache_key and cache.get_result_cache().get(job.cache_key)
+            if cached_path:
+                # 命中缓存：交给主线程直接应用，不再发送
+                with self._cond:
+                    if job.status != 'SENDING':
+                        return False
+                    job.status = 'WAITING'
+                    job.cache_key = None
+                    job.payload = None
+                    self._touch()
+                log.info(f"任务 {job.id} 命中结果缓存，无需发送。")
+                state.task_queue.put(([cached_path], job.target_image_name, job.id))
+                return False
+
+        with self._cond:
+            if job.status != 'SENDING':
+                return False  # 求值期间已被取消
+            job.payload = payload
+        return True
+
+    def _run_job(self, job):
+        if callable(job.payload) and not self._prepare_payload(job):
+            return
+        if job.pinned:
+            success = self._send(job, job.address)
+        else:
+            # 依次尝试负载最低的健康服务器，失败时自动切换到下一个
+            success = False
+            tried = set()
+            while not job.cancel_event.is_set():
+                address = self.pool.acquire(exclude=tried)
+                if address is None:
+                    log.error(f"任务 {job.id} 没有可用的 ComfyUI 服务器。")
+                    break
+                tried.add(address)
+                with self._cond:
+                    job.address = address
+                    job.abort_event = threading.Event()
+                success = self._send(job, address)
+                self.pool.sent(address, success)
+                if success:
+                    break
+                with self._cond:
+                    if job.status != 'SENDING':
+                        break  # 已被取消，名额已在 _finish 中释放
+                    job.address = None
+                self.pool.release(address)
+
+        with self._cond:
+            if job.status != 'SENDING':
+                return  # 发送期间已被取消
+            if not success:
+                job.error = "Failed to send data"
+                self._finish(job, 'FAILED')
+                log.error(f"任务 {job.id} 发送失败。")
+                return
+            job.status = 'WAITING'
+            # 等待结果期间不在内存中保留负载
+            payload, job.payload = job.payload, None
+            self._touch()
+            log.info(f"任务 {job.id} 已发送到 {job.address}，等待结果。")
+
+        if job.pinned or payload is None:
+            return
+        # 服务器失效时任务需要转发到其他服务器，因此负载写入磁盘而不是直接丢弃
+        try:
+            spilled = SpilledPayload.write(job.id, payload)
+        except OSError as e:
+            log.warning(f"无法保存任务 {job.id} 的负载，服务器失效时将无法转发此任务: {e}")
+            return
+        with self._cond:
+            if job.status == 'WAITING' and job.payload is None:
+                job.payload = spilled
+                return
+        spilled.discard()  # 写入期间任务已结束或被重新调度
+
+    def _send(self, job, address):
+        log.info(f"正在发送任务 {job.id} 到 {address}...")
+        try:
+            if job.return_via_channel:
+                return channel.get_channel().send(
+                    address, job.id, job.metadata, job.payload, cancel_event=job.abort_event
+                )
+            return comms.send_data(address, job.metadata, job.payload, cancel_event=job.abort_event)
+        except Exception as e:
+            log.error(f"发送任务 {job.id} 时出错: {e}", exc_info=True)
+            return False
+
+
+def get_scheduler(max_workers=None):
+    """
+    获取 JobScheduler 的单例实例，首次调用时启动工作线程。
+    :param max_workers: (可选) 首次创建时使用的工作线程数，之后的调用忽略此参数
+    """
+    global _scheduler_instance
+    with _scheduler_lock:
+        if _scheduler_instance is None:
+            _scheduler_instance = JobScheduler(max_workers or 2)
+            _scheduler_instance.start()
+        return _scheduler_instance
+
+
+def current_scheduler():
+    """返回已创建的调度器，尚未创建时返回 None (不会启动工作线程)。"""
+    return _scheduler_instance
+
+
+def stop_scheduler():
+    """取消所有任务并停止调度器。"""
+    global _scheduler_instance
+    with _scheduler_lock:
+        if _scheduler_instance:
+            _scheduler_instance.cancel_all()
+            _scheduler_instance.stop()
+            _scheduler_instance = None
@@ -0,0 +1,151 @@
+import json
+import threading
+import logging
+
+log = logging.getLogger(__name__)
+
+# 通过 HTTP 返回共享内存结果时使用的 Content-Type，请求体为 JSON 描述符
+SHM_CONTENT_TYPE = "application/vnd.bridge.shm+json"
+# 共享内存描述符在暂存目录中的扩展名
+SHM_SUFFIX = ".shm"
+
+_ring_instance = None
+_ring_lock = threading.Lock()
+
+
+class SharedMemoryRing:
+    """
+    由少量 multiprocessing.shared_memory 段组成的环形缓冲区。
+
+    发送时像素直接写入一个空闲段，ZMQ 消息中只携带段名、形状和数据类型。
+    段在任务结束 (服务器已读取) 之前保持占用；所有段都被占用时返回 None，调用方回退到普通传输。
+    段只在需要更大容量时才重新分配，连续发送相同尺寸的图像不会产生新的分配。
+    """
+
+    def __init__(self, slots=4):
+        self._segments = [None] * slots
+        self._in_use = [False] * slots
+        self._lock = threading.Lock()
+
+    def acquire(self, nbytes):
+        """占用一个至少 nbytes 大小的段，返回 (槽位, SharedMemory) 或 None。"""
+        from multiprocessing import shared_memory
+
+        with self._lock:
+            free = [i for i, used in enumerate(self._in_use) if not used]
+            if not free:
+                return None
+            # 优先复用已经足够大的段
+            index = next((i for i in free if self._segments[i] and self._segments[i].size >= nbytes), free[0])
+            segment = self._segments[index]
+            if segment is None or segment.size < nbytes:
+                if segment is not None:
+                    self._destroy(segment)
+                segment = shared_memory.SharedMemory(create=True, size=nbytes)
+                self._segments[index] = segment
+                log.info(f"已分配共享内存段 {segment.name} ({nbytes / 1024 / 1024:.1f} MB)。")
+            self._in_use[index] = True
+            return index, segment
+
+    def release(self, index):
+        with self._lock:
+            self._in_use[index] = False
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments:
+                if segment is not None:
+                    self._destroy(segment)
+            self._segments = [None] * len(self._segments)
+            self._in_use = [False] * len(self._in_use)
+
+    @staticmethod
+    def _destroy(segment):
+        try:
+            segment.close()
+            segment.unlink()
+        except (OSError, BufferError) as e:
+            log.warning(f"释放共享内存段 {segment.name} 失败: {e}")
+
+
+def write_image_pixels(ring, image):
+    """
+    将图像的像素写入环形缓冲区中的一个段，不经过编码。
+    :return: (槽位, 描述符字典)，没有空闲段时返回 None
+    """
+    import numpy as np
+
+    width, height = image.size
+    channels = image.channels
+    count = width * height * channels
+    if not count:
+        # 例如 Render Result 这类没有像素缓冲区的图像
+        raise ValueError(f"图像 '{image.name}' 没有可读取的像素。")
+    acquired = ring.acquire(count * 4)
+    if acquired is None:
+        return None
+    index, segment = acquired
+    pixels = np.ndarray((count,), dtype=np.float32, buffer=segment.buf)
+    image.pixels.foreach_get(pixels)
+    del pixels  # 不保留对共享内存缓冲区的引用，否则段无法关闭
+    descriptor = {
+        "name": segment.name,
+        "shape": [height, width, channels],
+        "dtype": "float32",
+        "color_space": image.colorspace_settings.name,
+        # Blender 的像素从左下角开始逐行存储
+        "origin": "bottom_left",
+    }
+    return index, descriptor
+
+
+def read_into_image(image, descriptor_path):
+    """
+    将服务器放在共享内存中的结果直接写入图像的像素缓冲区。
+    结果段的所有权在返回时转移给 Blender，因此读取后将其 unlink。
+    """
+    import numpy as np
+    from multiprocessing import shared_memory
+
+    with open(descriptor_path, "r", encoding="utf-8") as f:
+        descriptor = json.load(f)
+    height, width, channels = descriptor["shape"]
+    segment = shared_memory.SharedMemory(name=descriptor["name"])
+    try:
+        source = np.ndarray((height, width, channels), dtype=np.dtype(descriptor.get("dtype", "float32")), buffer=segment.buf)
+        if descriptor.get("origin", "bottom_left") != "bottom_left":
+            source = source[::-1]
+        if tuple(image.size) != (width, height):
+            image.scale(width, height)
+        target_channels = image.channels
+        if channels == target_channels and source.dtype == np.float32 and source.flags.c_contiguous:
+            image.pixels.foreach_set(source.reshape(-1))
+        else:
+            pixels = np.ones((height, width, target_channels), dtype=np.float32)
+            shared = min(channels, target_channels)
+            pixels[..., :shared] = source[..., :shared]
+            image.pixels.foreach_set(pixels.reshape(-1))
+        del source
+    finally:
+        segment.close()
+        try:
+            segment.unlink()
+        except OSError:
+            pass
+    image.update()
+
+
+def get_ring():
+    global _ring_instance
+    with _ring_lock:
+        if _ring_instance is None:
+            _ring_instance = SharedMemoryRing()
+        return _ring_instance
+
+
+def close_ring():
+    global _ring_instance
+    with _ring_lock:
+        if _ring_instance:
+            _ring_instance.close()
+            _ring_instance = None
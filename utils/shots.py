@@ -0,0 +1,92 @@
+"""
+无界面批量渲染 (headless.py) 的镜头展开和帧范围解析。不依赖 bpy，可以在 Blender 之外测试。
+"""
+import re
+
+# 帧范围: 起始[-结束][x步长]
+_FRAME_RANGE = re.compile(r"^(-?\d+)(?:-(-?\d+))?(?:x(\d+))?$")
+
+
+def _round(value):
+    return round(value, 3) if value is not None else None
+
+
+class Shot:
+    """一次渲染 (帧, 相机, 视图层) 及其发送和返回结果的记录。"""
+
+    def __init__(self, scene_name, frame, camera, view_layer, name):
+        self.scene_name = scene_name
+        self.frame = frame
+        self.camera = camera
+        self.view_layer = view_layer
+        # 同时用作结果的目标名称和输出文件名，由 expand_shots 保证唯一且不含路径分隔符
+        self.name = name
+        self.job = None
+        self.status = 'PENDING'
+        self.error = None
+        self.outputs = []
+        self.render_started = None
+        self.submitted_at = None
+        self.finished_at = None
+        self.render_seconds = None
+
+    def to_dict(self):
+        job = self.job
+        return {
+            "name": self.name,
+            "frame": self.frame,
+            "camera": self.camera,
+            "view_layer": self.view_layer,
+            "status": self.status,
+            "error": self.error,
+            "job_id": job.id if job else None,
+            "server": job.address if job else None,
+            "outputs": self.outputs,
+            "render_seconds": _round(self.render_seconds),
+            # 提交到 ComfyUI 到结果写入磁盘的时间 (包括排队、发送和服务器处理)
+            "comfyui_seconds": _round(self.finished_at - self.submitted_at if self.finished_at and self.submitted_at else None),
+            "send_seconds": _round(job.started_at - self.submitted_at if job and job.started_at else None),
+            "total_seconds": _round(self.finished_at - self.render_started if self.finished_at and self.render_started else None),
+        }
+
+
+def parse_frames(text, default):
+    """
+    解析帧范围，例如 "1-10", "1,5,10-20", "1-100x10" (步长)。为空时返回 [default]。
+    :raises ValueError: 格式不正确
+    """
+    if not text:
+        return [default]
+    frames = []
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        match = _FRAME_RANGE.match(part)
+        if not match:
+            raise ValueError(f"Invalid frame range '{part}'.")
+        start, end, step = match.groups()
+        end = int(end) if end is not None else int(start)
+        frames.extend(range(int(start), end + 1, max(1, int(step or 1))))
+    return list(dict.fromkeys(frames))
+
+
+def expand_shots(scene_name, frames, camera_names, view_layer_names, clean_name):
+    """
+    展开 (帧, 相机, 视图层) 组合。
+    场景、相机和视图层的名称可以包含路径分隔符等字符，镜头名称由 clean_name (bpy.path.clean_name) 清理后
+    才用作文件名；清理后重名的组合 (例如 "Cam.A" 和 "Cam_A") 依次加上 _1、_2 后缀。
+    """
+    shots = []
+    taken = set()
+    for frame in frames:
+        for camera in camera_names:
+            for layer in view_layer_names:
+                name = clean_name(f"{scene_name}_{camera}_{layer}_{frame:04d}")
+                unique, index = name, 1
+                while unique in taken:
+                    unique = f"{name}_{index}"
+                    index += 1
+                taken.add(unique)
+                shots.append(Shot(scene_name, frame, camera, layer, unique))
+    return shots
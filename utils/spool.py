@@ -0,0 +1,229 @@
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 1024 * 1024
+_MAX_WRITE_WORKERS = 8
+
+_spool_instance = None
+_spool_lock = threading.Lock()
+
+
+def suffix_for(content_type):
+    """根据 Content-Type 推断暂存文件的扩展名。"""
+    from .shm import SHM_CONTENT_TYPE, SHM_SUFFIX
+
+    content_type = (content_type or "").split(';')[0].strip()
+    if content_type == SHM_CONTENT_TYPE:
+        return SHM_SUFFIX
+    return f".{content_type.split('/')[-1]}" if '/' in content_type else ".tmp"
+
+
+def _process_alive(pid):
+    """检查进程是否仍在运行 (Windows 上 os.kill 会结束进程，因此改用 OpenProcess 查询)。"""
+    if os.name == "nt":
+        import ctypes
+
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return kernel32.GetLastError() == 5  # ERROR_ACCESS_DENIED: 进程存在但属于其他用户
+        try:
+            exit_code = ctypes.c_ulong()
+            return bool(kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))) and exit_code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def process_directory(base):
+    """
+    返回当前进程在 base 下独占的子目录 (以进程号命名)，不存在时创建。
+    同一台机器上可能同时运行多个 Blender (例如多个 blender -b 批量渲染进程)，
+    因此只清理所属进程已经退出的子目录和旧版本直接放在 base 中的文件，不会删除其他实例的数据。
+    """
+    os.makedirs(base, exist_ok=True)
+    removed = 0
+    for name in os.listdir(base):
+        path = os.path.join(base, name)
+        if os.path.isdir(path):
+            if not name.isdigit() or int(name) == os.getpid() or _process_alive(int(name)):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+        else:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+    if removed:
+        log.info(f"已清理 {base} 中已退出进程遗留的 {removed} 项数据。")
+    directory = os.path.join(base, str(os.getpid()))
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+class Spool:
+    """
+    接收结果的暂存目录。
+
+    文件先写入 .part 临时文件再原子重命名，避免主线程读到写了一半的结果。
+    每个文件带有引用计数，写入时计数为 1 (由任务队列持有)，
+    process_task_queue 应用结果后释放，计数归零时立即删除。
+    暂存的都是尚未应用的结果，因此超过上限时不会删除任何文件：
+    HTTP 接收端按此上限回复 503 Retry-After，让服务器稍后重试；ZMQ 通道则暂停接收，直到结果被应用。
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._files = {}  # path -> [refcount, size]，按写入顺序排列
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._over_limit = False
+        os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    @property
+    def is_full(self):
+        return self._total_bytes >= self.max_bytes
+
+    def _new_path(self, suffix):
+        return os.path.join(self.directory, f"{uuid.uuid4().hex}{suffix}")
+
+    def write(self, data, suffix=".tmp"):
+        """原子地写入一个文件，返回其路径 (引用计数为 1)。"""
+        path = self._new_path(suffix)
+        temp_path = f"{path}.part"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        return self._commit(temp_path, path)
+
+    def write_batch(self, items):
+        """
+        并行写入一批文件，items 为 (data, suffix) 列表。
+        返回与 items 顺序一致的路径列表 (每个文件的引用计数为 1)。
+        """
+        if len(items) == 1:
+            return [self.write(*items[0])]
+        with ThreadPoolExecutor(max_workers=min(_MAX_WRITE_WORKERS, len(items))) as executor:
+            return list(executor.map(lambda item: self.write(*item), items))
+
+    def write_from(self, stream, length, suffix=".tmp"):
+        """
+        从流中分块读取 length 字节并原子地写入一个文件，返回其路径 (引用计数为 1)。
+        length 为 None 时一直读取到流结束 (用于分块传输编码)。
+        """
+        path = self._new_path(suffix)
+        temp_path = f"{path}.part"
+        remaining = length
+        try:
+            with open(temp_path, "wb") as f:
+                while remaining is None or remaining > 0:
+                    chunk = stream.read(_CHUNK_SIZE if remaining is None else min(_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        if remaining is None:
+                            break
+                        raise ConnectionError(f"连接提前关闭，还有 {remaining} 字节未收到。")
+                    f.write(chunk)
+                    if remaining is not None:
+                        remaining -= len(chunk)
+        except Exception:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        return self._commit(temp_path, path)
+
+    def _commit(self, temp_path, path):
+        os.replace(temp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._files[path] = [1, size]
+            self._total_bytes += size
+            self._check_limit()
+        return path
+
+    def acquire(self, path):
+        """增加文件的引用计数。文件已被释放时返回 False。"""
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is None:
+                return False
+            entry[0] += 1
+            return True
+
+    def release(self, path):
+        """减少文件的引用计数，归零时删除文件。"""
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is None:
+                return
+            entry[0] -= 1
+            if entry[0] <= 0:
+                self._remove(path)
+
+    def detach(self, path, destination):
+        """
+        将文件移出暂存目录 (例如作为图像序列长期保留)，之后不再由暂存目录管理。
+        文件已被释放时返回 False。
+        """
+        with self._lock:
+            entry = self._files.pop(path, None)
+            if entry is None:
+                return False
+            self._total_bytes -= entry[1]
+        os.replace(path, destination)
+        return True
+
+    def set_max_bytes(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._check_limit()
+
+    def _remove(self, path):
+        _, size = self._files.pop(path)
+        self._total_bytes -= size
+        try:
+            os.remove(path)
+        except OSError as e:
+            log.warning(f"删除暂存文件失败: {path}. 原因: {e}")
+
+    def _check_limit(self):
+        """超过上限时只记录一次警告：暂存的结果都还未应用，删除它们会丢失结果。"""
+        over_limit = self._total_bytes > self.max_bytes
+        if over_limit and not self._over_limit:
+            log.warning(
+                f"暂存目录中等待应用的结果 ({self._total_bytes / 1024 / 1024:.0f} MB) 超出上限 "
+                f"({self.max_bytes / 1024 / 1024:.0f} MB)，接收端和 ZMQ 通道将暂停接收新的结果。"
+            )
+        self._over_limit = over_limit
+
+
+def get_spool(max_bytes=None):
+    """获取 Spool 的单例实例。传入 max_bytes 时同时更新容量上限。"""
+    global _spool_instance
+    with _spool_lock:
+        if _spool_instance is None:
+            directory = process_directory(os.path.join(tempfile.gettempdir(), "blender_comfyui_bridge", "spool"))
+            _spool_instance = Spool(directory, max_bytes or 2 * 1024 * 1024 * 1024)
+        elif max_bytes is not None and max_bytes != _spool_instance.max_bytes:
+            _spool_instance.set_max_bytes(max_bytes)
+        return _spool_instance
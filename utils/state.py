@@ -6,41 +6,40 @@ log = logging.getLogger(__name__)
 # 用于从 HTTP 接收线程向 Blender 主线程传递任务的队列
 task_queue = queue.Queue()
 
-# 用于持有后台线程的引用，以便在插件卸载时能安全地停止它
-receiver_thread = None
+# 渐进返回的结果分块: (暂存文件路径, 目标图像名称, 任务ID, 分块信息)
+tile_queue = queue.Queue()
 
-def start_receiver_server(port):
-    """启动或重启后台接收服务器"""
+# 长期运行的接收服务，插件卸载时停止
+receiver_service = None
+
+def ensure_receiver_server(port, default_target=None, max_uploads=None, max_queued_bytes=None):
+    """
+    确保接收服务器在指定端口上运行。
+    服务器已在该端口运行时只更新设置；端口改变时在后台排空旧服务器上的上传后再关闭它。
+    :param max_uploads: (可选) 同时接收的上传数量上限
+    :param max_queued_bytes: (可选) 等待应用的结果字节数上限，超出时回复 503 Retry-After
+    """
     from . import receiver # <-- 在函数内部进行局部导入
-    
-    global receiver_thread
-    # 如果已有服务器在运行，先停止它
-    if receiver_thread and receiver_thread.is_alive():
-        log.info("检测到现有接收服务器，正在停止...")
-        stop_receiver_server()
 
-    log.info(f"正在端口 {port} 上启动新的接收服务器...")
-    receiver_thread = receiver.HttpReceiver(port=port)
-    receiver_thread.start()
-    log.info("接收服务器已成功启动。")
+    global receiver_service
+    if receiver_service is None:
+        receiver_service = receiver.ReceiverService()
+    receiver_service.set_limits(max_uploads, max_queued_bytes)
+    try:
+        receiver_service.configure(port, default_target)
+    except OSError as e:
+        log.error(f"无法在端口 {port} 上启动接收服务器: {e}")
+    return receiver_service
 
 def stop_receiver_server():
-    """停止后台接收服务器"""
-    global receiver_thread
-    if receiver_thread and receiver_thread.is_alive():
-        log.info("正在停止接收服务器...")
-        try:
-            receiver_thread.stop()
-            receiver_thread.join(timeout=5)
-            if receiver_thread.is_alive():
-                log.warning("接收线程在超时后仍未停止。")
-        except Exception as e:
-            log.error(f"停止接收线程时发生错误: {e}", exc_info=True)
-        finally:
-            receiver_thread = None
-            log.info("接收服务器已停止。")
-    elif receiver_thread:
-        log.warning("接收线程对象存在但未存活。重置引用。")
-        receiver_thread = None
-    else:
+    """停止后台接收服务器，等待正在进行的上传完成"""
+    global receiver_service
+    if receiver_service is None:
         log.info("接收服务器未在运行。")
+        return
+    try:
+        receiver_service.stop()
+    except Exception as e:
+        log.error(f"停止接收服务器时发生错误: {e}", exc_info=True)
+    finally:
+        receiver_service = None
@@ -1,42 +1,509 @@
 import bpy
+from bpy.app.handlers import persistent
 import logging
-from . import state
+import math
+import os
+import queue
+import shutil
+import tempfile
+import time
+from . import state, scheduler, cache, spool, progress, shm, profiling, encoding, tiles
 
 log = logging.getLogger(__name__)
 
+# 上一次重绘时调度器、进度模型和服务器池的版本号
+_last_redraw_versions = None
+# 上一次同步到场景属性的连接状态
+_last_connection_status = None
+# 每个目标图像最近应用的完整分辨率结果所属任务的创建时间
+_latest_full_result = {}
+# 参数扫描任务正在拼合的缩略图: 任务ID -> ContactSheet
+_contact_sheets = {}
+# 正在渐进显示的结果: 任务ID (没有任务ID时为图像名称) -> tiles.TileCanvas
+_tile_canvases = {}
+# 每次定时器调用中写入分块的时间上限 (秒)，剩余的分块留到下一次调用
+_TILE_BUDGET = 0.05
+
+def _tag_redraw(area_types=('VIEW_3D',)):
+    """标记所有 3D 视图 (或指定类型的区域) 需要重绘，使面板中的任务列表保持最新。"""
+    wm = bpy.context.window_manager
+    if not wm:
+        return
+    for window in wm.windows:
+        for area in window.screen.areas:
+            if area.type in area_types:
+                area.tag_redraw()
+
+def _sync_connection_status(endpoint_pool):
+    """
+    将后台健康检查得到的连接状态写入所有场景的 connection_status，
+    使面板和发送按钮反映服务器当前是否可达。服务器池尚未配置时保持原状态。
+    """
+    global _last_connection_status
+    summary = endpoint_pool.summary()
+    if summary is None:
+        return
+    status = summary[0]
+    if status != _last_connection_status:
+        if status == 'CONNECTED':
+            log.info("与 ComfyUI 连接成功！")
+        elif status == 'FAILED':
+            log.error("连接失败。请检查地址或确保ComfyUI服务器正在运行。")
+        _last_connection_status = status
+    for scene in bpy.data.scenes:
+        props = getattr(scene, "bridge_props", None)
+        # 只在变化时写入，避免无谓地触发属性更新
+        if props is not None and props.connection_status != status:
+            props.connection_status = status
+
+@persistent
+def reset_connection_status(*args):
+    """
+    打开 .blend 文件后重置其中保存的连接状态 (load_post 处理器)。
+    保存时的状态不代表服务器现在是否可达；服务器池已配置时，下一次定时器调用会写入当前的状态。
+    """
+    for scene in bpy.data.scenes:
+        props = getattr(scene, "bridge_props", None)
+        if props is not None and props.connection_status != 'DISCONNECTED':
+            props.connection_status = 'DISCONNECTED'
+
+def apply_result(image, image_path):
+    """
+    将结果文件加载到图像数据块中。
+    加载后打包进 .blend，使图像不再依赖可能被清理的缓存/临时文件。
+    """
+    if image_path.endswith(shm.SHM_SUFFIX):
+        # 共享内存结果：像素直接写入图像缓冲区，不经过解码
+        shm.read_into_image(image, image_path)
+        image.pack()
+        return
+    if image.packed_file:
+        # 先移除旧的打包数据，否则 reload() 会重新读取打包的旧结果
+        image.unpack(method='REMOVE')
+    image.filepath = image_path
+    image.reload()
+    image.pack()
+
+def _sequence_dir(image_name):
+    """图像序列无法打包进 .blend，因此每个目标图像使用一个长期保留的序列目录。"""
+    return os.path.join(tempfile.gettempdir(), "blender_comfyui_bridge", "sequences", bpy.path.clean_name(image_name))
+
+def apply_sequence(image, image_paths):
+    """将一批结果作为图像序列应用到目标图像 (frame_0001, frame_0002, ...)。"""
+    directory = _sequence_dir(image.name)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+    extension = os.path.splitext(image_paths[0])[1]
+    first_frame = None
+    for index, image_path in enumerate(image_paths, start=1):
+        frame_path = os.path.join(directory, f"frame_{index:04d}{extension}")
+        spool.get_spool().detach(image_path, frame_path)
+        first_frame = first_frame or frame_path
+
+    if image.packed_file:
+        image.unpack(method='REMOVE')
+    image.source = 'SEQUENCE'
+    image.filepath = first_frame
+    image.reload()
+
+def ensure_result_image(name, width=1, height=1):
+    """获取结果图像数据块，不存在时创建一个 (结果返回后会被加载的文件替换)。"""
+    image = bpy.data.images.get(name)
+    if image is None:
+        image = bpy.data.images.new(name, width=max(width, 1), height=max(height, 1))
+        image.source = 'FILE'
+    return image
+
+def _sibling(image, index):
+    """批量结果的第 index 个数据块：0 为目标图像本身，其余为 '名称_001'、'名称_002' 等。"""
+    if index == 0:
+        return image
+    sibling = ensure_result_image(f"{image.name}_{index:03d}")
+    sibling.source = 'FILE'
+    return sibling
+
+def _apply_pixels(image, pixels):
+    """将已解码的 8 位结果像素写入图像数据块并打包进 .blend，与 apply_result 加载同一文件的效果相同。"""
+    height, width = pixels.shape[:2]
+    if image.packed_file:
+        image.unpack(method='REMOVE')
+    image.source = 'GENERATED'
+    image.generated_width = width
+    image.generated_height = height
+    image.use_generated_float = False
+    image.colorspace_settings.name = 'sRGB'
+    image.pixels.foreach_set(tiles._fit_channels(pixels, image.channels).reshape(-1))
+    image.update()
+    image.pack()
+
+def apply_datablocks(image, image_paths):
+    """
+    将一批结果依次应用到目标图像及其编号的兄弟数据块 (名称_001, 名称_002, ...)。
+    安装了 Pillow 时所有结果先在编码线程池中并行解码，主线程只用 foreach_set 写入像素；
+    Pillow 无法处理的结果 (共享内存、16 位和浮点图像) 仍由 Blender 在主线程中加载。
+    """
+    decoding = [
+        None if image_path.endswith(shm.SHM_SUFFIX) else encoding.defer(encoding.decode_image_file, image_path)
+        for image_path in image_paths
+    ]
+    for index, (image_path, decoded) in enumerate(zip(image_paths, decoding)):
+        target = _sibling(image, index)
+        pixels = decoded() if decoded else None
+        if pixels is None:
+            apply_result(target, image_path)
+        else:
+            _apply_pixels(target, pixels)
+
+def _result_pixels(image_path):
+    """读取一个结果文件的像素，返回 (像素数组 (h, w, c), 是否为浮点图像)。"""
+    if image_path.endswith(shm.SHM_SUFFIX):
+        temp = bpy.data.images.new("__bridge_sweep_cell", width=1, height=1, alpha=True, float_buffer=True)
+        try:
+            shm.read_into_image(temp, image_path)
+            return encoding.grab_pixels(temp), True
+        finally:
+            bpy.data.images.remove(temp)
+    temp = bpy.data.images.load(image_path, check_existing=False)
+    try:
+        return encoding.grab_pixels(temp), temp.is_float
+    finally:
+        bpy.data.images.remove(temp)
+
+class ContactSheet:
+    """
+    参数扫描结果拼成的缩略图：每个变体占一个格子，从左上角开始按行排列。
+    每返回一个结果就更新一次图像，全部返回后打包进 .blend。
+    """
+
+    def __init__(self, name, count):
+        self.name = name
+        self.count = count
+        self.columns = math.ceil(math.sqrt(count))
+        self.rows = math.ceil(count / self.columns)
+        self.cell_size = None
+        self.pixels = None
+
+    def add(self, index, image_path):
+        import numpy as np
+
+        cell, is_float = _result_pixels(image_path)
+        if cell is None:
+            return
+        cell_height, cell_width, channels = cell.shape
+        if self.pixels is None:
+            # 格子大小取第一个结果的尺寸
+            self.cell_size = (cell_width, cell_height)
+            self.pixels = np.zeros((cell_height * self.rows, cell_width * self.columns, 4), dtype=np.float32)
+            self.pixels[..., 3] = 1.0
+            self._image(is_float)
+        width, height = self.cell_size
+        cell = cell[:height, :width]
+        row, column = divmod(index, self.columns)
+        # Blender 的像素从左下角开始，第一行格子在图像顶部
+        y = (self.rows - 1 - row) * height
+        x = column * width
+        region = self.pixels[y:y + cell.shape[0], x:x + cell.shape[1]]
+        if channels >= 3:
+            region[..., :channels] = cell[..., :4]
+        else:
+            region[..., :3] = cell[..., :1]
+            if channels == 2:
+                region[..., 3] = cell[..., 1]
+
+        image = self._image(is_float)
+        image.pixels.foreach_set(self.pixels.reshape(-1))
+        image.update()
+
+    def _image(self, is_float):
+        height, width = self.pixels.shape[:2]
+        image = bpy.data.images.get(self.name)
+        if image is None:
+            image = bpy.data.images.new(self.name, width=width, height=height, alpha=True, float_buffer=is_float)
+        elif tuple(image.size) != (width, height):
+            if image.packed_file:
+                image.unpack(method='REMOVE')
+            image.source = 'GENERATED'
+            image.scale(width, height)
+        return image
+
+    def finish(self):
+        image = bpy.data.images.get(self.name)
+        if image is not None and self.pixels is not None:
+            image.pack()
+
+def apply_sweep_results(job, image, image_paths):
+    """
+    应用参数扫描任务返回的结果。服务器按变体顺序逐个 (或成批) 返回结果，
+    每个结果写入对应变体的数据块，或拼入 '目标名_sheet' 缩略图。
+    :return: 所有变体的结果是否都已返回
+    """
+    for image_path in image_paths:
+        index = job.sweep_received
+        if index >= job.sweep_count:
+            log.warning(f"参数扫描任务 {job.id} 返回了多余的结果，已忽略。")
+            break
+        if job.sweep_target == 'CONTACT_SHEET':
+            sheet = _contact_sheets.get(job.id)
+            if sheet is None:
+                sheet = _contact_sheets[job.id] = ContactSheet(f"{image.name}_sheet", job.sweep_count)
+            sheet.add(index, image_path)
+        else:
+            apply_result(_sibling(image, index), image_path)
+        job.sweep_received += 1
+    log.info(f"参数扫描任务 {job.id}: 已返回 {job.sweep_received}/{job.sweep_count} 个变体的结果。")
+
+    if job.sweep_received < job.sweep_count:
+        return False
+    sheet = _contact_sheets.pop(job.id, None)
+    if sheet:
+        sheet.finish()
+    return True
+
+def _tile_pixels(image_path, info):
+    """读取一个分块的像素：原始像素按分块信息还原，图像文件由 Blender 解码。"""
+    if "dtype" in info:
+        with open(image_path, "rb") as f:
+            return tiles.decode_raw(f.read(), info)
+    return _result_pixels(image_path)
+
+def _tile_canvas(key, image, info, is_float):
+    """
+    获取结果的分块缓冲区。第一个分块到达时按完整结果的尺寸准备目标图像，
+    尺寸相同时保留图像原有的像素作为背景，分块到达后逐步覆盖。
+    """
+    width, height = info["image_width"], info["image_height"]
+    canvas = _tile_canvases.get(key)
+    if canvas is not None and canvas.image_name == image.name and (canvas.width, canvas.height) == (width, height):
+        return canvas
+    if tuple(image.size) != (width, height) or not image.has_data or (is_float and not image.is_float):
+        if image.packed_file:
+            image.unpack(method='REMOVE')
+        image.source = 'GENERATED'
+        image.generated_color = (0.0, 0.0, 0.0, 0.0)
+        image.generated_width = width
+        image.generated_height = height
+        image.use_generated_float = is_float
+    pixels = encoding.grab_pixels(image)
+    if pixels is None:
+        log.warning(f"图像 '{image.name}' 没有像素缓冲区，无法写入结果分块。")
+        return None
+    canvas = _tile_canvases[key] = tiles.TileCanvas(image.name, pixels)
+    return canvas
+
+def _flush_canvas(canvas):
+    """将分块缓冲区一次性写入图像的像素缓冲区。"""
+    image = bpy.data.images.get(canvas.image_name)
+    if image is None or tuple(image.size) != (canvas.width, canvas.height):
+        return
+    image.pixels.foreach_set(canvas.pixels.reshape(-1))
+    image.update()
+    canvas.dirty = False
+
+def _apply_tile(job_scheduler, image_path, image_name, job_id, info):
+    """将一个分块写入所属结果的分块缓冲区，返回该缓冲区；分块已过时或无法应用时返回 None。"""
+    job = job_scheduler.get(job_id) if job_id else None
+    if job and not job.is_active:
+        # 完整结果已经应用，或任务已取消
+        return None
+    if job and job.target_image_name:
+        image_name = job.target_image_name
+    if job and job.is_proxy and _latest_full_result.get(image_name, 0) >= job.created_at:
+        return None
+    image = bpy.data.images.get(image_name) if image_name else None
+    if not image:
+        log.warning(f"目标图像 '{image_name}' 在Blender中未找到，丢弃结果分块。")
+        return None
+    if not os.path.exists(image_path):
+        return None
+
+    cell, is_float = _tile_pixels(image_path, info)
+    if cell is None:
+        return None
+    canvas = _tile_canvas(job_id or image.name, image, info, is_float)
+    if canvas is not None:
+        canvas.paste(info, cell)
+    return canvas
+
+def _finish_tiles(job_scheduler, job_id, canvas):
+    """最后一个分块已写入：结果已完整，打包进 .blend 并完成任务，服务器不需要再返回完整结果。"""
+    _flush_canvas(canvas)
+    _tile_canvases.pop(job_id or canvas.image_name, None)
+    image = bpy.data.images.get(canvas.image_name)
+    if image is not None:
+        image.pack()
+    log.info(f"图像 '{canvas.image_name}' 的 {canvas.tiles} 个结果分块已全部返回。")
+    job = job_scheduler.get(job_id) if job_id else None
+    if job:
+        job_scheduler.mark_done(job_id)
+        if not job.is_proxy:
+            supersede_proxies(job_scheduler, canvas.image_name, job.created_at)
+
+def apply_tiles(job_scheduler, budget=_TILE_BUDGET):
+    """
+    将已接收的结果分块写入目标图像，使结果在全部返回之前就逐步显示出来。
+    分块先写入每个结果的缓冲区，每个图像在本次调用结束时只写入一次像素缓冲区，
+    因此同时到达的多个分块只触发一次图像更新。每次调用最多用 budget 秒。
+    :return: 本次写入的分块数量
+    """
+    # 释放已完成或已取消的任务遗留的缓冲区
+    for key in list(_tile_canvases):
+        job = job_scheduler.get(key)
+        if job is not None and not job.is_active:
+            del _tile_canvases[key]
+
+    deadline = time.perf_counter() + budget
+    applied = 0
+    touched = []
+    while time.perf_counter() < deadline:
+        try:
+            image_path, image_name, job_id, info = state.tile_queue.get_nowait()
+        except queue.Empty:
+            break
+        try:
+            canvas = _apply_tile(job_scheduler, image_path, image_name, job_id, info)
+        except Exception as e:
+            log.error(f"应用任务 {job_id} 的结果分块时出错: {e}", exc_info=True)
+            continue
+        finally:
+            spool.get_spool().release(image_path)
+        if canvas is None:
+            continue
+        applied += 1
+        if info["final"]:
+            _finish_tiles(job_scheduler, job_id, canvas)
+            if canvas in touched:
+                touched.remove(canvas)
+        elif canvas not in touched:
+            touched.append(canvas)
+
+    for canvas in touched:
+        _flush_canvas(canvas)
+    if applied:
+        _tag_redraw(('VIEW_3D', 'IMAGE_EDITOR'))
+    return applied
+
+def supersede_proxies(job_scheduler, image_name, created_at):
+    """记录完整分辨率结果，并取消更早提交、尚未返回的代理任务。"""
+    _latest_full_result[image_name] = max(created_at, _latest_full_result.get(image_name, 0))
+    for other in job_scheduler.snapshot():
+        if other.is_proxy and other.is_active and other.target_image_name == image_name and other.created_at < created_at:
+            job_scheduler.cancel(other.id)
+
+# 定时器每 0.5 秒运行一次，只记录真正处理了结果的调用
+@profiling.profiled("process_task_queue", min_duration=0.005)
 def process_task_queue():
     """
     检查任务队列并处理一个项目。
     此函数设计为由 bpy.app.timers 运行。
     """
+    global _last_redraw_versions
+    job_scheduler = scheduler.current_scheduler()
+    if job_scheduler is None:
+        if state.task_queue.empty() and state.tile_queue.empty():
+            return 0.5  # 尚未提交过任务，不为定时器创建调度器和它的线程
+        job_scheduler = scheduler.get_scheduler()
+
+    # 先写入已到达的分块，完整结果随后到达时会替换它们
+    tiles_applied = apply_tiles(job_scheduler)
+
     if not state.task_queue.empty():
+        image_paths = []
         try:
-            # 从队列中获取任务
-            image_path, image_name = state.task_queue.get_nowait()
-            log.info(f"从队列中获取任务: 更新图像 '{image_name}' 使用路径 '{image_path}'")
+            # 从队列中获取任务。一个任务可能携带一批结果图像
+            image_paths, image_name, job_id = state.task_queue.get_nowait()
+            job = job_scheduler.get(job_id) if job_id else None
+            if job_id:
+                _tile_canvases.pop(job_id, None)
+            if job and not job.is_active:
+                # 已取消，或任务转移到其他服务器后原服务器又返回了结果
+                _contact_sheets.pop(job_id, None)
+                log.info(f"任务 {job_id} 已结束 ({job.status})，丢弃其返回结果。")
+                return 0.5
+            if job and job.target_image_name:
+                image_name = job.target_image_name
+            if job and job.is_proxy and _latest_full_result.get(image_name, 0) >= job.created_at:
+                # 更新的完整分辨率结果已经应用，代理结果已经过时
+                log.info(f"代理任务 {job_id} 的结果已过时，不覆盖完整分辨率结果。")
+                job_scheduler.mark_done(job_id)
+                return 0.5
+
+            log.info(f"从队列中获取任务: 更新图像 '{image_name}'，共 {len(image_paths)} 个结果")
             
             # 在主线程安全地更新 Blender 数据
-            image = bpy.data.images.get(image_name)
+            image = bpy.data.images.get(image_name) if image_name else None
             if not image:
                 log.warning(f"目标图像 '{image_name}' 在Blender中未找到。将跳过更新。")
+                if job_id:
+                    job_scheduler.mark_done(job_id, error=f"Image '{image_name}' not found")
                 return 0.5 # 检查间隔
             
+            available_paths = [path for path in image_paths if os.path.exists(path)]
+            if len(available_paths) < len(image_paths):
+                log.warning(f"{len(image_paths) - len(available_paths)} 个结果文件已不存在。")
+            if not available_paths:
+                if job_id:
+                    job_scheduler.mark_done(job_id, error="Result file missing")
+                return 0.5
+
+            if job and job.sweep_count:
+                if not apply_sweep_results(job, image, available_paths):
+                    return 0.5  # 还有变体的结果未返回，任务保持等待状态
+                job_scheduler.mark_done(job_id)
+                supersede_proxies(job_scheduler, image_name, job.created_at)
+                return 0.5
+
             # 更新图像路径并重新加载
-            image.filepath = image_path
-            image.reload()
+            if len(available_paths) == 1:
+                apply_result(image, available_paths[0])
+                if (job and job.cache_key and not available_paths[0].endswith(shm.SHM_SUFFIX)
+                        and job.workflow_hash == job_scheduler.pool.workflow_hash(job.address)):
+                    # 处理任务的服务器的工作流与计算缓存键时相同，结果才能写入缓存
+                    cache.get_result_cache().put(job.cache_key, available_paths[0])
+            elif job and job.batch_target == 'SEQUENCE':
+                apply_sequence(image, available_paths)
+            else:
+                apply_datablocks(image, available_paths)
             
             log.info(f"图像 '{image_name}' 已成功更新。")
+            if job_id:
+                job_scheduler.mark_done(job_id)
+            if job and not job.is_proxy:
+                supersede_proxies(job_scheduler, image_name, job.created_at)
 
         except Exception as e:
             log.error(f"处理任务队列时出错: {e}", exc_info=True)
-    
+        finally:
+            # 结果已打包进 .blend (或被丢弃)，释放暂存文件
+            for image_path in image_paths:
+                spool.get_spool().release(image_path)
+
+    _sync_connection_status(job_scheduler.pool)
+
+    versions = (job_scheduler.version, progress.get_board().version, job_scheduler.pool.version)
+    if versions != _last_redraw_versions:
+        _last_redraw_versions = versions
+        _tag_redraw()
+
+    if tiles_applied or not state.tile_queue.empty():
+        # 分块正在到达时更频繁地运行，使图像逐步更新
+        return 0.1
     return 0.5 # 返回再次运行的间隔时间（秒） 
 
 def unregister_task_queue():
     """清理任务队列，以防插件卸载时有残留任务。"""
     while not state.task_queue.empty():
         try:
-            state.task_queue.get_nowait()
-        except state.task_queue.Empty:
+            image_paths, _, _ = state.task_queue.get_nowait()
+            for image_path in image_paths:
+                spool.get_spool().release(image_path)
+        except queue.Empty:
+            break
+    while not state.tile_queue.empty():
+        try:
+            image_path, _, _, _ = state.tile_queue.get_nowait()
+            spool.get_spool().release(image_path)
+        except queue.Empty:
             break
-    log.info("任务队列已清空。") 
\ No newline at end of file
+    _tile_canvases.clear()
+    log.info("任务队列已清空。") 
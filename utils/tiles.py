@@ -0,0 +1,122 @@
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+# HTTP 返回时携带分块信息的请求头 (JSON)；ZMQ 通道中同样的信息放在消息头的 "tile" 字段
+TILE_HEADER = "X-Bridge-Tile"
+
+_REQUIRED_FIELDS = ("x", "y", "width", "height", "image_width", "image_height")
+_RAW_DTYPES = ("uint8", "float16", "float32")
+
+
+def parse_tile_info(value):
+    """
+    解析并检查分块信息。
+    区域 (x, y, width, height) 以完整图像的左上角为原点；pass 为渐进显示的遍数，
+    较高遍数的像素不会被较低遍数覆盖；final 为 True 的分块表示结果已全部返回。
+    原始像素分块还需要 dtype 和 shape ([高, 宽] 或 [高, 宽, 通道])，行从上到下存储。
+    :param value: JSON 字符串或字典
+    :raises ValueError: 信息不完整或区域超出图像范围
+    """
+    if isinstance(value, (str, bytes)):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"无法解析分块信息: {e}") from None
+    if not isinstance(value, dict):
+        raise ValueError("分块信息必须是一个对象。")
+    try:
+        info = {field: int(value[field]) for field in _REQUIRED_FIELDS}
+        info["pass"] = int(value.get("pass", 0))
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"分块信息缺少或包含无效字段: {e}") from None
+    info["final"] = bool(value.get("final", False))
+
+    if info["image_width"] <= 0 or info["image_height"] <= 0 or info["width"] <= 0 or info["height"] <= 0:
+        raise ValueError("分块和图像的尺寸必须为正数。")
+    if (info["x"] < 0 or info["y"] < 0 or info["x"] + info["width"] > info["image_width"]
+            or info["y"] + info["height"] > info["image_height"]):
+        raise ValueError("分块区域超出图像范围。")
+
+    if value.get("dtype") is not None:
+        if value["dtype"] not in _RAW_DTYPES:
+            raise ValueError(f"不支持的原始像素类型: {value['dtype']}")
+        shape = value.get("shape")
+        if not isinstance(shape, (list, tuple)) or len(shape) not in (2, 3) or not all(int(n) > 0 for n in shape):
+            raise ValueError("原始像素分块需要 shape ([高, 宽] 或 [高, 宽, 通道])。")
+        info["dtype"] = value["dtype"]
+        info["shape"] = [int(n) for n in shape]
+    return info
+
+
+def decode_raw(data, info):
+    """
+    将原始像素分块还原为 (像素数组 (h, w, c)，行从下到上, 是否为浮点数据)，与 encoding.grab_pixels 的布局一致。
+    """
+    import numpy as np
+
+    shape = info["shape"] if len(info["shape"]) == 3 else info["shape"] + [1]
+    pixels = np.frombuffer(data, dtype=np.dtype(info["dtype"]).newbyteorder("<")).reshape(shape)[::-1]
+    if info["dtype"] == "uint8":
+        return pixels.astype(np.float32) / 255.0, False
+    return pixels.astype(np.float32), True
+
+
+def _fit_channels(cell, channels):
+    """将分块的通道映射到图像的通道数 (灰度扩展为 RGB，缺少 Alpha 时为不透明)。"""
+    import numpy as np
+
+    height, width, cell_channels = cell.shape
+    if cell_channels == channels:
+        return cell
+    fitted = np.ones((height, width, channels), dtype=np.float32)
+    if cell_channels >= 3:
+        fitted[..., :min(3, channels)] = cell[..., :min(3, channels)]
+    else:
+        fitted[..., :min(3, channels)] = cell[..., :1]
+    if channels == 4 and cell_channels in (2, 4):
+        fitted[..., 3] = cell[..., -1]
+    return fitted
+
+
+class TileCanvas:
+    """
+    一个正在渐进返回的结果的像素缓冲区 (行从下到上，与 Blender 图像一致)。
+
+    分块只写入此缓冲区，主线程每次定时器调用后用一次 foreach_set 写入图像，
+    不会为每个分块都复制整张图像。低分辨率的渐进遍数会按最近邻放大到所在区域，
+    每个像素记录写入它的遍数，乱序到达的较低遍数不会覆盖已有的较高遍数。
+    """
+
+    def __init__(self, image_name, pixels):
+        import numpy as np
+
+        self.image_name = image_name
+        self.pixels = pixels
+        self.height, self.width, self.channels = pixels.shape
+        self.passes = np.full((self.height, self.width), -1, dtype=np.int32)
+        self.tiles = 0
+        self.dirty = False
+
+    def paste(self, info, cell):
+        """将分块像素 (形状 (h, w, c)，行从下到上) 写入 info 描述的区域。"""
+        import numpy as np
+
+        width, height = info["width"], info["height"]
+        cell_height, cell_width = cell.shape[:2]
+        if (cell_width, cell_height) != (width, height):
+            # 渐进遍数：低分辨率像素放大到整个区域
+            rows = np.arange(height) * cell_height // height
+            columns = np.arange(width) * cell_width // width
+            cell = cell[rows][:, columns]
+        cell = _fit_channels(cell, self.channels)
+
+        # 分块区域以左上角为原点，缓冲区的第一行在底部
+        bottom = self.height - info["y"] - height
+        region = (slice(bottom, bottom + height), slice(info["x"], info["x"] + width))
+        mask = self.passes[region] <= info["pass"]
+        self.pixels[region][mask] = cell[mask]
+        self.passes[region][mask] = info["pass"]
+        self.tiles += 1
+        self.dirty = True
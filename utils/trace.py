@@ -0,0 +1,116 @@
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+# 是否记录通信轨迹 (由 Blender 设置同步)。关闭时被包装的函数只多一次属性检查
+enabled = False
+# 轨迹文件路径，为空时使用临时目录下的 traces 子目录
+output_path = ""
+
+TRACE_VERSION = 1
+
+_lock = threading.Lock()
+_file = None
+_origin = None
+
+
+def configure(enable, path=""):
+    """开始或停止记录。每次开始时新建一个轨迹文件，第一行记录起始时间。"""
+    global enabled, output_path, _file, _origin
+    with _lock:
+        if _file is not None:
+            _file.close()
+            _file = None
+        enabled = False
+        if not enable:
+            return
+        output_path = path or os.path.join(
+            tempfile.gettempdir(), "blender_comfyui_bridge", "traces", f"trace_{time.strftime('%Y%m%d-%H%M%S')}.jsonl"
+        )
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        _file = open(output_path, "a", encoding="utf-8")
+        _origin = time.monotonic()
+        _write({"kind": "start", "version": TRACE_VERSION, "wall": time.time()})
+        enabled = True
+    log.info(f"通信轨迹记录到: {output_path}")
+
+
+def _write(event):
+    _file.write(json.dumps(event, separators=(",", ":"), ensure_ascii=False))
+    _file.write("\n")
+    _file.flush()
+
+
+def now():
+    """轨迹中的时间戳：相对于开始记录时的秒数 (单调时钟)。"""
+    return round(time.monotonic() - (_origin or 0.0), 6)
+
+
+def record(kind, **fields):
+    """写入一条事件。只记录大小、哈希和时间，不记录负载内容。"""
+    if not enabled:
+        return
+    event = {"kind": kind, "t": now(), "thread": threading.current_thread().name}
+    event.update(fields)
+    with _lock:
+        if _file is None:
+            return
+        try:
+            _write(event)
+        except (OSError, ValueError) as e:
+            log.warning(f"写入通信轨迹失败: {e}")
+
+
+def describe_payload(payload):
+    """负载的大小、帧数和内容哈希 (前 16 位)，用于在回放时生成同样大小的数据并识别重复发送。"""
+    if payload is None:
+        return {"size": 0, "frames": 0, "sha": None}
+    frames = payload if isinstance(payload, (list, tuple)) else [payload]
+    digest = hashlib.sha256()
+    for frame in frames:
+        digest.update(frame)
+    return {"size": sum(len(frame) for frame in frames), "frames": len(frames), "sha": digest.hexdigest()[:16]}
+
+
+def describe_metadata(metadata):
+    """去掉回调地址等与环境有关的字段，保留回放需要的元数据。"""
+    return_info = metadata.get("return_info") or {}
+    slim = {key: value for key, value in metadata.items() if key != "return_info"}
+    return {
+        "job_id": return_info.get("job_id"),
+        "return": return_info.get("transport") or ("http" if return_info.get("blender_server_address") else None),
+        "metadata": slim,
+    }
+
+
+def traced_send(via, arguments_of):
+    """
+    装饰器：记录一次发送的元数据、负载大小和哈希、开始时间、耗时和结果。
+    :param via: 发送方式 ("zmq" 为一次请求，"channel" 为长期连接的通道)
+    :param arguments_of: 从调用参数中取出 (地址, 元数据, 负载) 的函数 (args, kwargs) -> tuple
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            address, metadata, payload = arguments_of(args, kwargs)
+            start = now()
+            result = False
+            try:
+                result = func(*args, **kwargs)
+                return result
+            finally:
+                record(
+                    "send", via=via, address=address, start=start, duration=round(now() - start, 6),
+                    ok=bool(result), **describe_payload(payload), **describe_metadata(metadata or {}),
+                )
+        return wrapper
+    return decorator
@@ -27,6 +27,8 @@ class SSHTunnelManager:
         
         self.is_running = False
         self.error = None
+        # 结果通过 ZMQ 同一连接返回时，不需要 ComfyUI -> Blender 的反向隧道
+        self.use_reverse_tunnel = getattr(ssh_settings, "return_mode", 'HTTP') == 'HTTP'
         
         # --- 从Blender属性中提取连接参数 ---
         self.ssh_host = ssh_settings.ssh_host
@@ -68,15 +70,16 @@ class SSHTunnelManager:
         )
 
         # --- 配置远程转发器 (ComfyUI -> Blender) ---
-        self.remote_forwarder = SSHTunnelForwarder(
-            (self.ssh_host, self.ssh_port),
-            ssh_username=self.ssh_user,
-            ssh_password=self.ssh_password,
-            ssh_pkey=self.ssh_key,
-            remote_bind_addresses=[('127.0.0.1', self.local_http_port)],
-            local_bind_addresses=[('127.0.0.1', self.local_http_port)],
-            set_keepalive=10,
-        )
+        if self.use_reverse_tunnel:
+            self.remote_forwarder = SSHTunnelForwarder(
+                (self.ssh_host, self.ssh_port),
+                ssh_username=self.ssh_user,
+                ssh_password=self.ssh_password,
+                ssh_pkey=self.ssh_key,
+                remote_bind_addresses=[('127.0.0.1', self.local_http_port)],
+                local_bind_addresses=[('127.0.0.1', self.local_http_port)],
+                set_keepalive=10,
+            )
 
     def _run_forwarder(self, forwarder, name):
         """
@@ -104,18 +107,19 @@ class SSHTunnelManager:
             log.info(f"[SSH] {name} 转发器线程已停止。")
 
     def start(self):
-        """启动两个隧道转发器，每个都在自己的线程中。"""
+        """启动隧道转发器，每个都在自己的线程中。"""
         if self.is_running or self.error:
             return
             
-        log.info("[SSH] 正在启动双向隧道...")
+        log.info("[SSH] 正在启动双向隧道..." if self.use_reverse_tunnel else "[SSH] 正在启动隧道 (无反向转发)...")
         self.is_running = True # Set state to running before starting threads
 
         self.thread_local = threading.Thread(target=self._run_forwarder, args=(self.local_forwarder, "Local->Remote"), daemon=True)
-        self.thread_remote = threading.Thread(target=self._run_forwarder, args=(self.remote_forwarder, "Remote->Local"), daemon=True)
-        
         self.thread_local.start()
-        self.thread_remote.start()
+
+        if self.use_reverse_tunnel:
+            self.thread_remote = threading.Thread(target=self._run_forwarder, args=(self.remote_forwarder, "Remote->Local"), daemon=True)
+            self.thread_remote.start()
 
     def stop(self):
         """停止所有活动的隧道。"""
@@ -139,11 +143,11 @@ def get_tunnel_manager(ssh_settings=None):
     如果实例不存在，则使用提供的设置创建一个新实例。
     """
     global _tunnel_manager_instance
-        with _tunnel_lock:
-            if _tunnel_manager_instance is None and ssh_settings:
-                log.info("[SSH] 创建新的隧道管理器实例。")
-                _tunnel_manager_instance = SSHTunnelManager(ssh_settings)
-        return _tunnel_manager_instance
+    with _tunnel_lock:
+        if _tunnel_manager_instance is None and ssh_settings:
+            log.info("[SSH] 创建新的隧道管理器实例。")
+            _tunnel_manager_instance = SSHTunnelManager(ssh_settings)
+    return _tunnel_manager_instance
 
 def stop_tunnel():
     """全局函数，用于停止活动的隧道实例。"""
@@ -165,15 +169,16 @@ def get_tunnel_status():
     if not _tunnel_manager_instance.is_running:
         return "INACTIVE", None
 
+    needs_remote = _tunnel_manager_instance.use_reverse_tunnel
     local_ok = _tunnel_manager_instance.local_forwarder and _tunnel_manager_instance.local_forwarder.is_active
-    remote_ok = _tunnel_manager_instance.remote_forwarder and _tunnel_manager_instance.remote_forwarder.is_active
+    remote_ok = not needs_remote or (_tunnel_manager_instance.remote_forwarder and _tunnel_manager_instance.remote_forwarder.is_active)
     
     if local_ok and remote_ok:
         return "ACTIVE", None
     
     # If threads have died without setting an error, report it
     local_thread_alive = _tunnel_manager_instance.thread_local and _tunnel_manager_instance.thread_local.is_alive()
-    remote_thread_alive = _tunnel_manager_instance.thread_remote and _tunnel_manager_instance.thread_remote.is_alive()
+    remote_thread_alive = not needs_remote or (_tunnel_manager_instance.thread_remote and _tunnel_manager_instance.thread_remote.is_alive())
     if not local_thread_alive or not remote_thread_alive:
         _tunnel_manager_instance.error = "一个隧道线程意外终止。"
         return "ERROR", _tunnel_manager_instance.error